@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+from termcolor import cprint
+
+from smc3.analysis import (
+    DEFAULT_CHUNK_ROWS,
+    DEFAULT_SETTLING_BAND,
+    DEFAULT_STEP_THRESHOLD,
+    DEFAULT_STEP_WINDOW,
+    analyze,
+    telemetry_from_capture,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse recorded telemetry")
+    parser.add_argument(
+        "-c",
+        "--capture",
+        action="store_true",
+        help="The file is a wire capture, convert it to FILE.tel first",
+    )
+    parser.add_argument(
+        "-s",
+        "--step",
+        type=int,
+        default=DEFAULT_STEP_THRESHOLD,
+        help="Minimum target change considered a step",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=float,
+        default=DEFAULT_STEP_WINDOW,
+        help="Step response window, seconds",
+    )
+    parser.add_argument(
+        "-b",
+        "--band",
+        type=float,
+        default=DEFAULT_SETTLING_BAND,
+        help="Settling band, fraction of the step",
+    )
+    parser.add_argument(
+        "--chunk", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per chunk"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Print every step response"
+    )
+    parser.add_argument("file", help="Telemetry file recorded by log_positions.py -t")
+    args = parser.parse_args()
+
+    path = args.file
+    if args.capture:
+        path = f"{args.file}.tel"
+        rows = telemetry_from_capture(args.file, path)
+        cprint(f"Converted {rows} rows to {path}", "green")
+
+    def print_steps(motor, responses):
+        for s in responses:
+            print(
+                f"    {motor.name} {s['timestamp']:.3f} {s['start']:3d} -> "
+                f"{s['target']:3d} rise {s['rise_time'] * 1000:6.1f}ms "
+                f"overshoot {s['overshoot']:6.1%} "
+                f"settling {s['settling_time'] * 1000:6.1f}ms"
+            )
+
+    start = time.perf_counter()
+    report = analyze(
+        path,
+        chunk_rows=args.chunk,
+        step_threshold=args.step,
+        step_window=args.window,
+        settling_band=args.band,
+        on_steps=print_steps if args.verbose else None,
+    )
+    elapsed = time.perf_counter() - start
+
+    for motor, r in report.items():
+        cprint(f"Motor {motor.name}: {r.samples} samples, {r.duration:.1f}s", "red")
+        t = r.tracking
+        cprint(
+            f"  tracking error mean {t.mean:.2f} rms {t.rms:.2f} max {t.max}", "cyan"
+        )
+        cprint(f"  pwm saturation {r.saturation:.1%}", "cyan")
+        s = r.steps
+        if s.count:
+            cprint(
+                f"  {s.count} steps, mean rise {s.rise_time * 1000:.0f}ms "
+                f"settling {s.settling_time * 1000:.0f}ms "
+                f"max {s.max_settling_time * 1000:.0f}ms, "
+                f"{s.unsettled} unsettled, max overshoot {s.max_overshoot:.1%}",
+                "cyan",
+            )
+    cprint(f"Analysed in {elapsed:.3f}s", "yellow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import time
+
+from smc3.protocol import (
+    COMMAND_ARG_LIMITS,
+    PARAM_VALUE_COUNT,
+    READ_ONLY_PARAMS,
+    Client,
+    Protocol,
+    Motor,
+    Parameter,
+    format_value,
+    param_to_char,
+    read_command,
+    set_command,
+)
+
+CHUNK_SIZE = 64
+
+
+# The codec before the lookup tables, for comparison: motor and parameter are
+# recomputed from the code byte of every packet and commands are formatted
+def baseline_byte_to_param(byte: int):
+    start = ord("A")
+    if byte >= ord("a"):
+        start = ord("a")
+    motor = Motor((byte - start) % 3 + 1)
+    param = Parameter(chr((byte - start) // 3 * 3 + start))
+    return motor, param
+
+
+def baseline_parse_packet(packet: bytes):
+    motor, param = baseline_byte_to_param(packet[1])
+    if PARAM_VALUE_COUNT.get(param, 1) == 1:
+        return chr(packet[1]), motor, param, int.from_bytes(packet[2:4], "big")
+    return chr(packet[1]), motor, param, packet[2], packet[3]
+
+
+class BaselineParser:
+    def __init__(self, position_cb, pwm_status_cb) -> None:
+        self._buffer = bytes()
+        self._position_cb = position_cb
+        self._pwm_status_cb = pwm_status_cb
+
+    def data_received(self, data: bytes) -> None:
+        self._buffer = self._buffer + data
+        while len(self._buffer) >= 5:
+            _, motor, param, *args = baseline_parse_packet(self._buffer[:5])
+            if param == Parameter.Position:
+                self._position_cb(motor, args[0], args[1])
+            elif param == Parameter.PwmStatus:
+                self._pwm_status_cb(motor, args[0], args[1])
+            self._buffer = self._buffer[5:]
+
+
+def baseline_format_value(code: str, *args) -> bytes:
+    cmd = bytes(f"[{code}", "ascii")
+    if len(args) == 1:
+        return cmd + args[0].to_bytes(2, "big") + b"]"
+    return cmd + args[0].to_bytes() + args[1].to_bytes() + b"]"
+
+
+def baseline_set_command(motor: Motor, param: Parameter, *args) -> bytes:
+    if param in READ_ONLY_PARAMS:
+        raise TypeError(f"Paramenter {param.name} is read-only")
+    limits = COMMAND_ARG_LIMITS.get(param)
+    if len(args) == 2:
+        limits = (0, 255)
+    if limits:
+        for a in args:
+            if a < limits[0] or limits[1] < a:
+                raise ValueError(f"Value {a} out of range {limits}")
+    return baseline_format_value(param_to_char(motor, param), *args)
+
+
+def baseline_read_command(motor: Motor, param: Parameter) -> bytes:
+    return bytes(f"[rd{param_to_char(motor, param)}]", "ascii")
+
+
+class NullTransport(asyncio.Transport):
+    def write(self, data) -> None:
+        pass
+
+
+def telemetry_burst(frames: int) -> bytes:
+    burst = bytearray()
+    for i in range(frames):
+        for m in Motor.__members__.values():
+            burst += format_value(
+                param_to_char(m, Parameter.Position), i % 256, (i + 1) % 256
+            )
+        for m in Motor.__members__.values():
+            burst += format_value(param_to_char(m, Parameter.PwmStatus), 200, 1)
+    return bytes(burst)
+
+
+def bench_parse(frames: int, baseline: bool = False) -> float:
+    loop = asyncio.new_event_loop()
+    if baseline:
+        proto = BaselineParser(lambda *_: None, lambda *_: None)
+    else:
+        client = Client(
+            loop,
+            position_cb=lambda *_: None,
+            pwm_status_cb=lambda *_: None,
+        )
+        proto = Protocol(client)
+        proto.connection_made(NullTransport())
+    burst = telemetry_burst(frames)
+    chunks = [burst[i : i + CHUNK_SIZE] for i in range(0, len(burst), CHUNK_SIZE)]
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        proto.data_received(chunk)
+    elapsed = time.perf_counter() - start
+    loop.close()
+    return frames * 6 / elapsed
+
+
+def bench_set_command(count: int, baseline: bool = False) -> float:
+    encode = baseline_set_command if baseline else set_command
+    motors = list(Motor.__members__.values())
+    start = time.perf_counter()
+    for i in range(count):
+        encode(motors[i % 3], Parameter.Position, i % 1024)
+    return count / (time.perf_counter() - start)
+
+
+def bench_read_command(count: int, baseline: bool = False) -> float:
+    encode = baseline_read_command if baseline else read_command
+    start = time.perf_counter()
+    for _ in range(count):
+        encode(Motor.B, Parameter.Kp)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--frames", type=int, default=20000, help="Telemetry frames to parse"
+    )
+    parser.add_argument(
+        "-c", "--commands", type=int, default=200000, help="Commands to encode"
+    )
+    args = parser.parse_args()
+
+    print(f"{'packets/s':13s}{'baseline':>12s}{'current':>12s}")
+    for name, bench, count in (
+        ("parse", bench_parse, args.frames),
+        ("set_command", bench_set_command, args.commands),
+        ("read_command", bench_read_command, args.commands),
+    ):
+        before = bench(count, baseline=True)
+        after = bench(count)
+        print(f"{name:13s}{before:12,.0f}{after:12,.0f}  x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
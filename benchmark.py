@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+
+from typing import Any, Callable, Dict
+
+from mock_device import MockSerial
+from smc3 import Box, MotorNumber, Parameter
+from smc3.protocol import (
+    DECODE_TABLE,
+    PACKET_LEN,
+    format_value,
+    param_to_char,
+    read_command,
+    set_command,
+)
+from smc3.capture import replay
+from smc3.transport import memory_connection
+
+DEFAULT_THRESHOLD = 0.1
+CHUNK_SIZE = 64
+FEEDBACK_PERIOD = 0.015
+
+Result = Dict[str, Any]
+
+
+class Responder(asyncio.Protocol):
+    """
+    Answers read commands like the box would
+    """
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        for i in range(0, len(data) - PACKET_LEN + 1, PACKET_LEN):
+            if data[i + 1 : i + 3] == b"rd":
+                codec = DECODE_TABLE[data[i + 3]]
+                values = codec.arity == 2 and (1, 2) or (100,)
+                self._transport.write(format_value(codec.code, *values))
+
+
+def memory_box(loop: asyncio.AbstractEventLoop) -> Box:
+    return Box(device="memory", loop=loop, connection=memory_connection(Responder))
+
+
+def mock_device() -> MockSerial:
+    device = MockSerial()
+    for m in MotorNumber.__members__.values():
+        device.stub(
+            name=f"Motor {m.name} Kp",
+            receive_bytes=read_command(m, Parameter.Kp),
+            send_bytes=format_value(param_to_char(m, Parameter.Kp), 100),
+        )
+        device.stub(
+            name=f"Motor {m.name} position command",
+            receive_bytes=set_command(m, Parameter.Position, 512),
+            send_bytes=b"",
+        )
+    device.open()
+    return device
+
+
+def feedback_stream(frames: int) -> list:
+    """
+    [mo1] feedback, one chunk per 15ms frame
+    """
+    chunks = []
+    for i in range(frames):
+        chunk = bytearray()
+        for m in MotorNumber.__members__.values():
+            chunk += format_value(
+                param_to_char(m, Parameter.Position), i % 256, (i + 3) % 256
+            )
+        for m in MotorNumber.__members__.values():
+            chunk += format_value(param_to_char(m, Parameter.PwmStatus), 200, 1)
+        chunks.append(bytes(chunk))
+    return chunks
+
+
+def rate(value: float, unit: str) -> Result:
+    return {"value": value, "unit": unit, "higher_is_better": True}
+
+
+def cost(value: float, unit: str) -> Result:
+    return {"value": value, "unit": unit, "higher_is_better": False}
+
+
+def bench_parse(box: Box, frames: int) -> Result:
+    burst = b"".join(feedback_stream(frames))
+    chunks = [burst[i : i + CHUNK_SIZE] for i in range(0, len(burst), CHUNK_SIZE)]
+    proto = box._transport.get_protocol()
+    start = time.perf_counter()
+    for chunk in chunks:
+        proto.data_received(chunk)
+    return rate(frames * 6 / (time.perf_counter() - start), "packets/s")
+
+
+def bench_feedback_cpu(box: Box, seconds: int) -> Result:
+    chunks = feedback_stream(int(seconds / FEEDBACK_PERIOD))
+    proto = box._transport.get_protocol()
+    start = time.process_time()
+    for chunk in chunks:
+        proto.data_received(chunk)
+    return cost((time.process_time() - start) / seconds * 1000, "cpu ms/s")
+
+
+def bench_replay(box: Box, path: str) -> Result:
+    proto = box._transport.get_protocol()
+    start = time.perf_counter()
+    _, size = replay(path, proto)
+    return rate(size / (time.perf_counter() - start), "bytes/s")
+
+
+def bench_set_position(box: Box, count: int) -> Result:
+    start = time.perf_counter()
+    for i in range(count):
+        box.set_position(MotorNumber.A, 512)
+    return rate(count / (time.perf_counter() - start), "commands/s")
+
+
+def bench_round_trip(box: Box, count: int) -> Dict[str, Result]:
+    async def measure() -> list:
+        res = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await box.read_param_async(MotorNumber.A, Parameter.Kp, refresh=True)
+            res.append((time.perf_counter() - start) * 1000)
+        return res
+
+    samples = sorted(box.loop.run_until_complete(measure()))
+    q = statistics.quantiles(samples, n=100)
+    return {
+        "p50": cost(q[49], "ms"),
+        "p90": cost(q[89], "ms"),
+        "p99": cost(q[98], "ms"),
+    }
+
+
+def run(args) -> Dict[str, Result]:
+    results = {}
+
+    def record(name: str, fn: Callable, *fn_args) -> None:
+        # Best of several runs to filter out scheduling noise
+        res = {}
+        for _ in range(args.repeat):
+            run_res = fn(*fn_args)
+            if "value" in run_res:
+                run_res = {"": run_res}
+            for k, v in run_res.items():
+                best = res.get(k)
+                if (
+                    best is None
+                    or (v["value"] > best["value"]) == v["higher_is_better"]
+                ):
+                    res[k] = v
+        for k, v in res.items():
+            key = k and f"{name}.{k}" or name
+            results[key] = v
+            print(f"{key:32s} {v['value']:14,.3f} {v['unit']}")
+
+    loop = asyncio.new_event_loop()
+    box = memory_box(loop)
+    record("memory.parse", bench_parse, box, args.frames)
+    record("memory.feedback_cpu", bench_feedback_cpu, box, args.seconds)
+    record("memory.set_position", bench_set_position, box, args.commands)
+    record("memory.read_param_rtt", bench_round_trip, box, args.requests)
+    if args.capture:
+        record("memory.replay", bench_replay, box, args.capture)
+
+    if not args.memory_only:
+        device = mock_device()
+        try:
+            box = Box(device=device.port, loop=loop)
+            record("pty.set_position", bench_set_position, box, args.commands // 10)
+            box.delay(0.1)
+            record("pty.read_param_rtt", bench_round_trip, box, args.requests)
+            box.close()
+        finally:
+            device.close()
+    loop.close()
+    return results
+
+
+def compare(
+    baseline: Dict[str, Result], results: Dict[str, Result], threshold: float
+) -> int:
+    regressions = 0
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]["value"]
+        value = res["value"]
+        change = base and (value - base) / base or 0.0
+        worse = res["higher_is_better"] and -change or change
+        flag = ""
+        if worse > threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        print(f"{name:32s} {base:14,.3f} -> {value:14,.3f} {change:+8.1%} {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="smc3 performance benchmarks")
+    parser.add_argument(
+        "-f", "--frames", type=int, default=20000, help="Feedback frames to parse"
+    )
+    parser.add_argument(
+        "-s", "--seconds", type=int, default=60, help="Seconds of [mo1] feedback"
+    )
+    parser.add_argument(
+        "-c", "--commands", type=int, default=100000, help="Position commands"
+    )
+    parser.add_argument(
+        "-r", "--requests", type=int, default=500, help="Read requests for RTT"
+    )
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=3, help="Runs of each benchmark"
+    )
+    parser.add_argument(
+        "-m", "--memory-only", action="store_true", help="Skip pty benchmarks"
+    )
+    parser.add_argument(
+        "-p", "--capture", help="Replay a capture file recorded by log_positions.py"
+    )
+    parser.add_argument("-o", "--output", help="Save results as a JSON baseline")
+    parser.add_argument("-b", "--baseline", help="Compare with a JSON baseline")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Relative change considered a regression",
+    )
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        print()
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
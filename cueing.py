@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+
+from termcolor import cprint
+
+from smc3 import Box, MotorNumber, DEFAULT_BAUDRATE
+from smc3.cueing import ADAPTERS, DEFAULT_PORT, CueingPipeline, TelemetryReceiver
+from smc3.trajectory import MotionLimits
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the rig from game telemetry")
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
+    )
+    parser.add_argument(
+        "-g", "--game", choices=ADAPTERS.keys(), default="forza", help="Packet format"
+    )
+    parser.add_argument(
+        "-l",
+        "--listen",
+        default=f"0.0.0.0:{DEFAULT_PORT}",
+        help="UDP HOST:PORT the game sends telemetry to",
+    )
+    parser.add_argument(
+        "-r", "--rate", type=float, default=100, help="Update rate, Hz (50-1000)"
+    )
+    parser.add_argument(
+        "-s",
+        "--shape",
+        metavar="V,A,J",
+        type=lambda s: MotionLimits(*(float(x) for x in s.split(","))),
+        help="Limit the velocity, acceleration and jerk of the motors, position "
+        "units/s, /s², /s³, e.g. 2000,20000,400000",
+    )
+    parser.add_argument(
+        "-p",
+        "--predict",
+        choices=["A", "B", "C"],
+        help="Lead the positions by the delay estimated from the feedback of a motor",
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
+    args = parser.parse_args()
+
+    box = Box(device=args.device, baudrate=args.baudrate)
+    v = box.get_version()
+    cprint(f"SMC3 Version: {v / 100}", "red")
+    box.enable_motors()
+    if args.predict:
+        box.enable_feedback(MotorNumber.__members__[args.predict])
+
+    host, _, port = args.listen.rpartition(":")
+    receiver = box.loop.run_until_complete(
+        TelemetryReceiver.listen(
+            ADAPTERS[args.game](), host=host or "0.0.0.0", port=int(port)
+        )
+    )
+    pipeline = CueingPipeline(
+        box, receiver, rate=args.rate, limits=args.shape, predict=bool(args.predict)
+    )
+    try:
+        box.loop.run_until_complete(pipeline.run())
+    except KeyboardInterrupt:
+        pipeline.stop()
+        for k, v in pipeline.metrics.as_dict().items():
+            if k != "latency":
+                cprint(f"{k:12s} {v}", "yellow")
+        cprint(f"Latency: {pipeline.metrics.latency}", "yellow")
+        if pipeline.predictor:
+            for k, v in pipeline.predictor.metrics.as_dict().items():
+                cprint(f"{k:16s} {v[args.predict]}", "yellow")
+            box.disable_feedback()
+        box.delay(0.1)
+    finally:
+        pipeline.close()
+        receiver.close()
+        box.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+
+from termcolor import cprint
+
+from smc3 import Box, MotionScheduler, DEFAULT_BAUDRATE, POSITIONS_FRAME_LEN
+from smc3.effects import EffectStream, Noise, Puke, Rock, Sine
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+EFFECTS = {
+    "sine": lambda args: Sine(args.amplitude, args.frequency),
+    "rock": lambda args: Rock(args.amplitude, args.frequency),
+    "sideways": lambda args: Rock(args.amplitude, args.frequency, sideways=True),
+    "puke": lambda args: Puke(args.amplitude, args.frequency),
+    "shake": lambda args: Noise(args.amplitude, args.frequency),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
+    )
+    parser.add_argument(
+        "-r", "--rate", type=float, default=100, help="Update rate, Hz (50-1000)"
+    )
+    parser.add_argument(
+        "-a", "--amplitude", type=float, default=512, help="Effect amplitude"
+    )
+    parser.add_argument(
+        "-f", "--frequency", type=float, default=0.16, help="Effect frequency, Hz"
+    )
+    parser.add_argument("-n", "--noise", type=float, default=0, help="Noise amplitude")
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
+    parser.add_argument("effect", choices=EFFECTS.keys(), help="Effect to play")
+    args = parser.parse_args()
+
+    effect = EFFECTS[args.effect](args)
+    if args.noise:
+        effect = effect + Noise(args.noise, 5.0)
+
+    box = Box(device=args.device, baudrate=args.baudrate)
+    v = box.get_version()
+    cprint(f"SMC3 Version: {v / 100}", "red")
+
+    stream = EffectStream(effect, rate=args.rate)
+    buffer = bytearray(POSITIONS_FRAME_LEN)
+
+    def produce(t: float) -> None:
+        a, b, c = stream.at(t)
+        box.set_positions(a=a, b=b, c=c, buffer=buffer)
+
+    scheduler = MotionScheduler(produce, rate=args.rate, loop=box.loop)
+    try:
+        box.loop.run_until_complete(scheduler.run())
+    except KeyboardInterrupt:
+        scheduler.stop()
+        cprint(f"Lateness: {scheduler.lateness}", "yellow")
+        box.delay(1)
+
+
+if __name__ == "__main__":
+    main()
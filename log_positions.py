@@ -7,6 +7,8 @@ import logging
 from termcolor import colored, cprint
 
 from smc3 import Box, MotorNumber, Parameter, DEFAULT_BAUDRATE
+from smc3.capture import CaptureWriter
+from smc3.telemetry import TelemetryRecorder
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -19,12 +21,44 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "-c", "--capture", help="Record the raw traffic to a binary capture file"
+    )
+    parser.add_argument(
+        "-t", "--telemetry", help="Record the telemetry rows for smc3.analysis"
+    )
+    parser.add_argument(
+        "-r",
+        "--rotate",
+        type=int,
+        default=64,
+        help="Rotate the capture file every N megabytes",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="Don't log the positions"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     parser.add_argument("motor", choices=["A", "B", "C"], help="Motor to monitor")
     args = parser.parse_args()
 
+    capture = None
+    if args.capture:
+        capture = CaptureWriter(args.capture, rotate_size=args.rotate * 1024 * 1024)
+
     loop = asyncio.get_event_loop()
-    box = Box(loop=loop, device=args.device, baudrate=args.baudrate)
+    box = Box(
+        loop=loop,
+        device=args.device,
+        baudrate=args.baudrate,
+        capture=capture,
+        log_telemetry=not args.quiet,
+    )
+    recorder = None
+    if args.telemetry:
+        recorder = TelemetryRecorder(args.telemetry)
+        box.add_listener(recorder)
     v = loop.run_until_complete(box.get_version_async())
     cprint(f"SMC3 Version: {v / 100}", "red")
 
@@ -34,6 +68,13 @@ def main():
     except KeyboardInterrupt:
         box.disable_feedback()
         loop.run_until_complete(asyncio.sleep(1))
+    finally:
+        if recorder:
+            recorder.close()
+            cprint(f"Recorded {recorder.rows} rows to {recorder.path}", "green")
+        if capture:
+            capture.close()
+            cprint(f"Captured {capture.records} records to {capture.path}", "green")
 
 
 if __name__ == "__main__":
@@ -3,11 +3,10 @@
 import argparse
 import logging
 import math
-import time
 
 from termcolor import cprint
 
-from smc3 import Box, MotorNumber, DEFAULT_BAUDRATE
+from smc3 import Box, MotionScheduler, DEFAULT_BAUDRATE, POSITIONS_FRAME_LEN
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,24 +20,33 @@ def main():
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
     parser.add_argument("-s", "--scale", type=float, default=1.0, help="Scale time")
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "-r", "--rate", type=float, default=100, help="Update rate, Hz (50-1000)"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     args = parser.parse_args()
 
     box = Box(device=args.device, baudrate=args.baudrate)
     v = box.get_version()
     cprint(f"SMC3 Version: {v / 100}", "red")
 
+    buffer = bytearray(POSITIONS_FRAME_LEN)
+
+    def produce(t: float) -> None:
+        t = t * args.scale
+        a = int(math.sin(t) * 512) + 512
+        b = int(math.sin(t + math.pi / 3 * 2) * 512) + 512
+        c = int(math.sin(t + math.pi / 3 * 4) * 512) + 512
+        box.set_positions(a=a, b=b, c=c, buffer=buffer)
+
+    scheduler = MotionScheduler(produce, rate=args.rate, loop=box.loop)
     try:
-        while 1:
-            t = time.clock_gettime(time.CLOCK_MONOTONIC) * args.scale
-            a = int(math.sin(t) * 512) + 512
-            b = int(math.sin(t + math.pi / 3 * 2) * 512) + 512
-            c = int(math.sin(t + math.pi / 3 * 4) * 512) + 512
-            box.set_position(MotorNumber.A, a)
-            box.set_position(MotorNumber.B, b)
-            box.set_position(MotorNumber.C, c)
-            box.delay(0.01)
+        box.loop.run_until_complete(scheduler.run())
     except KeyboardInterrupt:
+        scheduler.stop()
+        cprint(f"Lateness: {scheduler.lateness}", "yellow")
         box.delay(1)
 
 
@@ -16,7 +16,9 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     parser.add_argument("param", help="Param (as in protocol)")
     args = parser.parse_args()
 
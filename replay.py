@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import time
+
+from termcolor import cprint
+
+from smc3 import Box, MotorNumber
+from smc3.capture import Replayer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a binary capture")
+    parser.add_argument(
+        "-s",
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to the recording, 0 for max speed",
+    )
+    parser.add_argument(
+        "-l", "--log", action="store_true", help="Log the replayed telemetry"
+    )
+    parser.add_argument("capture", help="Capture file recorded by log_positions.py")
+    args = parser.parse_args()
+
+    replayer = Replayer(args.capture, speed=args.speed)
+    box = Box(device=args.capture, connection=replayer.connect, log_telemetry=args.log)
+    start = time.process_time()
+    elapsed = box.loop.run_until_complete(replayer.wait())
+    cpu = time.process_time() - start
+
+    transport = replayer.transport
+    parser = transport.get_protocol().parser
+    cprint(
+        f"Replayed {transport.records} records, {transport.bytes_in} bytes, "
+        f"{parser.packets} packets in {elapsed:.3f}s, cpu {cpu:.3f}s",
+        "green",
+    )
+    if parser.dropped_bytes:
+        cprint(f"Dropped {parser.dropped_bytes} bytes of garbage", "yellow")
+    for m in MotorNumber.__members__.values():
+        sample = box.telemetry.latest(m)
+        if sample:
+            cprint(f"{m.name}: {len(box.telemetry[m])} samples, last {sample}", "cyan")
+    box.close()
+
+
+if __name__ == "__main__":
+    main()
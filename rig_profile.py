@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+
+from termcolor import cprint
+
+from smc3 import Box, DEFAULT_BAUDRATE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
+    )
+    parser.add_argument(
+        "-s", "--save", action="store_true", help="Save applied settings to the box"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
+    parser.add_argument("action", choices=["dump", "apply"], help="Action")
+    parser.add_argument("file", help="Profile JSON file")
+    args = parser.parse_args()
+
+    box = Box(device=args.device, baudrate=args.baudrate)
+    v = box.get_version()
+    cprint(f"SMC3 Version: {v / 100}", "red")
+
+    if args.action == "dump":
+        with open(args.file, "w") as f:
+            json.dump(box.snapshot(), f, indent=2)
+        cprint(f"Profile saved to {args.file}", "green")
+        return
+
+    with open(args.file) as f:
+        profile = json.load(f)
+    changed = box.apply(profile)
+    for m, p in changed:
+        cprint(f"  {m.name} {p.name}: {profile[m.name][p.name]}", attrs=["bold"])
+    cprint(f"{len(changed)} parameters changed", "green")
+    if changed and args.save:
+        box.save_settings()
+        box.delay(0.1)
+
+
+if __name__ == "__main__":
+    main()
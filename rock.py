@@ -1,14 +1,13 @@
 #!/usr/bin/env python3
 
-import asyncio
 import argparse
 import logging
 import math
-import time
 
 from termcolor import cprint
 
-from smc3 import Box, MotorNumber, DEFAULT_BAUDRATE
+from smc3 import Box, MotionScheduler, DEFAULT_BAUDRATE, POSITIONS_FRAME_LEN
+from smc3.kinematics import two_actuator
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,23 +20,48 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("-s", "--sideways", action="store_true", help="Scale time")
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "-s",
+        "--sideways",
+        action="store_true",
+        help="Pitch, A and B together, instead of roll, A and B opposite",
+    )
+    parser.add_argument(
+        "-a", "--angle", type=float, default=5.0, help="Rocking amplitude, degrees"
+    )
+    parser.add_argument(
+        "-r", "--rate", type=float, default=100, help="Update rate, Hz (50-1000)"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     args = parser.parse_args()
 
     box = Box(device=args.device, baudrate=args.baudrate)
     v = box.get_version()
     cprint(f"SMC3 Version: {v / 100}", "red")
 
+    platform = two_actuator()
+    amplitude = math.radians(args.angle)
+    buffer = bytearray(POSITIONS_FRAME_LEN)
+
+    def produce(t: float) -> None:
+        angle = math.sin(t) * amplitude
+        # Opposite like effects.Rock, together when sideways
+        if args.sideways:
+            a, b = platform.inverse(angle, 0.0)
+        else:
+            a, b = platform.inverse(0.0, angle)
+        box.set_positions(a=a, b=b, buffer=buffer)
+
+    scheduler = MotionScheduler(produce, rate=args.rate, loop=box.loop)
     try:
-        while 1:
-            t = time.clock_gettime(time.CLOCK_MONOTONIC)
-            a = int(math.sin(t) * 512) + 512
-            b = args.sideways and a or 1024 - a
-            box.set_position(MotorNumber.A, a)
-            box.set_position(MotorNumber.B, b)
-            box.delay(0.01)
+        box.loop.run_until_complete(scheduler.run())
     except KeyboardInterrupt:
+        scheduler.stop()
+        cprint(f"Lateness: {scheduler.lateness}", "yellow")
+        if platform.saturated:
+            cprint(f"Saturated: {platform.saturated} positions", "yellow")
         box.delay(1)
 
 
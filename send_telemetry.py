@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import socket
+import time
+
+from termcolor import cprint
+
+from smc3.cueing import ADAPTERS, DEFAULT_PORT, MotionCue
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send synthetic game telemetry to test cueing.py locally"
+    )
+    parser.add_argument(
+        "-g", "--game", choices=ADAPTERS.keys(), default="forza", help="Packet format"
+    )
+    parser.add_argument(
+        "-r", "--rate", type=float, default=60, help="Packets per second"
+    )
+    parser.add_argument(
+        "-a", "--acceleration", type=float, default=4.0, help="Peak acceleration, m/s²"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=0, help="Stop after N seconds"
+    )
+    parser.add_argument(
+        "target", nargs="?", default=f"127.0.0.1:{DEFAULT_PORT}", help="UDP HOST:PORT"
+    )
+    args = parser.parse_args()
+
+    adapter = ADAPTERS[args.game]()
+    host, _, port = args.target.rpartition(":")
+    address = (host or "127.0.0.1", int(port))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    cprint(f"Sending {args.game} telemetry to {address[0]}:{address[1]}", "green")
+    period = 1.0 / args.rate
+    start = deadline = time.monotonic()
+    sent = 0
+    try:
+        while not args.duration or deadline - start < args.duration:
+            t = deadline - start
+            # Braking and accelerating on a slow wave, cornering on a faster one,
+            # with some road roughness
+            cue = MotionCue(
+                t,
+                args.acceleration * math.sin(t * 0.5),
+                args.acceleration * math.sin(t * 1.3),
+                0.5 * args.acceleration * math.sin(t * 17.0) * math.sin(t * 0.7),
+                0.2 * math.cos(t * 1.3),
+                0.1 * math.cos(t * 0.5),
+                0.3 * math.sin(t * 0.2),
+            )
+            sock.sendto(adapter.encode(cue), address)
+            sent += 1
+            deadline += period
+            time.sleep(max(0.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    cprint(f"Sent {sent} packets", "yellow")
+
+
+if __name__ == "__main__":
+    main()
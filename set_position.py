@@ -18,7 +18,9 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     parser.add_argument("motor", choices=["A", "B", "C"], help="Motor to monitor")
     parser.add_argument("position", type=int, help="Target position (0-1024)")
     args = parser.parse_args()
@@ -5,7 +5,7 @@ import logging
 
 from termcolor import colored, cprint
 
-from smc3 import Box, MotorNumber, Parameter, DEFAULT_BAUDRATE
+from smc3 import Box, MotorNumber, Parameter, DEFAULT_BAUDRATE, READ_WINDOW
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,29 +18,45 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=READ_WINDOW,
+        help="Max read requests in flight",
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     args = parser.parse_args()
 
     box = Box(device=args.device, baudrate=args.baudrate)
     v = box.get_version()
     cprint(f"SMC3 Version: {v / 100}", "red")
 
-    for m in MotorNumber.__members__.values():
+    pid_params = [Parameter.Kp, Parameter.Ki, Parameter.Kd, Parameter.Ks]
+    pair_params = [Parameter.MinMax, Parameter.PWMinMax, Parameter.FBDeadZone]
+    params = pid_params + pair_params + [Parameter.Position, Parameter.PwmStatus]
+    motors = list(MotorNumber.__members__.values())
+    keys = [(m, p) for m in motors for p in params]
+    values = dict(zip(keys, box.read_params(keys, window=args.window)))
+
+    for m in motors:
         cprint(f"Motor {m.name}", "cyan", attrs=["bold"])
-        for p in [Parameter.Kp, Parameter.Ki, Parameter.Kd, Parameter.Ks]:
-            v = box.read_param(m, p)
+        for p in pid_params:
+            v = values[(m, p)]
             cprint(f"  {p.name}: {v[0]/100}", attrs=["bold"])
 
-        for p in [Parameter.MinMax, Parameter.PWMinMax, Parameter.FBDeadZone]:
-            v = box.read_param(m, p)
+        for p in pair_params:
+            v = values[(m, p)]
             cprint(f"  {p.name}: {v}", attrs=["bold"])
 
-        v = box.read_param(m, Parameter.Position)
+        v = values[(m, Parameter.Position)]
         cprint(f"  Position", "blue", attrs=["bold"])
         cprint(f"    target:   {v[0]}", "blue", attrs=["bold"])
         cprint(f"    feedback: {v[1]}", "blue", attrs=["bold"])
 
-        v = box.read_param(m, Parameter.PwmStatus)
+        v = values[(m, Parameter.PwmStatus)]
         cprint(f"  pwm:    {v[0]}", "magenta", attrs=["bold"])
         cprint(f"  status: {v[1]}", "red", attrs=["bold"])
 
@@ -15,7 +15,9 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     args = parser.parse_args()
 
     box = Box(device=args.device, baudrate=args.baudrate)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import time
+
+from termcolor import cprint
+
+from smc3 import DEFAULT_BAUDRATE
+from smc3.simulator import PtySimulator
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated SMC3 box on a pty")
+    parser.add_argument(
+        "-b",
+        "--baudrate",
+        type=int,
+        default=DEFAULT_BAUDRATE,
+        help="Simulated UART baud rate, 0 to disable throttling",
+    )
+    parser.add_argument(
+        "-l", "--latency", type=float, default=0.0, help="Link latency, seconds"
+    )
+    parser.add_argument(
+        "-n", "--noise", type=float, default=0.0, help="Feedback noise, std dev"
+    )
+    parser.add_argument(
+        "-s", "--speed", type=float, default=2000.0, help="Motor speed at full PWM"
+    )
+    args = parser.parse_args()
+
+    device = PtySimulator(
+        baudrate=args.baudrate,
+        latency=args.latency,
+        noise=args.noise,
+        max_speed=args.speed,
+    )
+    device.open()
+    cprint(f"Simulated box on {device.port}", "green")
+    try:
+        while 1:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,10 @@
 import argparse
 import logging
 import math
-import time
 
 from termcolor import cprint
 
-from smc3 import Box, MotorNumber, DEFAULT_BAUDRATE
+from smc3 import Box, MotionScheduler, MotorNumber, DEFAULT_BAUDRATE
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,7 +19,12 @@ def main():
     parser.add_argument(
         "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
     )
-    parser.add_argument("device", help="USB device")
+    parser.add_argument(
+        "-r", "--rate", type=float, default=100, help="Update rate, Hz (50-1000)"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
     parser.add_argument("motor", choices=["A", "B", "C"], help="Motor to monitor")
     args = parser.parse_args()
 
@@ -30,12 +34,17 @@ def main():
 
     motor = MotorNumber.__members__[args.motor]
     box.enable_feedback(motor)
+
+    def produce(t: float) -> None:
+        v = int(math.sin(t) * 512) + 512
+        box.set_position(motor, v)
+
+    scheduler = MotionScheduler(produce, rate=args.rate, loop=box.loop)
     try:
-        while 1:
-            v = int(math.sin(time.clock_gettime(time.CLOCK_MONOTONIC)) * 512) + 512
-            box.set_position(motor, v)
-            box.delay(0.01)
+        box.loop.run_until_complete(scheduler.run())
     except KeyboardInterrupt:
+        scheduler.stop()
+        cprint(f"Lateness: {scheduler.lateness}", "yellow")
         box.disable_feedback()
         box.delay(1)
 
@@ -1,2 +1,12 @@
 from .box import Box
-from .protocol import Motor as MotorNumber, Parameter, DEFAULT_BAUDRATE
+from .protocol import (
+    Motor as MotorNumber,
+    Parameter,
+    Priority,
+    DEFAULT_BAUDRATE,
+    READ_WINDOW,
+    POSITIONS_FRAME_LEN,
+)
+from .scheduler import MotionScheduler, OverrunPolicy
+from .telemetry import Subscription, Telemetry, TelemetryKind, TelemetrySample
+from .rig import Rig
@@ -0,0 +1,474 @@
+"""
+Offline analysis of recorded telemetry.
+
+Telemetry files written by `smc3.telemetry.TelemetryRecorder` (or converted from
+a wire capture with `telemetry_from_capture`) are memory-mapped as NumPy
+structured arrays and processed in chunks of `chunk_rows` rows, so memory use
+doesn't depend on the length of the recording.
+
+    report = analyze("session.tel")
+    for motor, r in report.items():
+        print(motor.name, r.tracking.rms, r.saturation, r.steps.count)
+
+Step responses are computed for all the steps of a chunk at once, only the rows
+of the last response window carry over to the next chunk.
+"""
+
+import os
+
+import numpy as np
+
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple, Union
+
+from .capture import Direction, read_capture
+from .protocol import DECODE_TABLE, FrameParser, Motor, Parameter
+from .telemetry import (
+    TELEMETRY_MAGIC,
+    TELEMETRY_RECORD,
+    TelemetryRecorder,
+    TelemetrySample,
+)
+
+TELEMETRY_DTYPE = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("motor", "u1"),
+        ("target", "<u2"),
+        ("feedback", "<u2"),
+        ("pwm", "<u2"),
+        ("status", "<u2"),
+    ]
+)
+if TELEMETRY_DTYPE.itemsize != TELEMETRY_RECORD.size:
+    raise RuntimeError(
+        f"Telemetry dtype of {TELEMETRY_DTYPE.itemsize} bytes doesn't match "
+        f"the {TELEMETRY_RECORD.size} bytes record"
+    )
+
+STEP_DTYPE = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("start", "<i4"),
+        ("target", "<i4"),
+        ("rise_time", "<f8"),
+        ("overshoot", "<f8"),
+        ("settling_time", "<f8"),
+    ]
+)
+
+DEFAULT_CHUNK_ROWS = 1 << 20
+# Minimum target change considered a step
+DEFAULT_STEP_THRESHOLD = 10
+# Settled once the feedback stays within this fraction of the step size
+DEFAULT_SETTLING_BAND = 0.05
+# Longest response analysed after a step, seconds
+DEFAULT_STEP_WINDOW = 2.0
+PWM_MAX = 255
+
+
+class TrackingError(NamedTuple):
+    """
+    Statistics of |target - feedback|
+    """
+
+    count: int
+    mean: float
+    rms: float
+    max: int
+
+
+class StepResponse(NamedTuple):
+    """
+    Response to a target step at `timestamp`, times in seconds relative to the step,
+    overshoot as a fraction of the step size. Metrics that couldn't be determined
+    within the response window are NaN.
+    """
+
+    timestamp: float
+    start: int
+    target: int
+    rise_time: float
+    overshoot: float
+    settling_time: float
+
+
+class StepStats(NamedTuple):
+    """
+    Aggregates of the step responses of a motor. Means are taken over the steps
+    where the metric could be determined, `unsettled` steps didn't settle within
+    their response window.
+    """
+
+    count: int
+    rise_time: float
+    overshoot: float
+    max_overshoot: float
+    settling_time: float
+    max_settling_time: float
+    unsettled: int
+
+
+class MotorReport(NamedTuple):
+    motor: Motor
+    samples: int
+    duration: float
+    tracking: TrackingError
+    saturation: float
+    steps: StepStats
+
+
+def load(path: str) -> np.ndarray:
+    """
+    Memory-map a telemetry file, an incomplete trailing record is ignored
+    """
+    with open(path, "rb") as f:
+        if f.read(len(TELEMETRY_MAGIC)) != TELEMETRY_MAGIC:
+            raise ValueError(f"{path} is not an SMC3 telemetry file")
+    rows = (os.path.getsize(path) - len(TELEMETRY_MAGIC)) // TELEMETRY_DTYPE.itemsize
+    if not rows:
+        return np.empty(0, dtype=TELEMETRY_DTYPE)
+    return np.memmap(
+        path,
+        dtype=TELEMETRY_DTYPE,
+        mode="r",
+        offset=len(TELEMETRY_MAGIC),
+        shape=(rows,),
+    )
+
+
+def chunks(
+    data: np.ndarray, chunk_rows: int = DEFAULT_CHUNK_ROWS
+) -> Iterator[np.ndarray]:
+    for start in range(0, len(data), chunk_rows):
+        yield data[start : start + chunk_rows]
+
+
+def tracking_error(target: np.ndarray, feedback: np.ndarray) -> TrackingError:
+    err = np.abs(target.astype(np.int32) - feedback.astype(np.int32))
+    if not len(err):
+        return TrackingError(0, 0.0, 0.0, 0)
+    return TrackingError(
+        len(err),
+        float(err.mean()),
+        float(np.sqrt(np.mean(np.square(err, dtype=np.float64)))),
+        int(err.max()),
+    )
+
+
+def pwm_saturation(pwm: np.ndarray, pwm_max: int = PWM_MAX) -> float:
+    """
+    Fraction of the samples with the pwm at the limit
+    """
+    if not len(pwm):
+        return 0.0
+    return float(np.count_nonzero(pwm >= pwm_max)) / len(pwm)
+
+
+def step_response(
+    timestamp: np.ndarray,
+    target: np.ndarray,
+    feedback: np.ndarray,
+    settling_band: float = DEFAULT_SETTLING_BAND,
+) -> StepResponse:
+    """
+    Metrics of the response to the step at the first row, which holds
+    the new target. Rise time is measured between 10% and 90% of the step.
+    """
+    t0 = float(timestamp[0])
+    start = int(feedback[0])
+    final = int(target[0])
+    delta = final - start
+    if not delta:
+        return StepResponse(t0, start, final, 0.0, 0.0, 0.0)
+    progress = (feedback.astype(np.float64) - start) / delta
+    t = timestamp - t0
+
+    above10 = np.flatnonzero(progress >= 0.1)
+    above90 = np.flatnonzero(progress >= 0.9)
+    rise = np.nan
+    if len(above10) and len(above90):
+        rise = float(t[above90[0]] - t[above10[0]])
+    overshoot = max(0.0, float(progress.max()) - 1.0)
+
+    outside = np.flatnonzero(np.abs(progress - 1.0) > settling_band)
+    if not len(outside):
+        settling = 0.0
+    elif outside[-1] + 1 < len(t):
+        settling = float(t[outside[-1] + 1])
+    else:
+        settling = np.nan
+    return StepResponse(t0, start, final, rise, overshoot, settling)
+
+
+def step_responses(
+    timestamp: np.ndarray,
+    target: np.ndarray,
+    feedback: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    settling_band: float = DEFAULT_SETTLING_BAND,
+) -> np.ndarray:
+    """
+    `step_response` of the rows starts[i]:ends[i] of every step i at once, as
+    a STEP_DTYPE array. The windows must be sorted and must not overlap,
+    the ones shorter than two rows are skipped.
+    """
+    keep = ends - starts > 1
+    starts = starts[keep]
+    lengths = ends[keep] - starts
+    n = len(starts)
+    out = np.empty(n, dtype=STEP_DTYPE)
+    if not n:
+        return out
+
+    # The windows are gathered back to back, offsets[i] is where window i starts
+    offsets = np.zeros(n, dtype=np.intp)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    total = int(offsets[-1] + lengths[-1])
+    window = np.repeat(np.arange(n), lengths)
+    rows = np.repeat(starts - offsets, lengths) + np.arange(total)
+
+    t0 = timestamp[starts]
+    start = feedback[starts].astype(np.float64)
+    final = target[starts].astype(np.float64)
+    delta = final - start
+    flat = delta == 0
+    delta[flat] = 1.0
+    progress = (feedback[rows] - start[window]) / delta[window]
+    t = timestamp[rows] - t0[window]
+    index = np.arange(total)
+
+    first10 = np.minimum.reduceat(np.where(progress >= 0.1, index, total), offsets)
+    first90 = np.minimum.reduceat(np.where(progress >= 0.9, index, total), offsets)
+    rise = np.full(n, np.nan)
+    risen = (first10 < total) & (first90 < total)
+    rise[risen] = t[first90[risen]] - t[first10[risen]]
+
+    overshoot = np.maximum(np.maximum.reduceat(progress, offsets) - 1.0, 0.0)
+
+    outside = np.abs(progress - 1.0) > settling_band
+    last = np.maximum.reduceat(np.where(outside, index, -1), offsets)
+    settling = np.where(last < 0, 0.0, np.nan)
+    settled = (0 <= last) & (last + 1 < offsets + lengths)
+    settling[settled] = t[last[settled] + 1]
+
+    rise[flat] = overshoot[flat] = settling[flat] = 0.0
+    out["timestamp"] = t0
+    out["start"] = start
+    out["target"] = final
+    out["rise_time"] = rise
+    out["overshoot"] = overshoot
+    out["settling_time"] = settling
+    return out
+
+
+class _Accumulator:
+    def __init__(
+        self,
+        step_threshold: int,
+        step_window: float,
+        settling_band: float,
+        pwm_max: int,
+        on_steps: Optional[Callable[[np.ndarray], None]],
+    ) -> None:
+        self.step_threshold = step_threshold
+        self.step_window = step_window
+        self.settling_band = settling_band
+        self.pwm_max = pwm_max
+        self.on_steps = on_steps
+        self.count = 0
+        self.sum_abs = 0
+        self.sum_sq = 0.0
+        self.max = 0
+        self.saturated = 0
+        self.first = np.nan
+        self.last = np.nan
+        self.last_target = None
+        # Rows from the last step on, its window may go on in the next chunk
+        self.tail: Optional[Tuple[np.ndarray, ...]] = None
+        self.steps = 0
+        self.rise_sum = 0.0
+        self.rise_count = 0
+        self.overshoot_sum = 0.0
+        self.max_overshoot = 0.0
+        self.settling_sum = 0.0
+        self.settling_count = 0
+        self.max_settling = np.nan
+
+    def add(self, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+        target = rows["target"].astype(np.int32)
+        err = np.abs(target - rows["feedback"])
+        self.count += len(err)
+        self.sum_abs += int(err.sum())
+        self.sum_sq += float(np.square(err, dtype=np.float64).sum())
+        self.max = max(self.max, int(err.max()))
+        self.saturated += int(np.count_nonzero(rows["pwm"] >= self.pwm_max))
+        if self.count == len(err):
+            self.first = float(rows["timestamp"][0])
+        self.last = float(rows["timestamp"][-1])
+
+        # Steps are found on the target difference, carrying the last target over
+        # the chunk boundary
+        prev = np.empty_like(target)
+        prev[1:] = target[:-1]
+        prev[0] = target[0] if self.last_target is None else self.last_target
+        step = np.abs(target - prev) >= self.step_threshold
+        self.last_target = int(target[-1])
+
+        columns = (rows["timestamp"], target, rows["feedback"], step)
+        if self.tail is not None:
+            columns = tuple(map(np.concatenate, zip(self.tail, columns)))
+        self._steps(*columns, final=False)
+
+    def finish(self) -> None:
+        if self.tail is not None:
+            self._steps(*self.tail, final=True)
+
+    def _steps(
+        self,
+        timestamp: np.ndarray,
+        target: np.ndarray,
+        feedback: np.ndarray,
+        step: np.ndarray,
+        final: bool,
+    ) -> None:
+        self.tail = None
+        starts = np.flatnonzero(step)
+        if not len(starts):
+            return
+        # A response lasts until the next step, at most step_window
+        bounds = timestamp[starts] + self.step_window
+        np.minimum(bounds[:-1], timestamp[starts[1:]], out=bounds[:-1])
+        ends = np.searchsorted(timestamp, bounds)
+        if not final and ends[-1] == len(timestamp):
+            last = starts[-1]
+            self.tail = (
+                timestamp[last:],
+                target[last:],
+                feedback[last:],
+                step[last:],
+            )
+            starts = starts[:-1]
+            ends = ends[:-1]
+        responses = step_responses(
+            timestamp, target, feedback, starts, ends, self.settling_band
+        )
+        if not len(responses):
+            return
+        if self.on_steps is not None:
+            self.on_steps(responses)
+        self.steps += len(responses)
+        rise = responses["rise_time"]
+        risen = ~np.isnan(rise)
+        self.rise_sum += float(rise[risen].sum())
+        self.rise_count += int(np.count_nonzero(risen))
+        overshoot = responses["overshoot"]
+        self.overshoot_sum += float(overshoot.sum())
+        self.max_overshoot = max(self.max_overshoot, float(overshoot.max()))
+        settling = responses["settling_time"]
+        settled = settling[~np.isnan(settling)]
+        if len(settled):
+            self.settling_sum += float(settled.sum())
+            self.settling_count += len(settled)
+            self.max_settling = np.fmax(self.max_settling, float(settled.max()))
+
+    def tracking(self) -> TrackingError:
+        if not self.count:
+            return TrackingError(0, 0.0, 0.0, 0)
+        return TrackingError(
+            self.count,
+            self.sum_abs / self.count,
+            float(np.sqrt(self.sum_sq / self.count)),
+            self.max,
+        )
+
+    def step_stats(self) -> StepStats:
+        return StepStats(
+            self.steps,
+            self.rise_sum / self.rise_count if self.rise_count else np.nan,
+            self.overshoot_sum / self.steps if self.steps else np.nan,
+            self.max_overshoot,
+            self.settling_sum / self.settling_count if self.settling_count else np.nan,
+            float(self.max_settling),
+            self.steps - self.settling_count,
+        )
+
+
+def analyze(
+    data: Union[str, np.ndarray],
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    step_threshold: int = DEFAULT_STEP_THRESHOLD,
+    step_window: float = DEFAULT_STEP_WINDOW,
+    settling_band: float = DEFAULT_SETTLING_BAND,
+    pwm_max: int = PWM_MAX,
+    on_steps: Callable[[Motor, np.ndarray], None] = None,
+) -> Dict[Motor, MotorReport]:
+    """
+    Tracking error, pwm saturation and step response statistics of every motor
+    present in a telemetry file or array. A step response lasts until the next
+    step of the motor, at most `step_window` seconds. The responses themselves
+    are passed to `on_steps` as STEP_DTYPE arrays, as they are completed.
+    """
+    if isinstance(data, str):
+        data = load(data)
+    acc = {}
+    for m in Motor:
+        callback = None
+        if on_steps is not None:
+            callback = lambda responses, m=m: on_steps(m, responses)
+        acc[m] = _Accumulator(
+            step_threshold, step_window, settling_band, pwm_max, callback
+        )
+    for chunk in chunks(data, chunk_rows):
+        motor = chunk["motor"]
+        for m, a in acc.items():
+            a.add(chunk[motor == m.value])
+
+    report = {}
+    for m, a in acc.items():
+        if not a.count:
+            continue
+        a.finish()
+        report[m] = MotorReport(
+            m,
+            a.count,
+            a.last - a.first,
+            a.tracking(),
+            a.saturated / a.count,
+            a.step_stats(),
+        )
+    return report
+
+
+def telemetry_from_capture(capture: str, path: str) -> int:
+    """
+    Convert the feedback packets of a wire capture from `smc3.capture`
+    to a telemetry file, returns the number of rows written
+    """
+    positions = {}
+    timestamp = 0.0
+
+    def packet_received(packet: memoryview) -> None:
+        codec = DECODE_TABLE[packet[1]]
+        if codec is None:
+            return
+        if codec.param is Parameter.Position:
+            positions[codec.motor] = codec.decode(packet)
+        elif codec.param is Parameter.PwmStatus:
+            target, feedback = positions.get(codec.motor, (0, 0))
+            recorder.add(
+                TelemetrySample(
+                    timestamp, codec.motor, target, feedback, *codec.decode(packet)
+                )
+            )
+
+    parser = FrameParser(packet_received)
+    with TelemetryRecorder(path) as recorder:
+        for record in read_capture(capture):
+            if record.direction == Direction.Inbound:
+                timestamp = record.timestamp
+                parser.feed(record.data)
+        return recorder.rows
@@ -1,12 +1,53 @@
 import asyncio
-import serial_asyncio
+import datetime
 import logging
+import threading
+import time
 
-from typing import Any, List
-from serial import EIGHTBITS, PARITY_NONE, STOPBITS_ONE
+from typing import (
+    Any,
+    Coroutine,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
+from .capture import CaptureWriter, capture_connection
 from .loggable import Loggable
-from .protocol import Client, Protocol, Motor, Parameter, set_command, DEFAULT_BAUDRATE
+from .metrics import LinkMetrics
+from .transport import ConnectionFactory, connection_for
+from .telemetry import (
+    Listener,
+    Subscription,
+    Telemetry,
+    TelemetryHub,
+    TelemetryKind,
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_TELEMETRY_CAPACITY,
+)
+from .protocol import (
+    Client,
+    Protocol,
+    Motor,
+    Parameter,
+    Priority,
+    param_to_char,
+    read_command,
+    set_command,
+    pack_positions,
+    DEFAULT_BAUDRATE,
+    DEFAULT_TIMEOUT,
+    POSITION_BYTES,
+    POSITIONS_FRAME_LEN,
+)
+
+# First delay between reconnect attempts in seconds, doubled after every failure
+DEFAULT_RECONNECT_DELAY = 0.05
+MAX_RECONNECT_DELAY = 2.0
 
 
 class MotorStatus:
@@ -47,6 +88,19 @@ Output Type - Binary
 """
 
 
+CONFIG_PARAMS = [
+    Parameter.Kp,
+    Parameter.Ki,
+    Parameter.Kd,
+    Parameter.Ks,
+    Parameter.MinMax,
+    Parameter.PWMinMax,
+    Parameter.FBDeadZone,
+]
+
+Profile = Dict[str, Dict[str, List[int]]]
+
+
 class Box(Loggable):
     """
     Class representing the Simulator Motor Control box
@@ -55,18 +109,67 @@ class Box(Loggable):
     _loop: asyncio.AbstractEventLoop
     _client: Client
     _motors: List[MotorStatus]
+    _telemetry: Telemetry
+    _hub: TelemetryHub
+    _params: Dict[Tuple[Motor, Parameter], Tuple[int, ...]]
+    _unsaved: Set[Tuple[Motor, Parameter]]
+    _thread: threading.Thread
 
     def __init__(
         self,
         *,
-        device: str,
+        device: str = None,
         loop: asyncio.AbstractEventLoop = None,
         baudrate: int = DEFAULT_BAUDRATE,
+        connection: ConnectionFactory = None,
+        capture: CaptureWriter = None,
+        telemetry_capacity: int = DEFAULT_TELEMETRY_CAPACITY,
+        log_telemetry: bool = False,
+        threaded: bool = False,
+        connect: bool = True,
+        reconnect: bool = True,
+        reconnect_delay: float = DEFAULT_RECONNECT_DELAY,
+        max_reconnect_delay: float = MAX_RECONNECT_DELAY,
     ) -> None:
+        """
+        With `threaded` set the box runs its own event loop on a dedicated thread,
+        telemetry is processed as it arrives and the synchronous methods can be
+        called from any thread.
+        Without `connect` the device is not opened until `connect`/`connect_async`
+        is called, see also `Box.open`.
+        The box is reached through `connection`, a factory from `smc3.transport`,
+        by default chosen by the device name: a serial device, tcp://host:port,
+        unix:///path or sim://.
+        With a `capture` writer from `smc3.capture` all the traffic is recorded.
+
+        With `reconnect` a lost connection is reopened, first right away, then
+        after `reconnect_delay` doubled on each failure up to `max_reconnect_delay`.
+        Pending requests fail with ConnectionError, commands sent meanwhile are
+        held. Once the box answers again the enabled motors, last positions and
+        feedback mode are restored and the parameter cache is dropped, as
+        the box may have been reset.
+        """
         super().__init__()
         self.set_logger(logging.getLogger("BOX"))
+        self.log_telemetry = log_telemetry
 
-        if not loop:
+        if connection is None:
+            if not device:
+                raise TypeError("Either device or connection is required")
+            connection = connection_for(device, baudrate)
+        if capture is not None:
+            connection = capture_connection(connection, capture)
+
+        self._thread = None
+        if threaded:
+            if loop:
+                raise ValueError("A threaded box runs its own event loop")
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=loop.run_forever, name="smc3-box", daemon=True
+            )
+            self._thread.start()
+        elif not loop:
             loop = asyncio.get_event_loop()
 
         self._loop = loop
@@ -74,77 +177,503 @@ class Box(Loggable):
             loop,
             position_cb=self._position_received,
             pwm_status_cb=self._pwm_status_received,
+            connection_lost_cb=self._connection_lost,
         )
         self._motors = [
             MotorStatus(Motor.A),
             MotorStatus(Motor.B),
             MotorStatus(Motor.C),
         ]
+        self._telemetry = Telemetry(telemetry_capacity)
+        self._hub = TelemetryHub(loop)
+        self._params = {}
+        self._unsaved = set()
+        self._device = device
+        self._connection = connection
+        self._transport = None
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._closing = False
+        self._reconnect_task: asyncio.Task = None
+        # State restored after a reconnect
+        self._positions: List[Optional[int]] = [None] * len(Motor)
+        self._enabled: Set[Motor] = set()
+        self._feedback_mode = 0
+        if connect:
+            self.connect()
+
+    @classmethod
+    async def open(
+        cls, *, device: str = None, loop: asyncio.AbstractEventLoop = None, **kwargs
+    ) -> "Box":
+        """
+        Create a box and open the device without blocking the running loop
+        """
+        box = cls(
+            device=device,
+            loop=loop or asyncio.get_running_loop(),
+            connect=False,
+            **kwargs,
+        )
+        await box.connect_async()
+        return box
+
+    async def connect_async(self) -> None:
+        await self._open_connection()
+        self._client.flush()
+
+    async def _open_connection(self) -> None:
         proto = Protocol(self._client)
-        _, _ = loop.run_until_complete(
-            serial_asyncio.create_serial_connection(
-                loop,
-                lambda: proto,
-                device,
-                baudrate=baudrate,
-                bytesize=EIGHTBITS,
-                parity=PARITY_NONE,
-                stopbits=STOPBITS_ONE,
+        self._transport, _ = await self._connection(self._loop, lambda: proto)
+
+    def connect(self) -> None:
+        self._run(self.connect_async())
+
+    @property
+    def connected(self) -> bool:
+        return self._client.connected
+
+    def _connection_lost(self, exc: Optional[Exception]) -> None:
+        self._transport = None
+        if self._closing or not self.reconnect:
+            self._client.discard(ConnectionError("Connection to the box closed"))
+            return
+        if self._reconnect_task is None:
+            self.log_warning(f"Connection to {self._device} lost: {exc!r}")
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        start = self._loop.time()
+        delay = self.reconnect_delay
+        attempt = 0
+        try:
+            while not self._closing:
+                attempt += 1
+                try:
+                    await self._open_connection()
+                    await self._restore()
+                except Exception as e:
+                    self.log_warning(f"Reconnect attempt {attempt} failed: {e!r}")
+                    if self._transport is not None:
+                        self._transport.close()
+                        self._transport = None
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+                    continue
+                self._client.metrics.reconnects += 1
+                self.log_info(
+                    f"Reconnected to {self._device} in "
+                    f"{(self._loop.time() - start) * 1000:.0f}ms, attempt {attempt}"
+                )
+                return
+        finally:
+            self._reconnect_task = None
+
+    async def _restore(self) -> None:
+        """
+        Wait for the box to answer, then restore the enabled motors, the positions
+        and the feedback mode ahead of the commands held meanwhile
+        """
+        client = self._client
+        fut = client.expect_packet("v")
+        client.send_ahead(b"[ver]")
+        await client.wait_packet("v", fut, timeout=DEFAULT_TIMEOUT)
+        self.invalidate_params()
+
+        # Enable before moving, like the Safety class of the held commands
+        if len(self._enabled) == len(Motor):
+            cmd = b"[ena]"
+        else:
+            cmd = b"".join(
+                bytes(f"[en{motor.value}]", "ascii")
+                for motor in sorted(self._enabled, key=lambda m: m.value)
             )
-        )
+        buffer = bytearray(POSITIONS_FRAME_LEN)
+        cmd += bytes(buffer[: pack_positions(buffer, self._positions)])
+        if self._feedback_mode:
+            cmd += bytes(f"[mo{self._feedback_mode}]", "ascii")
+        if cmd:
+            client.send_ahead(cmd)
+        client.flush()
+
+    def track_command(self, packet: bytes) -> None:
+        """
+        Remember the state changed by a command packet written with
+        `send_frame`, positions, enabled motors and the feedback mode,
+        to be restored after a reconnect
+        """
+        kind = packet[1]
+        if kind in POSITION_BYTES:
+            self._positions[POSITION_BYTES.index(kind)] = (packet[2] << 8) | packet[3]
+        elif packet[1:4] == b"ena":
+            self._enabled.update(Motor)
+        elif packet[1:3] == b"en" and 0x31 <= packet[3] <= 0x33:
+            self._enabled.add(Motor(packet[3] - 0x30))
+        elif packet[1:3] == b"mo" and 0x30 <= packet[3] <= 0x33:
+            self._feedback_mode = packet[3] - 0x30
+
+    @property
+    def device(self) -> str:
+        return self._device
 
     @property
     def loop(self) -> asyncio.AbstractEventLoop:
         return self._loop
 
+    @property
+    def threaded(self) -> bool:
+        return self._thread is not None
+
+    def close(self) -> None:
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+        else:
+            self._close()
+
+    def _close(self) -> None:
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._transport is not None:
+            self._transport.close()
+
+    def _run(self, coro: Coroutine) -> Any:
+        if self._thread:
+            return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+        return self._loop.run_until_complete(coro)
+
+    def _send(self, cmd: bytes, priority: Priority = None) -> None:
+        if self._thread:
+            self._loop.call_soon_threadsafe(self._client.send_command, cmd, priority)
+        else:
+            self._client.send_command(cmd, priority)
+
+    def send_frame(self, frame: bytes, priority: Priority = None) -> None:
+        """
+        Write a prebuilt frame of commands, e.g. from `encode_positions`
+        """
+        self._send(frame, priority)
+
+    def expect_packet(self, packet_type: str) -> asyncio.Future:
+        """
+        Future resolved by the next packet of the type, for a request written
+        separately with `send_frame`, to be awaited with `wait_packet`
+        """
+        return self._client.expect_packet(packet_type)
+
+    async def wait_packet(
+        self,
+        packet_type: str,
+        fut: asyncio.Future,
+        timeout: datetime.timedelta = DEFAULT_TIMEOUT,
+    ) -> Any:
+        """
+        Wait for the packet of a future from `expect_packet`, raises
+        asyncio.TimeoutError or ConnectionError if the connection is lost
+        """
+        return await self._client.wait_packet(packet_type, fut, timeout=timeout)
+
+    async def drain_async(self) -> None:
+        """
+        Wait until the commands held while the link was stalled are written
+        """
+        await self._client.drain()
+
+    def drain(self) -> None:
+        self._run(self.drain_async())
+
+    @property
+    def telemetry(self) -> Telemetry:
+        """
+        History of target, feedback, pwm and status received with feedback enabled
+        """
+        return self._telemetry
+
+    @property
+    def metrics(self) -> LinkMetrics:
+        """
+        Traffic counters of the connection to the box
+        """
+        return self._client.metrics
+
+    def motor_status(self, motor: Motor) -> MotorStatus:
+        return self._motors[motor.value - 1]
+
+    def subscribe(
+        self,
+        *,
+        motors: Iterable[Motor] = None,
+        kinds: Iterable[TelemetryKind] = None,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        conflate: bool = True,
+        deadband: int = 0,
+    ) -> Subscription:
+        """
+        Subscribe to telemetry samples of the motors, all by default.
+        The subscription is an async iterator, close it when done.
+
+            with box.subscribe(motors=[MotorNumber.A], deadband=2) as sub:
+                async for sample in sub:
+                    ...
+        """
+        return self._hub.subscribe(
+            motors=motors,
+            kinds=kinds,
+            maxsize=maxsize,
+            conflate=conflate,
+            deadband=deadband,
+        )
+
+    def add_listener(self, listener: Listener) -> None:
+        """
+        Call `listener(kind, sample)` for every telemetry sample as it arrives,
+        on the loop thread
+        """
+        self._hub.add_listener(listener)
+
+    def remove_listener(self, listener: Listener) -> None:
+        self._hub.remove_listener(listener)
+
     async def get_version_async(self) -> int:
         packet = await self._client.make_read_request(b"[ver]", "v")
         return packet[2]
 
     def get_version(self) -> int:
-        return self._loop.run_until_complete(self.get_version_async())
+        return self._run(self.get_version_async())
 
-    async def read_param_async(self, motor: Motor, param: Parameter) -> Any:
+    async def read_param_async(
+        self, motor: Motor, param: Parameter, refresh: bool = False
+    ) -> Any:
+        """
+        Read a parameter, configuration parameters are served from the cache
+        unless `refresh` is set
+        """
+        key = (motor, param)
+        if not refresh and key in self._params:
+            return list(self._params[key])
         _, _, *args = await self._client.read_parameter(motor, param)
+        self._cache_param(key, args)
         return args
 
-    def read_param(self, motor: Motor, param: Parameter) -> Any:
-        return self._loop.run_until_complete(self.read_param_async(motor, param))
+    def read_param(self, motor: Motor, param: Parameter, refresh: bool = False) -> Any:
+        return self._run(self.read_param_async(motor, param, refresh))
+
+    async def read_params_async(
+        self,
+        params: Sequence[Tuple[Motor, Parameter]],
+        window: int = None,
+        refresh: bool = False,
+    ) -> List[Any]:
+        """
+        Read several parameters pipelined, all the read commands are written at once
+        unless `window` limits the number of requests in flight, `READ_WINDOW`
+        for real hardware.
+        Cached configuration parameters are not requested unless `refresh` is set.
+        """
+        missing = [k for k in params if refresh or k not in self._params]
+        values = {}
+        if missing:
+            packets = await self._client.make_read_requests(
+                [(read_command(m, p), param_to_char(m, p)) for m, p in missing],
+                window=window,
+            )
+            for key, (_, _, *args) in zip(missing, packets):
+                self._cache_param(key, args)
+                values[key] = args
+        return [k in values and values[k] or list(self._params[k]) for k in params]
+
+    def read_params(
+        self,
+        params: Sequence[Tuple[Motor, Parameter]],
+        window: int = None,
+        refresh: bool = False,
+    ) -> List[Any]:
+        return self._run(self.read_params_async(params, window, refresh))
+
+    def invalidate_params(self) -> None:
+        """
+        Drop all cached parameter values, e.g. after the box was reset
+        """
+        self._params.clear()
+        self._unsaved.clear()
+
+    @property
+    def unsaved_params(self) -> Set[Tuple[Motor, Parameter]]:
+        """
+        Parameters written since the last `save_settings`
+        """
+        return set(self._unsaved)
+
+    async def snapshot_async(self, refresh: bool = False) -> Profile:
+        """
+        Configuration parameters of all motors as a JSON serializable profile
+        """
+        keys = [(m, p) for m in Motor for p in CONFIG_PARAMS]
+        values = await self.read_params_async(keys, refresh=refresh)
+        profile = {m.name: {} for m in Motor}
+        for (m, p), v in zip(keys, values):
+            profile[m.name][p.name] = list(v)
+        return profile
+
+    def snapshot(self, refresh: bool = False) -> Profile:
+        return self._run(self.snapshot_async(refresh))
+
+    async def apply_async(self, profile: Profile) -> List[Tuple[Motor, Parameter]]:
+        """
+        Write the parameters of the profile that differ from the current values.
+        Returns the parameters written.
+        """
+        wanted = {
+            (Motor[m], Parameter[p]): tuple(v)
+            for m, params in profile.items()
+            for p, v in params.items()
+        }
+        for m, p in wanted:
+            if p not in CONFIG_PARAMS:
+                raise ValueError(f"Parameter {p.name} can't be applied from a profile")
+        current = await self.read_params_async(list(wanted.keys()))
+        changed = [key for key, v in zip(wanted, current) if tuple(v) != wanted[key]]
+        if changed:
+            cmd = b"".join(set_command(m, p, *wanted[(m, p)]) for m, p in changed)
+            self._client.send_command(cmd)
+            for key in changed:
+                self._cache_param(key, wanted[key])
+                self._unsaved.add(key)
+        return changed
+
+    def apply(self, profile: Profile) -> List[Tuple[Motor, Parameter]]:
+        return self._run(self.apply_async(profile))
+
+    def _cache_param(self, key: Tuple[Motor, Parameter], args: Sequence[int]) -> None:
+        if key[1] in CONFIG_PARAMS:
+            self._params[key] = tuple(args)
 
     def delay(self, delay: float) -> None:
-        self._loop.run_until_complete(asyncio.sleep(delay))
+        if self._thread:
+            time.sleep(delay)
+        else:
+            self._run(asyncio.sleep(delay))
 
     def save_settings(self) -> None:
-        self._client.send_command(b"[sav]")
+        self._send(b"[sav]")
+        self._unsaved.clear()
 
     def enable_feedback(self, motor: Motor) -> None:
         self.log_info(f"Enable feedback for {motor.name} {motor.value}")
-        self._client.send_command(bytes(f"[mo{motor.value}]", "ascii"))
+        self._feedback_mode = motor.value
+        self._send(bytes(f"[mo{motor.value}]", "ascii"))
 
     def enable_motor(self, motor: Motor) -> None:
-        self._client.send_command(bytes(f"[en{motor.value}]", "ascii"))
+        self._enabled.add(motor)
+        self._send(bytes(f"[en{motor.value}]", "ascii"))
 
     def enable_motors(self) -> None:
-        self._client.send_command(b"[ena]")
+        self._enabled.update(Motor)
+        self._send(b"[ena]")
 
     def disable_feedback(self) -> None:
         self.log_info(f"Disable feedback for motors")
-        self._client.send_command(b"[mo0]")
+        self._feedback_mode = 0
+        self._send(b"[mo0]")
+
+    def set_position(self, motor: Motor, pos: int, priority: Priority = None) -> None:
+        self._send(set_command(motor, Parameter.Position, pos), priority)
+        self._positions[motor.value - 1] = pos
+
+    def set_positions(
+        self,
+        *,
+        a: int = None,
+        b: int = None,
+        c: int = None,
+        buffer: bytearray = None,
+        priority: Priority = None,
+    ) -> None:
+        """
+        Send positions for several motors in a single write.
+        Motors with position None are left alone. While the link is stalled only
+        the latest position of each motor is kept, unless a `priority` other
+        than Priority.Position is given, e.g. Priority.Safety for parking
+        the platform, which is written ahead of everything else.
+
+        A preallocated `buffer` of at least POSITIONS_FRAME_LEN bytes is reused
+        for encoding, unless the transport still holds the previous frame,
+        in which case a fresh one is allocated. A threaded box always writes
+        from a fresh buffer, as the write happens on the loop thread.
+        """
+        if self._thread:
+            buffer = None
+        data = self.encode_positions(a, b, c, buffer)
+        if data:
+            self._send(data, priority)
+
+    async def set_positions_async(
+        self,
+        *,
+        a: int = None,
+        b: int = None,
+        c: int = None,
+        buffer: bytearray = None,
+        priority: Priority = None,
+    ) -> None:
+        data = self.encode_positions(a, b, c, buffer)
+        if data:
+            self._client.send_command(data, priority)
+        # Let the transport flush the frame
+        await asyncio.sleep(0)
 
-    def set_position(self, motor: Motor, pos: int) -> None:
-        self._client.send_command(set_command(motor, Parameter.Position, pos))
+    def encode_positions(
+        self, a: int = None, b: int = None, c: int = None, buffer: bytearray = None
+    ) -> Optional[bytes]:
+        """
+        Frame setting the positions of the motors, None if all of them are None,
+        to be written with `send_frame`. The positions are recorded as the last
+        ones written, see `set_positions` for the buffer.
+        """
+        if buffer is None or self._client.write_buffer_size:
+            buffer = bytearray(POSITIONS_FRAME_LEN)
+        size = pack_positions(buffer, (a, b, c))
+        if not size:
+            return None
+        positions = self._positions
+        if a is not None:
+            positions[0] = a
+        if b is not None:
+            positions[1] = b
+        if c is not None:
+            positions[2] = c
+        if size == len(buffer):
+            return buffer
+        return memoryview(buffer)[:size]
 
     def set_parameter(self, motor: Motor, param: Parameter, *args) -> None:
-        self._client.send_command(set_command(motor, param, *args))
+        self._send(set_command(motor, param, *args))
+        if param in CONFIG_PARAMS:
+            self._cache_param((motor, param), args)
+            self._unsaved.add((motor, param))
 
     def _position_received(self, motor: Motor, target: int, feedback: int) -> None:
+        mt = self._telemetry.motors[motor.value - 1]
+        mt.add_position(self._loop.time(), target, feedback)
+        if self._hub:
+            self._hub.publish(TelemetryKind.Position, mt.latest())
         ms = self._motors[motor.value - 1]
         ms.target = target
         ms.feedback = feedback
-        self.log_info(ms)
+        if self.log_telemetry:
+            self.log_info(ms)
 
     def _pwm_status_received(self, motor: Motor, pwm: int, status: int) -> None:
+        mt = self._telemetry.motors[motor.value - 1]
+        mt.update_pwm_status(self._loop.time(), pwm, status)
+        if self._hub:
+            self._hub.publish(TelemetryKind.PwmStatus, mt.latest())
         ms = self._motors[motor.value - 1]
         ms.pwm = pwm
         ms.status = status
-        self.log_info(ms)
+        if self.log_telemetry:
+            self.log_info(ms)
@@ -0,0 +1,411 @@
+"""
+Binary capture of the wire traffic and its replay.
+
+A capture file starts with CAPTURE_MAGIC followed by records of raw bytes
+as they were read from or written to the transport:
+
+    timestamp   float64, monotonic clock seconds
+    direction   uint8, Direction
+    length      uint16
+    data        length bytes
+
+all little-endian. Records are buffered and appended, when the file grows
+beyond `rotate_size` it is synced to disk and renamed to `<path>.1`, `<path>.2`
+and so on, and a new file is started.
+"""
+
+import asyncio
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+
+from enum import IntEnum
+from typing import Callable, Iterator, List, NamedTuple, Tuple
+
+from .loggable import Loggable
+from .transport import ConnectionFactory
+
+CAPTURE_MAGIC = b"SMC3CAP1"
+RECORD_HEADER = struct.Struct("<dBH")
+MAX_RECORD_DATA = 0xFFFF
+DEFAULT_CAPTURE_BUFFER = 64 * 1024
+# Records fed per loop iteration when replaying at max speed
+REPLAY_BATCH = 64
+
+
+class Direction(IntEnum):
+    Inbound = 0
+    Outbound = 1
+
+
+class CaptureRecord(NamedTuple):
+    timestamp: float
+    direction: Direction
+    data: bytes
+
+
+class CaptureWriter(Loggable):
+    """
+    Append-only writer of a capture file
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        buffer_size: int = DEFAULT_CAPTURE_BUFFER,
+        rotate_size: int = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("CAPTURE"))
+        self._path = path
+        self._buffer_size = buffer_size
+        self._rotate_size = rotate_size
+        self._clock = clock
+        self._buffer = bytearray()
+        self._file = None
+        self._size = 0
+        rotated = _rotated_files(path)
+        self._rotations = rotated and rotated[-1][0] or 0
+        self.records = 0
+        self._open()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _open(self) -> None:
+        self._file = open(self._path, "ab", buffering=0)
+        self._size = self._file.seek(0, os.SEEK_END)
+        if not self._size:
+            self._buffer += CAPTURE_MAGIC
+
+    def write(self, direction: Direction, data: bytes) -> None:
+        if self._file is None:
+            return
+        timestamp = self._clock()
+        data = memoryview(data)
+        while True:
+            chunk = data[:MAX_RECORD_DATA]
+            self._buffer += RECORD_HEADER.pack(timestamp, direction, len(chunk))
+            self._buffer += chunk
+            self.records += 1
+            data = data[MAX_RECORD_DATA:]
+            if not data:
+                break
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is None or not self._buffer:
+            return
+        self._file.write(self._buffer)
+        self._size += len(self._buffer)
+        self._buffer.clear()
+        if self._rotate_size and self._size >= self._rotate_size:
+            self.rotate()
+
+    def rotate(self) -> None:
+        """
+        Sync the current file to disk and start a new one
+        """
+        self._close_file()
+        self._rotations += 1
+        rotated = f"{self._path}.{self._rotations}"
+        os.rename(self._path, rotated)
+        self.log_info(f"Capture rotated to {rotated}")
+        self._open()
+
+    def _close_file(self) -> None:
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._close_file()
+
+    def __enter__(self) -> "CaptureWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _rotated_files(path: str) -> List[Tuple[int, str]]:
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r"\.(\d+)$")
+    rotated = []
+    for f in os.listdir(directory or "."):
+        m = pattern.match(f)
+        if m:
+            rotated.append((int(m.group(1)), os.path.join(directory, f)))
+    return sorted(rotated)
+
+
+def capture_files(path: str) -> List[str]:
+    """
+    Files of a capture in recording order, the rotated ones first
+    """
+    files = [f for _, f in _rotated_files(path)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_capture_file(path: str) -> Iterator[CaptureRecord]:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(CAPTURE_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            if m[: len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+                raise ValueError(f"{path} is not an SMC3 capture")
+            offset = len(CAPTURE_MAGIC)
+            header = RECORD_HEADER.size
+            unpack_from = RECORD_HEADER.unpack_from
+            while offset + header <= size:
+                timestamp, direction, length = unpack_from(m, offset)
+                offset += header
+                if offset + length > size:
+                    break
+                yield CaptureRecord(
+                    timestamp, Direction(direction), m[offset : offset + length]
+                )
+                offset += length
+            if offset != size:
+                logging.getLogger("CAPTURE").warning(
+                    f"Truncated record at the end of {path}"
+                )
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """
+    Records of a capture including the rotated files
+    """
+    for f in capture_files(path):
+        yield from read_capture_file(f)
+
+
+class _CaptureTransport:
+    """
+    Transport proxy recording the outbound data
+    """
+
+    def __init__(self, transport: asyncio.Transport, writer: CaptureWriter) -> None:
+        self._transport = transport
+        self._writer = writer
+
+    def write(self, data) -> None:
+        self._writer.write(Direction.Outbound, data)
+        self._transport.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self._transport, name)
+
+
+class _CaptureProtocol(asyncio.Protocol):
+    """
+    Protocol proxy recording the inbound data
+    """
+
+    def __init__(self, protocol: asyncio.Protocol, writer: CaptureWriter) -> None:
+        self.protocol = protocol
+        self.transport = None
+        self._writer = writer
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = _CaptureTransport(transport, self._writer)
+        self.protocol.connection_made(self.transport)
+
+    def data_received(self, data: bytes) -> None:
+        self._writer.write(Direction.Inbound, data)
+        self.protocol.data_received(data)
+
+    def connection_lost(self, exc) -> None:
+        self._writer.flush()
+        self.protocol.connection_lost(exc)
+
+    def pause_writing(self) -> None:
+        self.protocol.pause_writing()
+
+    def resume_writing(self) -> None:
+        self.protocol.resume_writing()
+
+
+def capture_connection(
+    connection: ConnectionFactory, writer: CaptureWriter
+) -> ConnectionFactory:
+    """
+    Wrap a connection factory to record the traffic with `writer`
+    """
+
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        _, proto = await connection(
+            loop, lambda: _CaptureProtocol(protocol_factory(), writer)
+        )
+        return proto.transport, proto.protocol
+
+    return connect
+
+
+class ReplayTransport(asyncio.Transport):
+    """
+    Feeds the inbound records of a capture to the protocol, anything
+    written is counted and discarded
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        protocol: asyncio.Protocol,
+        records: Iterator[CaptureRecord],
+        speed: float,
+        done: asyncio.Future,
+    ) -> None:
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._records = (r for r in records if r.direction == Direction.Inbound)
+        self._speed = speed
+        self._done = done
+        self._next: CaptureRecord = None
+        self._origin = 0.0
+        self._start = 0.0
+        self._handle = None
+        self._closing = False
+        self.records = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def get_protocol(self) -> asyncio.Protocol:
+        return self._protocol
+
+    def set_protocol(self, protocol: asyncio.Protocol) -> None:
+        self._protocol = protocol
+
+    def start(self) -> None:
+        self._next = next(self._records, None)
+        if self._next is not None:
+            self._origin = self._next.timestamp
+        self._start = self._loop.time()
+        self._handle = self._loop.call_soon(self._step)
+
+    def _feed(self, record: CaptureRecord) -> None:
+        self.records += 1
+        self.bytes_in += len(record.data)
+        self._protocol.data_received(record.data)
+
+    def _step(self) -> None:
+        self._handle = None
+        if self._closing:
+            return
+        record = self._next
+        if self._speed > 0:
+            now = self._loop.time()
+            while record is not None:
+                deadline = self._start + (record.timestamp - self._origin) / self._speed
+                if deadline > now:
+                    self._next = record
+                    self._handle = self._loop.call_at(deadline, self._step)
+                    return
+                self._feed(record)
+                record = next(self._records, None)
+        else:
+            for _ in range(REPLAY_BATCH):
+                if record is None:
+                    break
+                self._feed(record)
+                record = next(self._records, None)
+            if record is not None:
+                self._next = record
+                self._handle = self._loop.call_soon(self._step)
+                return
+        self._next = None
+        if not self._done.done():
+            self._done.set_result(self._loop.time() - self._start)
+
+    def write(self, data) -> None:
+        self.bytes_out += len(data)
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._done.done():
+            self._done.cancel()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+
+class Replayer:
+    """
+    Replays a capture as a connection, `speed` is the time scale relative
+    to the recording, 0 feeds the records as fast as possible.
+
+        replayer = Replayer("session.cap", speed=10)
+        box = Box(device="session.cap", connection=replayer.connect)
+        box.loop.run_until_complete(replayer.wait())
+    """
+
+    transport: ReplayTransport
+
+    def __init__(self, path: str, *, speed: float = 1.0) -> None:
+        if speed < 0:
+            raise ValueError(f"Invalid replay speed {speed}")
+        self.path = path
+        self.speed = speed
+        self.transport = None
+        self._done: asyncio.Future = None
+
+    async def connect(self, loop: asyncio.AbstractEventLoop, protocol_factory):
+        protocol = protocol_factory()
+        self._done = loop.create_future()
+        self.transport = ReplayTransport(
+            loop, protocol, read_capture(self.path), self.speed, self._done
+        )
+        protocol.connection_made(self.transport)
+        self.transport.start()
+        return self.transport, protocol
+
+    async def wait(self) -> float:
+        """
+        Wait until all the records are fed, returns the replay duration in seconds
+        """
+        return await self._done
+
+
+def replay(path: str, protocol: asyncio.Protocol) -> Tuple[int, int]:
+    """
+    Feed the inbound data of a capture to the protocol synchronously,
+    returns the number of records and bytes fed
+    """
+    records = size = 0
+    for record in read_capture(path):
+        if record.direction == Direction.Inbound:
+            protocol.data_received(record.data)
+            records += 1
+            size += len(record.data)
+    return records, size
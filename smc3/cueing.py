@@ -0,0 +1,565 @@
+"""
+Motion cueing from game telemetry.
+
+The pipeline has three stages:
+
+    adapter     decodes the UDP telemetry packets of a game into `MotionCue`
+                accelerations and rotation rates, in place with `struct`
+    washout     `ClassicalWashout`, a bank of filters turning the cues into
+                platform pitch, roll and heave
+    output      `CueingPipeline` filters the latest cue, maps the platform pose
+                to actuator positions and writes them to the box at a fixed rate
+
+Cues are in the vehicle frame: x forward, y left, z up. Accelerations are in
+m/s², rotation rates in rad/s, positive roll lowers the right side, positive
+pitch raises the nose.
+
+    receiver = await TelemetryReceiver.listen(ForzaAdapter(), port=5300)
+    pipeline = CueingPipeline(box, receiver)
+    await pipeline.run()
+    print(pipeline.metrics.latency)
+"""
+
+import asyncio
+import logging
+import math
+import struct
+import time
+
+import numpy as np
+
+from typing import Callable, NamedTuple, Optional, Sequence, Tuple
+
+from .box import Box
+from .loggable import Loggable
+from .metrics import COUNTER, HISTOGRAM, Histogram, Metrics
+from .prediction import LatencyPredictor
+from .protocol import CENTER, POSITION_MAX, POSITION_MIN, POSITIONS_FRAME_LEN
+from .scheduler import DEFAULT_RATE, MotionScheduler
+from .trajectory import MotionLimits, TrajectoryShaper
+
+GRAVITY = 9.80665
+
+DEFAULT_PORT = 5300
+
+# Upper bounds of receipt to write latency buckets in seconds
+CUE_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+)
+
+
+class MotionCue(NamedTuple):
+    """
+    Decoded telemetry frame, `received` is the `time.perf_counter` time
+    of the datagram
+    """
+
+    received: float
+    surge: float
+    sway: float
+    heave: float
+    roll_rate: float
+    pitch_rate: float
+    yaw_rate: float
+
+
+class Adapter:
+    """
+    Decoder of the telemetry packets of a game. `decode` returns None for
+    packets carrying no motion, e.g. sent from a menu.
+    """
+
+    size: int
+
+    def decode(self, data: memoryview, received: float) -> Optional[MotionCue]:
+        raise NotImplementedError()
+
+    def encode(self, cue: MotionCue) -> bytes:
+        """
+        Packet carrying the cue, for testing with a local sender
+        """
+        raise NotImplementedError()
+
+
+class GenericAdapter(Adapter):
+    """
+    Six little-endian floats: surge, sway and heave accelerations, then roll,
+    pitch and yaw rates, in the units and frame of `MotionCue`
+    """
+
+    FORMAT = struct.Struct("<6f")
+    size = FORMAT.size
+
+    def decode(self, data: memoryview, received: float) -> Optional[MotionCue]:
+        return MotionCue(received, *self.FORMAT.unpack_from(data))
+
+    def encode(self, cue: MotionCue) -> bytes:
+        return self.FORMAT.pack(*cue[1:])
+
+
+class ForzaAdapter(Adapter):
+    """
+    Forza Motorsport / Horizon "Data Out" packets, sled or dash format.
+    Only the header is decoded: the race flag, then after the timestamp and
+    engine speeds the acceleration, velocity and angular velocity vectors in car
+    space (x right, y up, z forward, angular x pitch, y yaw, z roll).
+    """
+
+    HEADER = struct.Struct("<iI12x3f12x3f")
+    # Sled packets are the shortest
+    size = 232
+
+    def decode(self, data: memoryview, received: float) -> Optional[MotionCue]:
+        race_on, _, ax, ay, az, wx, wy, wz = self.HEADER.unpack_from(data)
+        if not race_on:
+            return None
+        return MotionCue(received, az, -ax, ay, wz, wx, wy)
+
+    def encode(self, cue: MotionCue) -> bytes:
+        packet = bytearray(self.size)
+        self.HEADER.pack_into(
+            packet,
+            0,
+            1,
+            int(cue.received * 1000) & 0xFFFFFFFF,
+            -cue.sway,
+            cue.heave,
+            cue.surge,
+            cue.pitch_rate,
+            cue.yaw_rate,
+            cue.roll_rate,
+        )
+        return bytes(packet)
+
+
+ADAPTERS = {
+    "generic": GenericAdapter,
+    "forza": ForzaAdapter,
+}
+
+
+class CueingMetrics(Metrics):
+    """
+    Frames of a cueing pipeline
+    """
+
+    DESCRIPTIONS = {
+        "frames": (COUNTER, "Telemetry frames decoded"),
+        "invalid": (COUNTER, "Telemetry datagrams too short to decode"),
+        "idle": (COUNTER, "Telemetry frames without motion"),
+        "superseded": (COUNTER, "Telemetry frames replaced before being written"),
+        "ticks": (COUNTER, "Positions written to the box"),
+        "stale": (COUNTER, "Positions written without a new frame"),
+        "latency": (
+            HISTOGRAM,
+            "Time from a frame received to its positions written, seconds",
+        ),
+    }
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.frames = 0
+        self.invalid = 0
+        self.idle = 0
+        self.superseded = 0
+        self.ticks = 0
+        self.stale = 0
+        self.latency = Histogram(CUE_LATENCY_BUCKETS)
+
+
+class TelemetryReceiver(asyncio.DatagramProtocol, Loggable):
+    """
+    Keeps the latest cue decoded from the datagrams received
+    """
+
+    def __init__(self, adapter: Adapter, metrics: CueingMetrics = None) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("CUEING"))
+        self.adapter = adapter
+        self.metrics = metrics or CueingMetrics()
+        self.latest: Optional[MotionCue] = None
+        self.sequence = 0
+        self._transport: asyncio.DatagramTransport = None
+
+    @classmethod
+    async def listen(
+        cls,
+        adapter: Adapter,
+        *,
+        host: str = "0.0.0.0",
+        port: int = DEFAULT_PORT,
+        loop: asyncio.AbstractEventLoop = None,
+        metrics: CueingMetrics = None,
+    ) -> "TelemetryReceiver":
+        loop = loop or asyncio.get_running_loop()
+        receiver = cls(adapter, metrics)
+        await loop.create_datagram_endpoint(lambda: receiver, local_addr=(host, port))
+        receiver.log_info(f"Listening for telemetry on udp://{host}:{port}")
+        return receiver
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        received = time.perf_counter()
+        if len(data) < self.adapter.size:
+            self.metrics.invalid += 1
+            return
+        cue = self.adapter.decode(memoryview(data), received)
+        if cue is None:
+            self.metrics.idle += 1
+            return
+        self.metrics.frames += 1
+        self.latest = cue
+        self.sequence += 1
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+
+class WashoutConfig(NamedTuple):
+    """
+    Classical washout parameters. Accelerations and rates are scaled by
+    `acceleration_scale` and `rotation_scale` first. Frequencies are in rad/s.
+    """
+
+    acceleration_scale: float = 0.5
+    rotation_scale: float = 0.5
+    # Second order high-pass of the heave acceleration followed by a first order
+    # one, the platform returns to neutral under a sustained acceleration
+    heave_frequency: float = 2.5
+    heave_damping: float = 1.0
+    heave_return_frequency: float = 0.5
+    # Second order high-pass of the roll and pitch rates
+    rotation_frequency: float = 1.0
+    rotation_damping: float = 1.0
+    # Second order low-pass of the surge and sway accelerations reproduced
+    # by tilting the platform
+    tilt_frequency: float = 5.0
+    tilt_damping: float = 1.0
+    tilt_max: float = math.radians(10)
+    # Below the perception threshold of rotation
+    tilt_rate_limit: float = math.radians(3)
+
+
+def _bilinear(
+    num: Sequence[float], den: Sequence[float], dt: float
+) -> Tuple[float, ...]:
+    """
+    Discrete (b0, b1, b2, a1, a2) of an analog section
+    (n0 s² + n1 s + n2) / (d0 s² + d1 s + d2) by the bilinear transform
+    """
+    k = 2.0 / dt
+    n0, n1, n2 = num
+    d0, d1, d2 = den
+    if not n0 and not d0:
+        a0 = d1 * k + d2
+        return (
+            (n1 * k + n2) / a0,
+            (n2 - n1 * k) / a0,
+            0.0,
+            (d2 - d1 * k) / a0,
+            0.0,
+        )
+    kk = k * k
+    a0 = d0 * kk + d1 * k + d2
+    return (
+        (n0 * kk + n1 * k + n2) / a0,
+        (2 * n2 - 2 * n0 * kk) / a0,
+        (n0 * kk - n1 * k + n2) / a0,
+        (2 * d2 - 2 * d0 * kk) / a0,
+        (d0 * kk - d1 * k + d2) / a0,
+    )
+
+
+IDENTITY_SECTION = (1.0, 0.0, 0.0, 0.0, 0.0)
+
+
+class BiquadBank:
+    """
+    Independent cascades of second order sections, one per channel, evaluated
+    for all the channels at once. `sections` has the shape (stages, channels, 5)
+    of (b0, b1, b2, a1, a2), shorter cascades are padded with IDENTITY_SECTION.
+    """
+
+    def __init__(self, sections: np.ndarray) -> None:
+        sections = np.asarray(sections, dtype=np.float64)
+        self.b0, self.b1, self.b2, self.a1, self.a2 = np.moveaxis(sections, -1, 0)
+        self.state = np.zeros((2,) + self.b0.shape)
+
+    @property
+    def channels(self) -> int:
+        return self.b0.shape[1]
+
+    def reset(self) -> None:
+        self.state[:] = 0.0
+
+    def step(self, x: np.ndarray) -> np.ndarray:
+        z1, z2 = self.state
+        for i in range(len(self.b0)):
+            y = self.b0[i] * x + z1[i]
+            z1[i] = self.b1[i] * x - self.a1[i] * y + z2[i]
+            z2[i] = self.b2[i] * x - self.a2[i] * y
+            x = y
+        return x
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        Filter a block of shape (samples, channels), the state carries over
+        """
+        out = np.empty_like(block, dtype=np.float64)
+        step = self.step
+        for i, x in enumerate(np.asarray(block, dtype=np.float64)):
+            out[i] = step(x)
+        return out
+
+
+# Filter bank channels
+_PITCH_RATE, _ROLL_RATE, _HEAVE, _SURGE, _SWAY = range(5)
+
+
+class ClassicalWashout:
+    """
+    Classical washout for a platform with pitch, roll and heave.
+
+    Roll and pitch rates are high-pass filtered and integrated into angles,
+    the heave acceleration is high-pass filtered and integrated twice into
+    a displacement, and the low frequency part of the surge and sway
+    accelerations is reproduced by tilting the platform so that gravity
+    provides it, with the tilt rate kept below the perception threshold.
+    The output is (pitch, roll, heave) in radians and meters.
+    """
+
+    def __init__(self, config: WashoutConfig = WashoutConfig(), *, dt: float) -> None:
+        self.config = config
+        self.dt = dt
+        c = config
+
+        def second_order(frequency: float, damping: float) -> Tuple[float, ...]:
+            return (1.0, 2 * damping * frequency, frequency * frequency)
+
+        rotation = second_order(c.rotation_frequency, c.rotation_damping)
+        heave = second_order(c.heave_frequency, c.heave_damping)
+        tilt = second_order(c.tilt_frequency, c.tilt_damping)
+        # High-pass s²/D(s) followed by the integration 1/s, i.e. s/D(s)
+        rotation_section = _bilinear((0.0, 1.0, 0.0), rotation, dt)
+        sections = [
+            [
+                rotation_section,
+                rotation_section,
+                # s²/D(s) integrated twice
+                _bilinear((0.0, 0.0, 1.0), heave, dt),
+                _bilinear((0.0, 0.0, tilt[2]), tilt, dt),
+                _bilinear((0.0, 0.0, tilt[2]), tilt, dt),
+            ],
+            [
+                IDENTITY_SECTION,
+                IDENTITY_SECTION,
+                _bilinear((0.0, 1.0, 0.0), (0.0, 1.0, c.heave_return_frequency), dt),
+                IDENTITY_SECTION,
+                IDENTITY_SECTION,
+            ],
+        ]
+        self.bank = BiquadBank(sections)
+        self._scale = np.array(
+            [
+                c.rotation_scale,
+                c.rotation_scale,
+                c.acceleration_scale,
+                c.acceleration_scale / GRAVITY,
+                c.acceleration_scale / GRAVITY,
+            ]
+        )
+        self._input = np.zeros(5)
+        self._tilt = np.zeros(2)
+        self._tilt_step = c.tilt_rate_limit * dt
+        self._tilt_limit = math.sin(c.tilt_max)
+
+    def reset(self) -> None:
+        self.bank.reset()
+        self._tilt[:] = 0.0
+
+    def step(self, cue: Sequence[float]) -> np.ndarray:
+        """
+        Pose for the cue as (surge, sway, heave, roll_rate, pitch_rate, ...)
+        held for `dt`
+        """
+        x = self._input
+        x[_PITCH_RATE] = cue[4]
+        x[_ROLL_RATE] = cue[3]
+        x[_HEAVE] = cue[2]
+        x[_SURGE] = cue[0]
+        x[_SWAY] = cue[1]
+        y = self.bank.step(x * self._scale)
+
+        target = np.arcsin(np.clip(y[_SURGE:], -self._tilt_limit, self._tilt_limit))
+        self._tilt += np.clip(target - self._tilt, -self._tilt_step, self._tilt_step)
+        return np.array(
+            [
+                y[_PITCH_RATE] + self._tilt[0],
+                y[_ROLL_RATE] + self._tilt[1],
+                y[_HEAVE],
+            ]
+        )
+
+    def process(self, cues: np.ndarray) -> np.ndarray:
+        """
+        Poses for a block of cues of shape (samples, 5+), one per `dt`
+        """
+        cues = np.asarray(cues, dtype=np.float64)
+        inputs = cues[:, [4, 3, 2, 0, 1]] * self._scale
+        y = self.bank.process(inputs)
+
+        target = np.arcsin(np.clip(y[:, _SURGE:], -self._tilt_limit, self._tilt_limit))
+        tilt = np.empty_like(target)
+        current = self._tilt
+        # The rate limit depends on the previous output, only this part
+        # runs sample by sample
+        for i, t in enumerate(target):
+            current += np.clip(t - current, -self._tilt_step, self._tilt_step)
+            tilt[i] = current
+        return np.stack(
+            [
+                y[:, _PITCH_RATE] + tilt[:, 0],
+                y[:, _ROLL_RATE] + tilt[:, 1],
+                y[:, _HEAVE],
+            ],
+            axis=1,
+        )
+
+
+# Actuators A and B behind the seat on the left and right, C in front,
+# a higher position extends the actuator
+DEFAULT_MIX = (
+    (-1.0, 1.0, 1.0),
+    (-1.0, -1.0, 1.0),
+    (1.0, 0.0, 1.0),
+)
+# Position units per radian of pitch and roll and per meter of heave
+DEFAULT_POSE_SCALE = (1500.0, 1500.0, 4000.0)
+
+
+class LinearMixer:
+    """
+    Maps a pose (pitch, roll, heave) to actuator positions around `center`
+    with a fixed matrix, rows are actuators, columns the pose axes
+    """
+
+    def __init__(
+        self,
+        mix: Sequence[Sequence[float]] = DEFAULT_MIX,
+        *,
+        scale: Sequence[float] = DEFAULT_POSE_SCALE,
+        center: float = CENTER,
+    ) -> None:
+        self.matrix = np.asarray(mix, dtype=np.float64) * np.asarray(scale)
+        self.center = center
+
+    def __call__(self, pose: np.ndarray) -> Tuple[int, ...]:
+        positions = np.clip(
+            np.rint(self.matrix @ pose + self.center), POSITION_MIN, POSITION_MAX
+        )
+        return tuple(int(p) for p in positions)
+
+
+class CueingPipeline(Loggable):
+    """
+    Writes the positions for the latest cue of the receiver to the box
+    at a fixed `rate`. The washout runs on every tick, holding the last cue
+    until a new frame arrives, and the platform returns to neutral when
+    no frame has been received for `timeout` seconds. The `mixer` maps
+    the pose to the positions of motors A, B and optionally C, by default
+    a `LinearMixer`, or a `smc3.kinematics.Platform` for the rig geometry.
+    With `limits` the positions are shaped by a `TrajectoryShaper` before
+    they are written, with `predict` they are led by the delay of the feedback
+    estimated by a `smc3.prediction.LatencyPredictor`.
+    """
+
+    def __init__(
+        self,
+        box: Box,
+        receiver: TelemetryReceiver,
+        *,
+        washout: WashoutConfig = WashoutConfig(),
+        mixer: Callable[[np.ndarray], Sequence[int]] = None,
+        rate: float = DEFAULT_RATE,
+        timeout: float = 0.5,
+        limits: MotionLimits = None,
+        predict: bool = False,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("CUEING"))
+        if box.threaded:
+            raise ValueError("The cueing pipeline must run on the box loop")
+        self.box = box
+        self.receiver = receiver
+        self.metrics = receiver.metrics
+        self.washout = ClassicalWashout(washout, dt=1.0 / rate)
+        self.mixer = mixer or LinearMixer()
+        self.shaper = TrajectoryShaper(limits, rate=rate) if limits else None
+        self.predictor = LatencyPredictor(box) if predict else None
+        self.timeout = timeout
+        self.scheduler = MotionScheduler(self._tick, rate=rate, loop=box.loop)
+        self.pose = np.zeros(3)
+        self._neutral = (0.0,) * 6
+        self._sequence = 0
+        self._buffer = bytearray(POSITIONS_FRAME_LEN)
+
+    async def run(self, duration: float = None) -> None:
+        await self.scheduler.run(duration)
+
+    def stop(self) -> None:
+        self.scheduler.stop()
+
+    def close(self) -> None:
+        """
+        Stop and detach from the box, the box and the receiver stay open
+        """
+        self.stop()
+        if self.predictor is not None:
+            self.predictor.close()
+
+    def _tick(self, _: float) -> None:
+        receiver = self.receiver
+        metrics = self.metrics
+        cue = receiver.latest
+        fresh = receiver.sequence != self._sequence
+        if fresh:
+            metrics.superseded += receiver.sequence - self._sequence - 1
+            self._sequence = receiver.sequence
+        else:
+            metrics.stale += 1
+        if cue is None or time.perf_counter() - cue.received > self.timeout:
+            values = self._neutral
+        else:
+            values = cue[1:]
+        self.pose = self.washout.step(values)
+        positions = self.mixer(self.pose)
+        if self.shaper is not None:
+            positions = self.shaper(positions)[: len(positions)]
+        if self.predictor is not None:
+            shaper = self.shaper
+            if shaper is not None:
+                positions = self.predictor.lead(
+                    positions, shaper.velocities, shaper.accelerations
+                )
+            else:
+                positions = self.predictor.lead(positions)
+        # A mixer of a 2 actuator rig has no row for C, the motor is left alone
+        a, b = positions[0], positions[1]
+        c = positions[2] if len(positions) > 2 else None
+        self.box.set_positions(a=a, b=b, c=c, buffer=self._buffer)
+        metrics.ticks += 1
+        if fresh:
+            metrics.latency.add(time.perf_counter() - cue.received)
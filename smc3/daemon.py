@@ -0,0 +1,372 @@
+"""
+Multiplexing daemon sharing one box among several clients.
+
+The daemon owns the `Box` and listens on Unix and/or TCP sockets. Clients speak
+the SMC3 packet protocol itself, so a `Box` connects to the daemon with
+a unix:///path or tcp://host:port device and the examples run unchanged:
+
+    [rdX], [ver]        forwarded to the box, the reply goes back to the client
+                        that asked
+    [moN], [mo0]        subscribe the client to the feedback stream or
+                        unsubscribe it, the box streams feedback while at least
+                        one client is subscribed and every packet is fanned out
+                        to all subscribers
+    [Xxx], [ena], [enN], [sav]
+                        change the box state and are only accepted from the
+                        owner, the first client to send one, the other clients
+                        are read-only until the owner disconnects
+
+Commands received from all clients during a loop iteration are written to the box
+in a single batch, and so is the telemetry sent to each client.
+"""
+
+import asyncio
+import logging
+import time
+
+from typing import Any, Dict, List
+
+from .box import Box
+from .loggable import Loggable
+from .protocol import (
+    FrameParser,
+    Motor,
+    Parameter,
+    SET_COMMANDS,
+    DEFAULT_TIMEOUT,
+    format_value,
+    param_to_char,
+)
+from .metrics import COUNTER, HISTOGRAM, Histogram, Metrics
+from .telemetry import TelemetryKind, TelemetrySample
+
+# Upper bounds of forwarding latency buckets in seconds
+DAEMON_LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+)
+
+WRITE_BYTES = frozenset(codec.byte for codec in SET_COMMANDS.values())
+WRITE_COMMANDS = frozenset([b"ena", b"en1", b"en2", b"en3", b"sav"])
+
+
+class DaemonMetrics(Metrics):
+    """
+    Traffic of the daemon clients
+    """
+
+    DESCRIPTIONS = {
+        "commands": (COUNTER, "Commands forwarded to the box"),
+        "batches": (COUNTER, "Batches written to the box"),
+        "rejected": (COUNTER, "Write commands rejected from read-only clients"),
+        "session_timeouts": (COUNTER, "Requests of clients timed out"),
+        "dropped": (COUNTER, "Feedback packets dropped for slow clients"),
+        "upstream": (
+            HISTOGRAM,
+            "Time from a client command received to the batch written to the box, "
+            "seconds",
+        ),
+        "downstream": (
+            HISTOGRAM,
+            "Time from a packet received from the box to the batch written "
+            "to a client, seconds",
+        ),
+    }
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.commands = 0
+        self.batches = 0
+        self.rejected = 0
+        self.session_timeouts = 0
+        self.dropped = 0
+        self.upstream = Histogram(DAEMON_LATENCY_BUCKETS)
+        self.downstream = Histogram(DAEMON_LATENCY_BUCKETS)
+
+
+POSITION_CODES = {m: param_to_char(m, Parameter.Position) for m in Motor}
+PWM_STATUS_CODES = {m: param_to_char(m, Parameter.PwmStatus) for m in Motor}
+
+
+class Session(asyncio.Protocol, Loggable):
+    """
+    Connection of a single client to the daemon
+    """
+
+    def __init__(self, daemon: "Daemon", name: str) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("SESSION"))
+        self.name = name
+        self.feedback = False
+        self.rejected = 0
+        self.dropped = 0
+        self._daemon = daemon
+        self._transport = None
+        self._parser = FrameParser(self._packet_received)
+        self._received = 0.0
+        self._out = bytearray()
+        self._out_since = 0.0
+        self._paused = False
+
+    @property
+    def closed(self) -> bool:
+        return self._transport is None or self._transport.is_closing()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        peer = transport.get_extra_info("peername")
+        if peer and isinstance(peer, tuple):
+            self.name = f"{self.name} ({peer[0]}:{peer[1]})"
+        self._daemon._attach(self)
+
+    def data_received(self, data: bytes) -> None:
+        self._received = time.perf_counter()
+        self._parser.feed(data)
+
+    def _packet_received(self, packet: memoryview) -> None:
+        self._daemon._command(self, packet)
+
+    def connection_lost(self, exc) -> None:
+        self._daemon._detach(self)
+
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+
+    def send(self, data: bytes, feedback: bool = False) -> None:
+        """
+        Queue data for the next batch, feedback is dropped while the client
+        doesn't keep up
+        """
+        if feedback and self._paused:
+            self.dropped += 1
+            self._daemon.metrics.dropped += 1
+            return
+        if not self._out:
+            self._out_since = time.perf_counter()
+            self._daemon._schedule_session(self)
+        self._out += data
+
+    def _flush(self) -> float:
+        since = self._out_since
+        if not self.closed:
+            self._transport.write(bytes(self._out))
+        self._out.clear()
+        return since
+
+    def close(self) -> None:
+        if not self.closed:
+            self._transport.close()
+
+
+class Daemon(Loggable):
+    """
+    Serves a box to several clients, see the module documentation
+    for the protocol
+    """
+
+    _box: Box
+    _loop: asyncio.AbstractEventLoop
+    _sessions: List[Session]
+
+    def __init__(self, box: Box) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("DAEMON"))
+
+        if box.threaded:
+            raise ValueError("The daemon must run on the box loop")
+        self._box = box
+        self._loop = box.loop
+        self._sessions = []
+        self._servers: List[asyncio.AbstractServer] = []
+        self._owner: Session = None
+        self._feedback = 0
+        self._pending = bytearray()
+        self._pending_since = 0.0
+        self._dirty: List[Session] = []
+        self._flush_handle: asyncio.Handle = None
+        self._session_count = 0
+        self.metrics = DaemonMetrics()
+        box.add_listener(self._telemetry_received)
+
+    @property
+    def box(self) -> Box:
+        return self._box
+
+    @property
+    def sessions(self) -> List[Session]:
+        return list(self._sessions)
+
+    @property
+    def owner(self) -> Session:
+        return self._owner
+
+    def _new_session(self) -> Session:
+        self._session_count += 1
+        return Session(self, f"client {self._session_count}")
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        server = await self._loop.create_unix_server(self._new_session, path)
+        self._servers.append(server)
+        self.log_info(f"Listening on unix://{path}")
+        return server
+
+    async def serve_tcp(self, host: str, port: int) -> asyncio.AbstractServer:
+        server = await self._loop.create_server(self._new_session, host, port)
+        self._servers.append(server)
+        self.log_info(f"Listening on tcp://{host}:{port}")
+        return server
+
+    def close(self) -> None:
+        for server in self._servers:
+            server.close()
+        self._servers.clear()
+        for session in list(self._sessions):
+            session.close()
+        self._box.remove_listener(self._telemetry_received)
+        if self._feedback:
+            self._feedback = 0
+            self._queue(b"[mo0]", time.perf_counter())
+
+    def stats(self) -> Dict[str, Any]:
+        metrics = self.metrics
+        return {
+            "clients": len(self._sessions),
+            "owner": self._owner and self._owner.name or None,
+            "commands": metrics.commands,
+            "batches": metrics.batches,
+            "rejected": metrics.rejected,
+            "timeouts": metrics.session_timeouts,
+            "dropped": metrics.dropped,
+            "upstream": str(metrics.upstream),
+            "downstream": str(metrics.downstream),
+        }
+
+    def _attach(self, session: Session) -> None:
+        self._sessions.append(session)
+        self.log_info(f"{session.name} connected")
+
+    def _detach(self, session: Session) -> None:
+        if session not in self._sessions:
+            return
+        self._sessions.remove(session)
+        if session.feedback:
+            self._set_feedback(session, 0, time.perf_counter())
+        if self._owner is session:
+            self._owner = None
+            self.log_info(f"{session.name} released the box")
+        self.log_info(f"{session.name} disconnected")
+
+    def _command(self, session: Session, packet: memoryview) -> None:
+        received = session._received
+        cmd = bytes(packet[1:4])
+        if cmd[:2] == b"rd":
+            self._read(session, bytes(packet), chr(cmd[2]), received)
+        elif cmd == b"ver":
+            self._read(session, bytes(packet), "v", received)
+        elif cmd[:2] == b"mo" and 0x30 <= cmd[2] <= 0x33:
+            self._set_feedback(session, cmd[2] - 0x30, received)
+        elif cmd[0] in WRITE_BYTES or cmd in WRITE_COMMANDS:
+            self._write(session, packet, received)
+        else:
+            self.log_warning(f"{session.name} sent unknown command {bytes(packet)}")
+
+    def _read(self, session: Session, cmd: bytes, code: str, received: float) -> None:
+        fut = self._box.expect_packet(code)
+        self._queue(cmd, received)
+        self._loop.create_task(self._reply(session, code, fut))
+
+    async def _reply(self, session: Session, code: str, fut: asyncio.Future) -> None:
+        try:
+            _, _, *values = await self._box.wait_packet(
+                code, fut, timeout=DEFAULT_TIMEOUT
+            )
+        except ConnectionError:
+            self.log_debug(f"Connection lost waiting for '{code}' for {session.name}")
+            return
+        except asyncio.TimeoutError:
+            self.metrics.session_timeouts += 1
+            self.log_warning(
+                f"Timeout waiting for '{code}' requested by {session.name}"
+            )
+            return
+        if not session.closed:
+            session.send(format_value(code, *values))
+
+    def _set_feedback(self, session: Session, mode: int, received: float) -> None:
+        session.feedback = mode != 0
+        subscribed = any(s.feedback for s in self._sessions)
+        if subscribed and not self._feedback:
+            self._feedback = mode
+            self._queue(bytes(f"[mo{mode}]", "ascii"), received)
+        elif not subscribed and self._feedback:
+            self._feedback = 0
+            self._queue(b"[mo0]", received)
+
+    def _write(self, session: Session, packet: memoryview, received: float) -> None:
+        if self._owner is None:
+            self._owner = session
+            self.log_info(f"{session.name} owns the box")
+        elif self._owner is not session:
+            self.metrics.rejected += 1
+            session.rejected += 1
+            if session.rejected == 1:
+                self.log_warning(
+                    f"{session.name} is read-only, {self._owner.name} owns the box"
+                )
+            return
+        self._queue(packet, received)
+
+    def _queue(self, cmd: bytes, received: float) -> None:
+        # The box restores the state changed by the commands after a reconnect
+        self._box.track_command(cmd)
+        if not self._pending or received < self._pending_since:
+            self._pending_since = received
+        self._pending += cmd
+        self.metrics.commands += 1
+        self._schedule()
+
+    def _schedule_session(self, session: Session) -> None:
+        self._dirty.append(session)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        if self._pending:
+            # The transport may hold on to the buffer, write a copy
+            self._box.send_frame(bytes(self._pending))
+            self._pending.clear()
+            self.metrics.batches += 1
+            self.metrics.upstream.add(time.perf_counter() - self._pending_since)
+        for session in self._dirty:
+            since = session._flush()
+            self.metrics.downstream.add(time.perf_counter() - since)
+        self._dirty.clear()
+
+    def _telemetry_received(self, kind: TelemetryKind, sample: TelemetrySample) -> None:
+        if kind is TelemetryKind.Position:
+            data = format_value(
+                POSITION_CODES[sample.motor], sample.target, sample.feedback
+            )
+        else:
+            data = format_value(
+                PWM_STATUS_CODES[sample.motor], sample.pwm, sample.status
+            )
+        for session in self._sessions:
+            if session.feedback:
+                session.send(data, feedback=True)
@@ -0,0 +1,254 @@
+"""
+Motion effects evaluated in vectorized chunks.
+
+An effect maps an array of times (seconds) to an array of displacements of shape
+(len(t), 3), one column per motor, in position units around the center of the
+motor range. Effects are composed with `+` and scaled with `*`, and are turned
+into clamped integer positions by `EffectStream`, which precomputes them a chunk
+at a time so that producing a position is a list lookup.
+
+    stream = EffectStream(Puke(amplitude=400) + Noise(amplitude=30), rate=200)
+    a, b, c = stream.at(t)
+"""
+
+import math
+
+import numpy as np
+
+from typing import List, Sequence, Union
+
+from .protocol import AXES, CENTER, POSITION_MAX, POSITION_MIN
+
+# sin(t) as used by the example scripts
+DEFAULT_FREQUENCY = 1 / (2 * math.pi)
+DEFAULT_AMPLITUDE = 512
+DEFAULT_CHUNK_DURATION = 0.1
+
+NOISE_TABLE_SIZE = 4096
+
+AxisValues = Union[float, Sequence[float]]
+
+
+def _axis_array(value: AxisValues) -> np.ndarray:
+    arr = np.broadcast_to(np.asarray(value, dtype=np.float64), (AXES,))
+    return arr.copy()
+
+
+class Effect:
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        raise NotImplementedError()
+
+    def __add__(self, other: "Effect") -> "Effect":
+        return Sum(self, other)
+
+    def __mul__(self, scale: AxisValues) -> "Effect":
+        return Scaled(self, scale)
+
+    __rmul__ = __mul__
+
+
+class Sum(Effect):
+    def __init__(self, *effects: Effect) -> None:
+        self.effects = effects
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        res = self.effects[0].evaluate(t)
+        for e in self.effects[1:]:
+            res += e.evaluate(t)
+        return res
+
+
+class Scaled(Effect):
+    def __init__(self, effect: Effect, scale: AxisValues) -> None:
+        self.effect = effect
+        self.scale = _axis_array(scale)
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        return self.effect.evaluate(t) * self.scale
+
+
+class Sine(Effect):
+    """
+    Sine wave, `gains` and `phase` are either a single value or one per motor
+    """
+
+    def __init__(
+        self,
+        amplitude: float = DEFAULT_AMPLITUDE,
+        frequency: float = DEFAULT_FREQUENCY,
+        *,
+        phase: AxisValues = 0.0,
+        gains: AxisValues = (1.0, 0.0, 0.0),
+    ) -> None:
+        self.amplitude = amplitude
+        self.omega = 2 * math.pi * frequency
+        self.phase = _axis_array(phase)
+        self.gains = _axis_array(gains) * amplitude
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        return np.sin(np.add.outer(t * self.omega, self.phase)) * self.gains
+
+
+class Rock(Sine):
+    """
+    Motors A and B move in opposite directions, or together when sideways
+    """
+
+    def __init__(
+        self,
+        amplitude: float = DEFAULT_AMPLITUDE,
+        frequency: float = DEFAULT_FREQUENCY,
+        *,
+        sideways: bool = False,
+    ) -> None:
+        super().__init__(
+            amplitude, frequency, gains=(1.0, sideways and 1.0 or -1.0, 0.0)
+        )
+
+
+class Puke(Sine):
+    """
+    All three motors on a sine wave with a phase shift of 2π/3
+    """
+
+    def __init__(
+        self,
+        amplitude: float = DEFAULT_AMPLITUDE,
+        frequency: float = DEFAULT_FREQUENCY,
+    ) -> None:
+        super().__init__(
+            amplitude,
+            frequency,
+            phase=(0.0, math.pi / 3 * 2, math.pi / 3 * 4),
+            gains=1.0,
+        )
+
+
+class Noise(Effect):
+    """
+    Smooth random motion, random knots `frequency` times a second interpolated
+    with a cosine. The knots repeat every NOISE_TABLE_SIZE / frequency seconds.
+    """
+
+    def __init__(
+        self,
+        amplitude: float,
+        frequency: float = 2.0,
+        *,
+        gains: AxisValues = 1.0,
+        seed: int = None,
+    ) -> None:
+        rng = np.random.default_rng(seed)
+        self.frequency = frequency
+        self.knots = rng.uniform(-1.0, 1.0, (NOISE_TABLE_SIZE, AXES))
+        self.knots *= _axis_array(gains) * amplitude
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        x = t * self.frequency
+        k = np.floor(x)
+        w = (0.5 - 0.5 * np.cos((x - k) * math.pi))[:, None]
+        k = k.astype(np.int64) % NOISE_TABLE_SIZE
+        return self.knots[k] * (1 - w) + self.knots[(k + 1) % NOISE_TABLE_SIZE] * w
+
+
+class Ramp(Effect):
+    """
+    Linear move from zero to `amplitude` starting at `start` over `duration` seconds,
+    holding the value afterwards
+    """
+
+    def __init__(
+        self,
+        amplitude: float,
+        start: float,
+        duration: float,
+        *,
+        gains: AxisValues = 1.0,
+    ) -> None:
+        self.start = start
+        self.duration = duration
+        self.gains = _axis_array(gains) * amplitude
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        x = np.clip((t - self.start) / self.duration, 0.0, 1.0)
+        return np.multiply.outer(x, self.gains)
+
+
+class Bump(Effect):
+    """
+    Raised cosine pulse of `amplitude` starting at `start`, lasting `duration` seconds
+    """
+
+    def __init__(
+        self,
+        amplitude: float,
+        start: float,
+        duration: float,
+        *,
+        gains: AxisValues = 1.0,
+    ) -> None:
+        self.start = start
+        self.duration = duration
+        self.gains = _axis_array(gains) * amplitude
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        x = np.clip((t - self.start) / self.duration, 0.0, 1.0)
+        return np.multiply.outer(0.5 - 0.5 * np.cos(x * 2 * math.pi), self.gains)
+
+
+class EffectStream:
+    """
+    Positions of an effect sampled at `rate`, precomputed in chunks of `chunk_duration`
+    seconds and clamped to the position limits. Sample k is at time `start + k / rate`.
+    """
+
+    def __init__(
+        self,
+        effect: Effect,
+        *,
+        rate: float,
+        chunk_duration: float = DEFAULT_CHUNK_DURATION,
+        start: float = 0.0,
+        center: AxisValues = CENTER,
+    ) -> None:
+        self.effect = effect
+        self.rate = rate
+        self.start = start
+        self.center = _axis_array(center)
+        self._chunk_len = max(1, int(round(chunk_duration * rate)))
+        self._base = 0
+        self._chunk: List[List[int]] = []
+        self._index = 0
+
+    def __iter__(self) -> "EffectStream":
+        return self
+
+    def __next__(self) -> List[int]:
+        res = self.sample(self._index)
+        self._index += 1
+        return res
+
+    def at(self, t: float) -> List[int]:
+        """
+        Positions of the sample closest to time t
+        """
+        return self.sample(int(round((t - self.start) * self.rate)))
+
+    def sample(self, index: int) -> List[int]:
+        offset = index - self._base
+        if offset < 0 or len(self._chunk) <= offset:
+            self._fill(index)
+            offset = 0
+        return self._chunk[offset]
+
+    def evaluate(self, t: np.ndarray) -> np.ndarray:
+        """
+        Clamped integer positions at times t, shape (len(t), 3)
+        """
+        pos = np.rint(self.effect.evaluate(t) + self.center)
+        return np.clip(pos, POSITION_MIN, POSITION_MAX).astype(np.int64)
+
+    def _fill(self, index: int) -> None:
+        t = self.start + (index + np.arange(self._chunk_len)) / self.rate
+        self._chunk = self.evaluate(t).tolist()
+        self._base = index
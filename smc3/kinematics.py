@@ -0,0 +1,285 @@
+"""
+Inverse kinematics of 2- and 3-actuator platforms.
+
+A platform rotates about a pivot, the origin of the coordinates: x forward,
+y left, z up, in meters. Each actuator lifts a mount point of the platform,
+given relative to the pivot at the neutral pose. A pose is (pitch, roll, heave):
+positive pitch raises the nose, positive roll lowers the right side, heave
+lifts the platform, the same convention as `smc3.cueing`.
+
+The displacement of every mount point is computed in closed form, the nonlinear
+part, from a displacement to an actuator position, is precomputed per actuator
+as a table on a uniform grid and interpolated. `Platform.inverse` evaluates
+a single pose in plain Python, `Platform.inverse_batch` a whole trajectory
+with NumPy.
+
+    platform = three_actuator()
+    a, b, c = platform.inverse(math.radians(5), 0.0, 0.02)
+    box.set_positions(a=a, b=b, c=c)
+"""
+
+import math
+
+import numpy as np
+
+from typing import NamedTuple, Sequence, Tuple, Union
+
+from .protocol import CENTER, POSITION_MAX, POSITION_MIN
+
+DEFAULT_TABLE_SIZE = 1024
+# Crank angle at the position limits
+DEFAULT_MAX_ANGLE = math.radians(60)
+
+
+class LinearActuator(NamedTuple):
+    """
+    Actuator changing its length, between a base joint right below the mount
+    at the neutral pose and the mount. `stroke` is the travel between
+    the position limits, `length` the neutral length.
+    """
+
+    x: float
+    y: float
+    z: float = 0.0
+    stroke: float = 0.1
+    length: float = 0.4
+    invert: bool = False
+
+    def table(self, size: int) -> Tuple[float, float, np.ndarray]:
+        """
+        Positions on a uniform grid of displacements from the first value
+        to the second one
+        """
+        half = self.stroke / 2
+        positions = np.linspace(POSITION_MIN, POSITION_MAX, size)
+        if self.invert:
+            positions = positions[::-1]
+        return -half, half, positions
+
+
+class CrankActuator(NamedTuple):
+    """
+    Rotary actuator, e.g. a wiper motor, with a crank of radius `arm` pushing
+    the mount with a rod of length `link`. The crank is horizontal and the rod
+    vertical at the neutral pose, the position limits correspond to the crank
+    angles of ±`max_angle`. The displacement of the mount is taken as vertical.
+    """
+
+    x: float
+    y: float
+    z: float = 0.0
+    arm: float = 0.05
+    link: float = 0.3
+    max_angle: float = DEFAULT_MAX_ANGLE
+    invert: bool = False
+
+    def lift(self, angle: np.ndarray) -> np.ndarray:
+        """
+        Vertical displacement of the mount at crank `angle`
+        """
+        return (
+            self.arm * np.sin(angle)
+            + np.sqrt(self.link**2 - (self.arm * (1 - np.cos(angle))) ** 2)
+            - self.link
+        )
+
+    def table(self, size: int) -> Tuple[float, float, np.ndarray]:
+        if not 0 < self.max_angle < math.pi / 2 or self.link <= self.arm:
+            raise ValueError(f"Invalid crank geometry {self}")
+        # The lift is monotonic on the angle range, sample it densely
+        # and invert it on the uniform grid
+        angles = np.linspace(-self.max_angle, self.max_angle, size * 8)
+        lift = self.lift(angles)
+        grid = np.linspace(lift[0], lift[-1], size)
+        angle = np.interp(grid, lift, angles)
+        positions = CENTER + angle / self.max_angle * (POSITION_MAX - CENTER)
+        if self.invert:
+            positions = 2 * CENTER - positions
+        return float(lift[0]), float(lift[-1]), positions
+
+
+Actuator = Union[LinearActuator, CrankActuator]
+
+
+class Platform:
+    """
+    Inverse kinematics of a platform with 2 or 3 actuators driven by motors
+    A, B and C in order. With a `fixed_pivot` the platform can only rotate
+    and heave is ignored. Poses beyond the reach of an actuator are clamped
+    to its position limits and counted in `saturated`.
+    """
+
+    def __init__(
+        self,
+        actuators: Sequence[Actuator],
+        *,
+        fixed_pivot: bool = False,
+        table_size: int = DEFAULT_TABLE_SIZE,
+    ) -> None:
+        if not 2 <= len(actuators) <= 3:
+            raise ValueError(f"Unsupported number of actuators {len(actuators)}")
+        if table_size < 2:
+            raise ValueError(f"Invalid table size {table_size}")
+        self.actuators = list(actuators)
+        self.fixed_pivot = fixed_pivot
+        self.table_size = table_size
+        self.saturated = 0
+
+        tables = [a.table(table_size) for a in self.actuators]
+        self._low = np.array([lo for lo, _, _ in tables])
+        self._scale = np.array([(table_size - 1) / (hi - lo) for lo, hi, _ in tables])
+        self._tables = np.stack([t for _, _, t in tables])
+        self._mounts = np.array([(a.x, a.y, a.z) for a in self.actuators])
+        # Length of the linear actuators, 0 for the cranks
+        self._lengths = np.array(
+            [isinstance(a, LinearActuator) and a.length or 0.0 for a in self.actuators]
+        )
+        self._linear = self._lengths > 0
+        # Plain Python copies for the single pose path
+        self._scalar = [
+            (a.x, a.y, a.z, length, low, scale, table.tolist())
+            for a, length, low, scale, table in zip(
+                self.actuators,
+                self._lengths.tolist(),
+                self._low.tolist(),
+                self._scale.tolist(),
+                self._tables,
+            )
+        ]
+
+    def __len__(self) -> int:
+        return len(self.actuators)
+
+    def inverse(self, pitch: float, roll: float, heave: float = 0.0) -> Tuple[int, ...]:
+        """
+        Actuator positions for a pose, one per actuator
+        """
+        sp = math.sin(pitch)
+        cp = math.cos(pitch)
+        sr = math.sin(roll)
+        cr = math.cos(roll)
+        if self.fixed_pivot:
+            heave = 0.0
+        last = self.table_size - 1
+        res = []
+        for x, y, z, length, low, scale, table in self._scalar:
+            xp = x * cp - z * sp
+            zp = x * sp + z * cp
+            dz = y * sr + zp * cr + heave - z
+            if length:
+                dx = xp - x
+                dy = y * cr - zp * sr - y
+                d = math.sqrt(dx * dx + dy * dy + (length + dz) ** 2) - length
+            else:
+                d = dz
+            u = (d - low) * scale
+            if u <= 0.0:
+                if u < 0.0:
+                    self.saturated += 1
+                res.append(round(table[0]))
+                continue
+            if u >= last:
+                if u > last:
+                    self.saturated += 1
+                res.append(round(table[last]))
+                continue
+            i = int(u)
+            v = table[i]
+            res.append(round(v + (table[i + 1] - v) * (u - i)))
+        return tuple(res)
+
+    def __call__(self, pose: Sequence[float]) -> Tuple[int, ...]:
+        """
+        Positions for a (pitch, roll, heave) pose, usable as the mixer
+        of `smc3.cueing.CueingPipeline`
+        """
+        return self.inverse(*pose)
+
+    def displacements(self, poses: np.ndarray) -> np.ndarray:
+        """
+        Displacements of the actuators for poses of shape (samples, 3),
+        or (samples, 2) without heave, shape (samples, actuators)
+        """
+        poses = np.asarray(poses, dtype=np.float64)
+        pitch = poses[:, 0:1]
+        roll = poses[:, 1:2]
+        x, y, z = self._mounts.T
+        sp = np.sin(pitch)
+        cp = np.cos(pitch)
+        sr = np.sin(roll)
+        cr = np.cos(roll)
+        xp = x * cp - z * sp
+        zp = x * sp + z * cp
+        dz = y * sr + zp * cr - z
+        if poses.shape[1] > 2 and not self.fixed_pivot:
+            dz += poses[:, 2:3]
+        if not self._linear.any():
+            return dz
+        length = self._lengths
+        dx = xp - x
+        dy = y * cr - zp * sr - y
+        linear = np.sqrt(dx * dx + dy * dy + (length + dz) ** 2) - length
+        return np.where(self._linear, linear, dz)
+
+    def inverse_batch(self, poses: np.ndarray) -> np.ndarray:
+        """
+        Actuator positions for a whole trajectory of poses of shape (samples, 3),
+        as an integer array of shape (samples, actuators)
+        """
+        u = (self.displacements(poses) - self._low) * self._scale
+        last = self.table_size - 1
+        self.saturated += int(np.count_nonzero((u < 0) | (u > last)))
+        np.clip(u, 0, last, out=u)
+        i = np.minimum(u.astype(np.intp), last - 1)
+        cols = np.arange(len(self.actuators))
+        lo = self._tables[cols, i]
+        hi = self._tables[cols, i + 1]
+        return np.rint(lo + (hi - lo) * (u - i)).astype(np.int32)
+
+
+def two_actuator(
+    *,
+    width: float = 0.5,
+    offset: float = 0.4,
+    arm: float = 0.06,
+    link: float = 0.3,
+    max_angle: float = DEFAULT_MAX_ANGLE,
+    table_size: int = DEFAULT_TABLE_SIZE,
+) -> Platform:
+    """
+    Seat mover on a fixed pivot, crank actuators A and B `offset` meters behind
+    it, `width` apart on the left and right
+    """
+    return Platform(
+        [
+            CrankActuator(-offset, width / 2, arm=arm, link=link, max_angle=max_angle),
+            CrankActuator(-offset, -width / 2, arm=arm, link=link, max_angle=max_angle),
+        ],
+        fixed_pivot=True,
+        table_size=table_size,
+    )
+
+
+def three_actuator(
+    *,
+    width: float = 0.5,
+    rear: float = 0.3,
+    front: float = 0.3,
+    arm: float = 0.05,
+    link: float = 0.3,
+    max_angle: float = DEFAULT_MAX_ANGLE,
+    table_size: int = DEFAULT_TABLE_SIZE,
+) -> Platform:
+    """
+    Platform carried by crank actuators A and B `rear` meters behind the center,
+    `width` apart on the left and right, and C `front` meters ahead of it
+    """
+    crank = dict(arm=arm, link=link, max_angle=max_angle)
+    return Platform(
+        [
+            CrankActuator(-rear, width / 2, **crank),
+            CrankActuator(-rear, -width / 2, **crank),
+            CrankActuator(front, 0.0, **crank),
+        ],
+        table_size=table_size,
+    )
@@ -0,0 +1,326 @@
+"""
+Runtime metrics.
+
+A metric set keeps its counters and gauges as plain attributes, updated on the
+hot path without any formatting, locking or lookups, and describes them in the
+class level DESCRIPTIONS table, which is only consulted when the values are
+exported. Metric sets are exported with `as_dict`, or gathered in
+a `MetricsRegistry` and rendered as a Prometheus text page.
+
+    registry = MetricsRegistry()
+    registry.register(box.metrics, device=box.device)
+    print(registry.prometheus())
+
+`serve_prometheus` serves the page over HTTP for scraping.
+"""
+
+import asyncio
+import bisect
+
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+DEFAULT_PREFIX = "smc3"
+
+# Upper bounds of lateness buckets in seconds, the last bucket is open
+LATENESS_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+)
+
+# Upper bounds of request round trip time buckets in seconds
+RTT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+)
+
+# Upper bounds of write pause duration buckets in seconds
+PAUSE_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram of float samples
+    """
+
+    bounds: Sequence[float]
+    counts: List[int]
+
+    def __init__(self, bounds: Sequence[float] = LATENESS_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.count and self.total / self.count or 0.0
+
+    def as_dict(self) -> Dict[str, int]:
+        res = {f"<={b * 1000:g}ms": c for b, c in zip(self.bounds, self.counts)}
+        res[f">{self.bounds[-1] * 1000:g}ms"] = self.counts[-1]
+        return res
+
+    def __str__(self) -> str:
+        buckets = " ".join(f"{k}: {v}" for k, v in self.as_dict().items() if v)
+        return f"count {self.count} mean {self.mean * 1000:.3f}ms max {self.max * 1000:.3f}ms {buckets}"
+
+
+class Metrics:
+    """
+    Base of metric sets. DESCRIPTIONS maps attribute names to the metric type
+    and help text, LABELS maps attributes holding a list of counters indexed by
+    a byte to the name of the label, the label value is the character.
+    """
+
+    DESCRIPTIONS: Dict[str, Tuple[str, str]] = {}
+    LABELS: Dict[str, str] = {}
+
+    def reset(self) -> None:
+        raise NotImplementedError()
+
+    def _values(self, name: str) -> Iterator[Tuple[Dict[str, str], Any]]:
+        value = getattr(self, name)
+        label = self.LABELS.get(name)
+        if label is None:
+            yield {}, value
+            return
+        for i, v in enumerate(value):
+            if v:
+                yield {label: chr(i)}, v
+
+    def as_dict(self) -> Dict[str, Any]:
+        res = {}
+        for name, (kind, _) in self.DESCRIPTIONS.items():
+            value = getattr(self, name)
+            if kind == HISTOGRAM:
+                res[name] = {
+                    "count": value.count,
+                    "sum": value.total,
+                    "max": value.max,
+                    "buckets": value.as_dict(),
+                }
+            elif name in self.LABELS:
+                res[name] = {
+                    labels[self.LABELS[name]]: v for labels, v in self._values(name)
+                }
+            else:
+                res[name] = value
+        return res
+
+
+class LinkMetrics(Metrics):
+    """
+    Traffic of a connection to the box
+    """
+
+    DESCRIPTIONS = {
+        "bytes_in": (COUNTER, "Bytes received from the box"),
+        "bytes_out": (COUNTER, "Bytes written to the box"),
+        "writes": (COUNTER, "Writes to the transport"),
+        "packets": (COUNTER, "Packets received from the box by type"),
+        "unknown_packets": (COUNTER, "Packets of unknown type"),
+        "dropped_bytes": (COUNTER, "Bytes skipped by the frame parser"),
+        "resyncs": (COUNTER, "Frame parser resynchronizations"),
+        "timeouts": (COUNTER, "Requests timed out"),
+        "write_buffer_high_water": (GAUGE, "Largest transport write buffer, bytes"),
+        "pauses": (COUNTER, "Times writing was paused by the transport"),
+        "disconnects": (COUNTER, "Connections to the box lost"),
+        "reconnects": (COUNTER, "Connections to the box restored"),
+        "queued": (COUNTER, "Writes held while writing was paused"),
+        "coalesced": (
+            COUNTER,
+            "Position commands replaced by a newer one while writing was paused",
+        ),
+        "pause_duration": (HISTOGRAM, "Duration of write pauses, seconds"),
+        "rtt": (HISTOGRAM, "Request round trip time, seconds"),
+    }
+    LABELS = {"packets": "type"}
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.writes = 0
+        self.packets = [0] * 256
+        self.unknown_packets = 0
+        self.dropped_bytes = 0
+        self.resyncs = 0
+        self.timeouts = 0
+        self.write_buffer_high_water = 0
+        self.pauses = 0
+        self.disconnects = 0
+        self.reconnects = 0
+        self.queued = 0
+        self.coalesced = 0
+        self.pause_duration = Histogram(PAUSE_BUCKETS)
+        self.rtt = Histogram(RTT_BUCKETS)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    values = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+    return f"{{{values}}}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    """
+    Metric sets exported together, each with its own labels
+    """
+
+    def __init__(self, prefix: str = DEFAULT_PREFIX) -> None:
+        self.prefix = prefix
+        self._sets: List[Tuple[Metrics, Dict[str, str]]] = []
+
+    def register(self, metrics: Metrics, **labels) -> None:
+        """
+        Add a metric set. A metric of the same name as one of another set
+        must have the same type and help, and different label values.
+        """
+        labels = {k: str(v) for k, v in labels.items()}
+        for other, other_labels in self._sets:
+            shared = metrics.DESCRIPTIONS.keys() & other.DESCRIPTIONS.keys()
+            for name in sorted(shared):
+                if metrics.DESCRIPTIONS[name] != other.DESCRIPTIONS[name]:
+                    raise ValueError(
+                        f"Metric {name} is already registered with another type "
+                        "or help"
+                    )
+                if labels == other_labels:
+                    raise ValueError(
+                        f"Metric {name} is already registered with labels {labels}"
+                    )
+        self._sets.append((metrics, labels))
+
+    def unregister(self, metrics: Metrics) -> None:
+        self._sets = [(m, l) for m, l in self._sets if m is not metrics]
+
+    def as_dict(self) -> List[Dict[str, Any]]:
+        return [
+            {"labels": dict(labels), "metrics": metrics.as_dict()}
+            for metrics, labels in self._sets
+        ]
+
+    def prometheus(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        families: Dict[str, List[str]] = {}
+        for metrics, labels in self._sets:
+            for name, (kind, help) in metrics.DESCRIPTIONS.items():
+                metric = f"{self.prefix}_{name}"
+                if kind == COUNTER:
+                    metric += "_total"
+                lines = families.get(metric)
+                if lines is None:
+                    lines = families[metric] = [
+                        f"# HELP {metric} {help}",
+                        f"# TYPE {metric} {kind}",
+                    ]
+                if kind == HISTOGRAM:
+                    lines.extend(
+                        self._histogram(metric, labels, getattr(metrics, name))
+                    )
+                    continue
+                for extra, value in metrics._values(name):
+                    lines.append(
+                        f"{metric}{_format_labels({**labels, **extra})} "
+                        f"{_format_value(value)}"
+                    )
+        return "".join(line + "\n" for lines in families.values() for line in lines)
+
+    def _histogram(
+        self, metric: str, labels: Dict[str, str], hist: Histogram
+    ) -> Iterator[str]:
+        cumulative = 0
+        for bound, count in zip(hist.bounds, hist.counts):
+            cumulative += count
+            le = _format_labels({**labels, "le": repr(float(bound))})
+            yield f"{metric}_bucket{le} {cumulative}"
+        le = _format_labels({**labels, "le": "+Inf"})
+        yield f"{metric}_bucket{le} {hist.count}"
+        yield f"{metric}_sum{_format_labels(labels)} {_format_value(hist.total)}"
+        yield f"{metric}_count{_format_labels(labels)} {hist.count}"
+
+
+async def serve_prometheus(
+    registry: MetricsRegistry, host: str, port: int
+) -> asyncio.AbstractServer:
+    """
+    Minimal HTTP server answering every GET with the Prometheus page
+    of the registry
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        if request.startswith(b"GET "):
+            body = registry.prometheus().encode()
+            status = b"200 OK"
+        else:
+            body = b""
+            status = b"405 Method Not Allowed"
+        writer.write(
+            b"HTTP/1.0 " + status + b"\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,270 @@
+"""
+Latency compensation of position commands.
+
+The feedback of a motor follows its commanded position with a delay, the sum
+of the link latency both ways and of the response of the actuator.
+`LatencyPredictor` estimates this delay per motor from the feedback stream
+and leads the commands by it, extrapolating the desired trajectory, so that
+the feedback follows the desired position instead of lagging behind it.
+
+The delay is estimated by matching every feedback sample against the command
+history delayed by each lag on a grid, the lag with the smallest exponentially
+weighted squared error wins. The feedback is only compared while the commands
+move, a platform at rest tells nothing about the delay.
+
+    predictor = LatencyPredictor(box)
+    box.enable_feedback(MotorNumber.A)
+    ...
+    a, b, c = predictor.lead(shaper.step(), shaper.velocities, shaper.accelerations)
+    box.set_positions(a=a, b=b, c=c)
+    print(predictor.metrics.as_dict())
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from .box import Box
+from .loggable import Loggable
+from .metrics import COUNTER, GAUGE, Metrics
+from .protocol import AXES, POSITION_MAX, POSITION_MIN, Motor
+from .telemetry import TelemetryKind, TelemetrySample
+
+# Telemetry positions are scaled down to 0-255
+FEEDBACK_SCALE = 4
+
+DEFAULT_MAX_LAG = 0.25
+DEFAULT_LAG_STEP = 0.005
+# Time constant of the error averaging, seconds
+DEFAULT_WINDOW = 2.0
+# Commands kept per motor, must cover the largest lag at the command rate
+DEFAULT_HISTORY = 512
+# Smoothing of the velocity estimated from the positions, when not given
+DEFAULT_SMOOTHING = 0.2
+# Smallest range of the commands over the lag grid, in position units,
+# for a feedback sample to be used for the estimate
+MIN_EXCURSION = 4
+# Feedback samples used before the estimate is trusted
+MIN_SAMPLES = 30
+# Largest RMS error of the delay model, in position units, for the commands
+# to be led, a saturated actuator isn't a delay and leading it makes it worse
+MAX_MODEL_ERROR = 20.0
+
+
+class PredictionMetrics(Metrics):
+    """
+    Delay estimate and prediction error per motor
+    """
+
+    DESCRIPTIONS = {
+        "lag_samples": (COUNTER, "Feedback samples used for the delay estimate"),
+        "lag": (
+            GAUGE,
+            "Estimated delay from a command to the feedback following it, seconds",
+        ),
+        "lead": (GAUGE, "Lead of the commands over the desired positions, seconds"),
+        "model_error": (
+            GAUGE,
+            "RMS difference between the feedback and the command delayed "
+            "by the estimated lag, position units",
+        ),
+        "tracking_error": (
+            GAUGE,
+            "RMS difference between the feedback and the desired position, "
+            "position units",
+        ),
+    }
+    LABELS = {name: "motor" for name in DESCRIPTIONS}
+
+    def __init__(self, axes: int = AXES) -> None:
+        self.axes = axes
+        self.reset()
+
+    def reset(self) -> None:
+        self.lag_samples = [0] * self.axes
+        self.lag = [0.0] * self.axes
+        self.lead = [0.0] * self.axes
+        self.model_error = [0.0] * self.axes
+        self.tracking_error = [0.0] * self.axes
+
+    def _values(self, name: str) -> Iterator[Tuple[dict, float]]:
+        # Indexed by axis rather than by byte
+        for motor, value in zip(Motor, getattr(self, name)):
+            yield {"motor": motor.name}, value
+
+
+class LatencyPredictor(Loggable):
+    """
+    Estimates the delay of the feedback of the `axes` motors of the box and
+    leads the commanded positions by it, at most by `max_lead` seconds.
+    The delay is searched between 0 and `max_lag` seconds by `lag_step`.
+    """
+
+    def __init__(
+        self,
+        box: Box,
+        *,
+        axes: int = AXES,
+        max_lag: float = DEFAULT_MAX_LAG,
+        lag_step: float = DEFAULT_LAG_STEP,
+        max_lead: float = None,
+        window: float = DEFAULT_WINDOW,
+        history: int = DEFAULT_HISTORY,
+        smoothing: float = DEFAULT_SMOOTHING,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("PREDICT"))
+        if not 0 < lag_step <= max_lag:
+            raise ValueError(f"Invalid lag grid {lag_step} to {max_lag}")
+        self.box = box
+        self.axes = axes
+        self.lags = np.arange(0.0, max_lag + lag_step / 2, lag_step)
+        self.lag_step = lag_step
+        self.max_lead = max_lag if max_lead is None else max_lead
+        self.window = window
+        self.smoothing = smoothing
+        self.metrics = PredictionMetrics(axes)
+
+        # Rings stored twice back to back, the history is a contiguous range
+        self._capacity = history
+        self._times = np.zeros(history * 2)
+        self._commands = np.zeros((axes, history * 2))
+        self._desired = np.zeros((axes, history * 2))
+        self._next = 0
+        self._count = 0
+
+        self._cost = np.zeros((axes, len(self.lags)))
+        self._model_square = [0.0] * axes
+        self._tracking_square = [0.0] * axes
+        self._feedback_time = [0.0] * axes
+
+        self._time = 0.0
+        self._last = [None] * axes
+        self._velocity = [0.0] * axes
+        box.add_listener(self._telemetry_received)
+
+    def close(self) -> None:
+        self.box.remove_listener(self._telemetry_received)
+
+    @property
+    def lag(self) -> List[float]:
+        """
+        Estimated delay of each motor, seconds
+        """
+        return list(self.metrics.lag)
+
+    def reset(self) -> None:
+        self._next = 0
+        self._count = 0
+        self._cost[:] = 0.0
+        self._model_square = [0.0] * self.axes
+        self._tracking_square = [0.0] * self.axes
+        self._last = [None] * self.axes
+        self._velocity = [0.0] * self.axes
+        self.metrics.reset()
+
+    def lead(
+        self,
+        positions: Sequence[Optional[float]],
+        velocities: Sequence[float] = None,
+        accelerations: Sequence[float] = None,
+    ) -> List[Optional[int]]:
+        """
+        Commanded positions for the desired positions, to be written right away.
+        The trajectory is extrapolated with the velocities and accelerations,
+        in position units per second and second², if given, e.g. those of
+        a `smc3.trajectory.TrajectoryShaper`, otherwise with a velocity
+        estimated from the positions. Motors with position None are skipped.
+        """
+        now = self.box.loop.time()
+        dt = now - self._time
+        self._time = now
+        metrics = self.metrics
+        res: List[Optional[int]] = []
+        i = self._next
+        j = i + self._capacity
+        self._times[i] = self._times[j] = now
+        for axis, p in enumerate(positions[: self.axes]):
+            if p is None:
+                # The motor holds its previous command
+                for ring in (self._commands, self._desired):
+                    ring[axis, i] = ring[axis, j] = ring[axis, j - 1]
+                res.append(None)
+                continue
+            if velocities is not None:
+                v = velocities[axis]
+                a = accelerations[axis] if accelerations is not None else 0.0
+            else:
+                last = self._last[axis]
+                v = self._velocity[axis]
+                if last is not None and dt > 0.0:
+                    v += self.smoothing * ((p - last) / dt - v)
+                self._velocity[axis] = v
+                a = 0.0
+            self._last[axis] = p
+            lead = 0.0
+            if (
+                metrics.lag_samples[axis] >= MIN_SAMPLES
+                and metrics.model_error[axis] <= MAX_MODEL_ERROR
+            ):
+                lead = min(metrics.lag[axis], self.max_lead)
+            metrics.lead[axis] = lead
+            cmd = p + (v + a * lead / 2) * lead
+            cmd = min(max(cmd, POSITION_MIN), POSITION_MAX)
+            self._commands[axis, i] = self._commands[axis, j] = cmd
+            self._desired[axis, i] = self._desired[axis, j] = p
+            res.append(round(cmd))
+        self._next = (i + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+        return res
+
+    def _telemetry_received(self, kind: TelemetryKind, sample: TelemetrySample) -> None:
+        if kind is not TelemetryKind.Position:
+            return
+        axis = sample.motor.value - 1
+        if axis >= self.axes or self._count < 2 or self._last[axis] is None:
+            return
+        t = sample.timestamp
+        feedback = sample.feedback * FEEDBACK_SCALE + FEEDBACK_SCALE / 2
+        end = self._next + self._capacity
+        times = self._times[end - self._count : end]
+        if t - self.lags[-1] < times[0]:
+            # The history doesn't cover the lag grid yet
+            return
+        decay = math.exp(-max(t - self._feedback_time[axis], 0.0) / self.window)
+        self._feedback_time[axis] = t
+        metrics = self.metrics
+
+        desired = np.interp(t, times, self._desired[axis, end - self._count : end])
+        error = feedback - desired
+        self._tracking_square[axis] = self._tracking_square[
+            axis
+        ] * decay + error * error * (1.0 - decay)
+        metrics.tracking_error[axis] = math.sqrt(self._tracking_square[axis])
+
+        predicted = np.interp(
+            t - self.lags, times, self._commands[axis, end - self._count : end]
+        )
+        if predicted.max() - predicted.min() < MIN_EXCURSION:
+            return
+        errors = feedback - predicted
+        cost = self._cost[axis]
+        cost *= decay
+        cost += errors * errors
+        k = int(cost.argmin())
+        lag = self.lags[k]
+        if 0 < k < len(cost) - 1:
+            # Parabola through the neighbours
+            curvature = cost[k - 1] - 2 * cost[k] + cost[k + 1]
+            if curvature > 0:
+                lag += 0.5 * (cost[k - 1] - cost[k + 1]) / curvature * self.lag_step
+        error = errors[k]
+        self._model_square[axis] = self._model_square[axis] * decay + error * error * (
+            1.0 - decay
+        )
+        metrics.model_error[axis] = math.sqrt(self._model_square[axis])
+        metrics.lag[axis] = float(lag)
+        metrics.lag_samples[axis] += 1
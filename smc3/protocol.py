@@ -29,15 +29,37 @@ sensible limits as recommended above.
 import asyncio
 import logging
 import datetime
-
-from enum import Enum
-from typing import Tuple, Any, Dict, Callable
+import struct
+
+from collections import deque
+from enum import Enum, IntEnum
+from typing import (
+    Tuple,
+    Any,
+    Deque,
+    Dict,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
 
 from .loggable import Loggable
+from .metrics import LinkMetrics
 
 PACKET_LEN = 5
+PACKET_START = ord("[")
+PACKET_END = ord("]")
 BYTE_ORDER = "big"
 
+DEFAULT_BUFFER_SIZE = 4096
+# Transport write buffer size at which writing is paused and commands are held
+# in the client queue, at the default baud rate about 20ms of traffic
+DEFAULT_WRITE_BUFFER_LIMIT = 1024
+# Read commands in flight fitting the 64 bytes serial receive buffer of the SMC3
+READ_WINDOW = 12
+
 DEFAULT_BAUDRATE = 500000
 DEFAULT_TIMEOUT = datetime.timedelta(seconds=1)
 
@@ -66,11 +88,16 @@ class Parameter(Enum):
 
     @classmethod
     def _missing_(cls, value):
+        if value in _PSEUDO_PARAMS:
+            return _PSEUDO_PARAMS[value]
         p = Parameter.__new__(Parameter, "")
         p.code = value
+        _PSEUDO_PARAMS[value] = p
         return p
 
 
+_PSEUDO_PARAMS: Dict[str, Parameter] = {}
+
 READ_ONLY_PARAMS = [Parameter.PwmStatus, Parameter.Version]
 
 COMMAND_ARGC = {
@@ -87,6 +114,11 @@ COMMAND_ARG_LIMITS = {
     Parameter.Ks: (1, 20),
 }
 
+# Motors of a box, and the range of their positions
+AXES = len(Motor)
+POSITION_MIN, POSITION_MAX = COMMAND_ARG_LIMITS[Parameter.Position]
+CENTER = (POSITION_MIN + POSITION_MAX) // 2
+
 PARAM_VALUE_COUNT = {
     Parameter.Position: 2,
     Parameter.PwmStatus: 2,
@@ -113,97 +145,454 @@ def byte_to_param(byte: int) -> Tuple[Motor, Parameter]:
     return motor, param
 
 
+# Value layouts of a packet, `[` and type byte are followed by either
+# a single 16-bit value or two 8-bit values, then `]`
+VALUE_STRUCTS = {
+    1: struct.Struct(">xxHx"),
+    2: struct.Struct(">xxBBx"),
+}
+PACKET_STRUCTS = {
+    1: struct.Struct(">BBHB"),
+    2: struct.Struct(">BBBBB"),
+}
+
+
+class PacketCodec(NamedTuple):
+    code: str
+    motor: Motor
+    param: Parameter
+    arity: int
+    decode: Callable[[bytes], Tuple[int, ...]]
+
+
+def _make_decode_table() -> List[Optional[PacketCodec]]:
+    table = [None] * 256
+    for byte in range(ord("A"), 256):
+        motor, param = byte_to_param(byte)
+        arity = PARAM_VALUE_COUNT.get(param, 1)
+        table[byte] = PacketCodec(
+            chr(byte), motor, param, arity, VALUE_STRUCTS[arity].unpack
+        )
+    return table
+
+
+DECODE_TABLE = _make_decode_table()
+
+READ_COMMANDS = {
+    (motor, param): bytes(f"[rd{param_to_char(motor, param)}]", "ascii")
+    for motor in Motor
+    for param in Parameter
+    if param not in (Parameter.Unknown, Parameter.Version)
+}
+
+
+class CommandCodec(NamedTuple):
+    byte: int
+    argc: int
+    limits: Tuple[int, int]
+    pack: Callable[..., bytes]
+
+
+def _make_set_commands() -> Dict[Tuple[Motor, Parameter], CommandCodec]:
+    commands = {}
+    for param in Parameter:
+        if param == Parameter.Unknown or param in READ_ONLY_PARAMS:
+            continue
+        argc = COMMAND_ARGC.get(param, 1)
+        limits = COMMAND_ARG_LIMITS.get(param, (0, 0xFFFF))
+        if argc == 2:
+            limits = (0, 255)
+        for motor in Motor:
+            commands[(motor, param)] = CommandCodec(
+                ord(param_to_char(motor, param)),
+                argc,
+                limits,
+                PACKET_STRUCTS[argc].pack,
+            )
+    return commands
+
+
+SET_COMMANDS = _make_set_commands()
+
+POSITION_BYTES = tuple(ord(param_to_char(motor, Parameter.Position)) for motor in Motor)
+POSITIONS_FRAME_LEN = PACKET_LEN * len(POSITION_BYTES)
+
+
 def read_command(motor: Motor, param: Parameter) -> bytes:
-    return bytes(f"[rd{param_to_char(motor, param)}]", "ascii")
+    cmd = READ_COMMANDS.get((motor, param))
+    if cmd is None:
+        cmd = bytes(f"[rd{param_to_char(motor, param)}]", "ascii")
+    return cmd
 
 
 def set_command(motor: Motor, param: Parameter, *args) -> bytes:
-    argc = 1
-    if param in READ_ONLY_PARAMS:
-        raise TypeError(f"Paramenter {param.name} is read-only")
-    if param in COMMAND_ARGC:
-        argc = COMMAND_ARGC[param]
-    if len(args) != argc:
+    codec = SET_COMMANDS.get((motor, param))
+    if codec is None:
+        if param in READ_ONLY_PARAMS:
+            raise TypeError(f"Paramenter {param.name} is read-only")
+        raise TypeError(f"Parameter {param.name} cannot be set")
+    if len(args) != codec.argc:
         raise TypeError(
-            f"Invalid argument count for parameter {param.name}, got {len(args)} required {argc}"
+            f"Invalid argument count for parameter {param.name}, got {len(args)} required {codec.argc}"
         )
-    limits = param in COMMAND_ARG_LIMITS and COMMAND_ARG_LIMITS[param] or None
-
-    if argc == 2:
-        limits = (0, 255)
-    if limits:
-        for a in args:
-            if a < limits[0] or limits[1] < a:
-                raise ValueError(
-                    f"Value {a} out of range {limits} for param {param.name}"
-                )
-
-    return format_value(param_to_char(motor, param), *args)
+    lo, hi = codec.limits
+    for a in args:
+        if a < lo or hi < a:
+            raise ValueError(
+                f"Value {a} out of range {codec.limits} for param {param.name}"
+            )
+
+    return codec.pack(PACKET_START, codec.byte, *args, PACKET_END)
+
+
+def pack_positions(buffer: bytearray, positions: Sequence[Optional[int]]) -> int:
+    """
+    Pack position commands for all motors with a position that is not None
+    back to back into the buffer, in motor order.
+    Returns the number of bytes written.
+    """
+    lo, hi = COMMAND_ARG_LIMITS[Parameter.Position]
+    pack_into = PACKET_STRUCTS[1].pack_into
+    offset = 0
+    for byte, pos in zip(POSITION_BYTES, positions):
+        if pos is None:
+            continue
+        if pos < lo or hi < pos:
+            raise ValueError(
+                f"Value {pos} out of range {(lo, hi)} for param {Parameter.Position.name}"
+            )
+        pack_into(buffer, offset, PACKET_START, byte, pos, PACKET_END)
+        offset += PACKET_LEN
+    return offset
 
 
 def format_value(code: str, *args) -> bytes:
     argc = len(args)
     if argc < 1 or 2 < argc:
         raise ValueError(f"Invalid number of values {argc}")
-    cmd = bytes(f"[{code}", "ascii")
-    if argc == 1:
-        cmd = cmd + args[0].to_bytes(2, BYTE_ORDER) + b"]"
-    elif argc == 2:
-        cmd = cmd + args[0].to_bytes() + args[1].to_bytes() + b"]"
-    return cmd
+    return PACKET_STRUCTS[argc].pack(PACKET_START, ord(code), *args, PACKET_END)
+
+
+class Priority(IntEnum):
+    """
+    Classes of outbound commands, held commands of a lower class are written
+    first when the transport resumes writing
+    """
+
+    Safety = 0
+    Feedback = 1
+    Position = 2
+    Parameter = 3
+
+
+def _make_command_priorities() -> List[Priority]:
+    # Reads are kept in the parameter class so they are answered
+    # after the writes queued before them
+    table = [Priority.Parameter] * 256
+    # [ena] and [enN] go ahead of the positions they make the motors follow
+    table[ord("e")] = Priority.Safety
+    table[ord("m")] = Priority.Feedback
+    for byte in POSITION_BYTES:
+        table[byte] = Priority.Position
+    return table
+
+
+COMMAND_PRIORITIES = _make_command_priorities()
+
+
+class CommandQueue:
+    """
+    Outbound commands held while the transport doesn't accept writes.
+
+    Commands are split into packets and classified by type unless a priority
+    is given. Position commands are coalesced by packet type, so only the
+    latest unsent target of a motor survives, the other classes keep
+    all their commands in order.
+    """
+
+    def __init__(self) -> None:
+        self._queues = [bytearray() for _ in Priority]
+        self._positions: Dict[int, bytes] = {}
+        self.coalesced = 0
+
+    def __bool__(self) -> bool:
+        return bool(self._positions) or any(self._queues)
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes held
+        """
+        return PACKET_LEN * len(self._positions) + sum(len(q) for q in self._queues)
+
+    def push(self, cmd: bytes, priority: Priority = None) -> None:
+        if priority is not None and priority != Priority.Position:
+            self._queues[priority] += cmd
+            return
+        view = memoryview(cmd)
+        if len(view) % PACKET_LEN:
+            self._queues[Priority.Parameter if priority is None else priority] += view
+            return
+        positions = self._positions
+        for offset in range(0, len(view), PACKET_LEN):
+            packet = view[offset : offset + PACKET_LEN]
+            kind = packet[1]
+            if priority is None and COMMAND_PRIORITIES[kind] != Priority.Position:
+                self._queues[COMMAND_PRIORITIES[kind]] += packet
+                continue
+            if kind in positions:
+                self.coalesced += 1
+            positions[kind] = bytes(packet)
+
+    def pop(self) -> Optional[bytes]:
+        """
+        All the held commands of the highest priority class
+        """
+        for priority, queue in enumerate(self._queues):
+            if priority == Priority.Position and self._positions:
+                data = b"".join(self._positions.values())
+                self._positions.clear()
+                return data
+            if queue:
+                data = bytes(queue)
+                queue.clear()
+                return data
+        return None
+
+    def clear(self) -> None:
+        for queue in self._queues:
+            queue.clear()
+        self._positions.clear()
 
 
 def parse_packet(packet: bytes) -> Tuple[Motor, Parameter]:
     if len(packet) != PACKET_LEN:
         raise ValueError(f"Invalid packet size {len(packet)}")
-    motor, param = byte_to_param(packet[1])
-    value_count = 1
-    if param in PARAM_VALUE_COUNT:
-        value_count = PARAM_VALUE_COUNT[param]
-    if value_count == 1:
-        return (
-            chr(packet[1]),
-            motor,
-            param,
-            int.from_bytes(packet[2:4], byteorder=BYTE_ORDER, signed=False),
-        )
-    elif value_count == 2:
-        return chr(packet[1]), motor, param, packet[2], packet[3]
-    raise ValueError(f"Invalid value count setup for param {param.name}: {value_count}")
+    codec = DECODE_TABLE[packet[1]]
+    if codec is None:
+        raise ValueError(f"Invalid packet type {packet[1]:#04x}")
+    return (codec.code, codec.motor, codec.param, *codec.decode(packet))
 
 
 class Client(Loggable):
     _loop: asyncio.AbstractEventLoop
     _transport: asyncio.Transport
-    _outstanding: Dict[str, asyncio.Future]
+    _outstanding: Dict[str, Deque[asyncio.Future]]
 
     def __init__(
         self,
         loop: asyncio.AbstractEventLoop,
         position_cb: Callable[[Motor, int, int], None] = None,
         pwm_status_cb: Callable[[Motor, int, int], None] = None,
+        connection_lost_cb: Callable[[Optional[Exception]], None] = None,
     ) -> None:
         super().__init__()
         self.set_logger(logging.getLogger("CLIENT"))
         self._loop = loop
         self._transport = None
-        self._outstanding = dict[str, asyncio.Future]()
+        self._outstanding = dict[str, Deque[asyncio.Future]]()
         self._position_cb = position_cb
         self._pwm_status_sb = pwm_status_cb
-
-    def send_command(self, cmd: bytes) -> None:
+        self._handlers = {
+            Parameter.Position: position_cb,
+            Parameter.PwmStatus: pwm_status_cb,
+        }
+        self._connection_lost_cb = connection_lost_cb
+        self.metrics = LinkMetrics()
+        self._queue = CommandQueue()
+        self._paused_at: float = None
+        self._drain_waiters: List[asyncio.Future] = []
+
+    @property
+    def write_buffer_size(self) -> int:
+        """
+        Bytes held by the transport, 0 while there is no connection
+        """
+        if self._transport is None:
+            return 0
+        return self._transport.get_write_buffer_size()
+
+    @property
+    def connected(self) -> bool:
+        return self._transport is not None
+
+    @property
+    def paused(self) -> bool:
+        return self._paused_at is not None
+
+    @property
+    def queued(self) -> int:
+        """
+        Bytes of commands held while writing is paused
+        """
+        return self._queue.size
+
+    def send_command(self, cmd: bytes, priority: Priority = None) -> None:
+        """
+        Write a command or several back to back. While the transport has paused
+        writing or there is no connection the commands are held in a queue and
+        written when it resumes, by `priority` or the class of each packet,
+        see `CommandQueue`.
+        """
+        if self._paused_at is not None or self._queue or self._transport is None:
+            queue = self._queue
+            coalesced = queue.coalesced
+            queue.push(cmd, priority)
+            self.metrics.queued += 1
+            self.metrics.coalesced += queue.coalesced - coalesced
+            return
+        self._write(cmd)
+
+    def send_ahead(self, cmd: bytes) -> None:
+        """
+        Write commands right away, ahead of the ones held in the queue,
+        e.g. to restore the state of the box after a reconnect
+        """
+        if self._transport is None:
+            raise ConnectionError("Not connected to the box")
+        self._write(cmd)
+
+    def _write(self, cmd: bytes) -> None:
         self._transport.write(cmd)
+        metrics = self.metrics
+        metrics.writes += 1
+        metrics.bytes_out += len(cmd)
+        size = self._transport.get_write_buffer_size()
+        if size > metrics.write_buffer_high_water:
+            metrics.write_buffer_high_water = size
+
+    def pause_writing(self) -> None:
+        self._paused_at = self._loop.time()
+        self.metrics.pauses += 1
+
+    def resume_writing(self) -> None:
+        if self._paused_at is not None:
+            self.metrics.pause_duration.add(self._loop.time() - self._paused_at)
+            self._paused_at = None
+        if self._transport is not None:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the held commands as far as the transport accepts them
+        """
+        queue = self._queue
+        # Writing a class may pause the transport again, the rest stays queued
+        while queue and self._paused_at is None:
+            self._write(queue.pop())
+        if not queue and self._paused_at is None:
+            self._wake_drain_waiters()
+
+    def discard(self, exc: Exception) -> None:
+        """
+        Drop the held commands, `drain` raises `exc`
+        """
+        self._queue.clear()
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_exception(exc)
+
+    def _wake_drain_waiters(self) -> None:
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def drain(self) -> None:
+        """
+        Wait until the held commands are written to the transport
+        """
+        if self._paused_at is None and not self._queue and self._transport:
+            return
+        fut = self._loop.create_future()
+        self._drain_waiters.append(fut)
+        await fut
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        """
+        Commands held until now are written on `flush`
+        """
+        self._transport = transport
+        self._paused_at = None
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """
+        Fail the outstanding requests, the commands sent from now on
+        are held until the next connection
+        """
+        self._transport = None
+        self._paused_at = None
+        self.metrics.disconnects += 1
+        outstanding, self._outstanding = self._outstanding, {}
+        for waiters in outstanding.values():
+            for fut in waiters:
+                if not fut.done():
+                    fut.set_exception(ConnectionError("Connection to the box lost"))
+        if self._connection_lost_cb is not None:
+            self._connection_lost_cb(exc)
+
+    def expect_packet(self, packet_type: str) -> asyncio.Future:
+        """
+        Register a waiter for the next packet of the type. Waiters for the same
+        packet type are resolved in the order they were registered.
+        """
+        fut = self._loop.create_future()
+        waiters = self._outstanding.get(packet_type)
+        if waiters is None:
+            waiters = self._outstanding[packet_type] = deque()
+        waiters.append(fut)
+        return fut
 
     async def wait_for_packet(
         self,
         packet_type: str,
         timeout: datetime.timedelta = DEFAULT_TIMEOUT,
     ) -> Any:
-        if packet_type in self._outstanding:
-            self.log_warning(f"Already waiting for packet `{packet_type}`")
-        fut = self._loop.create_future()
-        self._outstanding[packet_type] = fut
-        return await asyncio.wait_for(fut, timeout.total_seconds())
+        return await self.wait_packet(
+            packet_type, self.expect_packet(packet_type), timeout=timeout
+        )
+
+    async def wait_packet(
+        self,
+        packet_type: str,
+        fut: asyncio.Future,
+        timeout: datetime.timedelta = DEFAULT_TIMEOUT,
+        sent: float = None,
+    ) -> Any:
+        """
+        Wait for the future registered by `expect_packet`, with the loop time
+        the request was `sent` the round trip time is recorded
+        """
+        try:
+            res = await asyncio.wait_for(fut, timeout.total_seconds())
+            if sent is not None:
+                self.metrics.rtt.add(self._loop.time() - sent)
+            return res
+        except BaseException as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.metrics.timeouts += 1
+            waiters = self._outstanding.get(packet_type)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    del self._outstanding[packet_type]
+            raise
+
+    def _resolve(self, packet_type: str, result: Tuple) -> bool:
+        waiters = self._outstanding.get(packet_type)
+        if waiters is None:
+            return False
+        while waiters:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(result)
+                break
+        else:
+            fut = None
+        if not waiters:
+            del self._outstanding[packet_type]
+        return fut is not None
 
     async def read_parameter(
         self,
@@ -221,65 +610,223 @@ class Client(Loggable):
         wait_for: str,
         timeout: datetime.timedelta = DEFAULT_TIMEOUT,
     ) -> Any:
+        if self._transport is None:
+            raise ConnectionError("Not connected to the box")
+        fut = self.expect_packet(wait_for)
+        sent = self._loop.time()
         self.send_command(cmd)
-        return await self.wait_for_packet(wait_for, timeout=timeout)
+        return await self.wait_packet(wait_for, fut, timeout=timeout, sent=sent)
+
+    async def make_read_requests(
+        self,
+        requests: Sequence[Tuple[bytes, str]],
+        timeout: datetime.timedelta = DEFAULT_TIMEOUT,
+        window: int = None,
+    ) -> List[Any]:
+        """
+        Pipeline several (command, wait_for) read requests and return the packets
+        in request order. All the commands are written in a single burst,
+        unless `window` limits the number of requests in flight.
+        """
+        if self._transport is None:
+            raise ConnectionError("Not connected to the box")
+        if window is not None and window < len(requests):
+            limit = asyncio.Semaphore(window)
+
+            async def request(cmd: bytes, wait_for: str) -> Any:
+                async with limit:
+                    return await self.make_read_request(cmd, wait_for, timeout)
+
+            return await asyncio.gather(*(request(*r) for r in requests))
+
+        futs = [self.expect_packet(wait_for) for _, wait_for in requests]
+        sent = self._loop.time()
+        self.send_command(b"".join(cmd for cmd, _ in requests))
+        return await asyncio.gather(
+            *(
+                self.wait_packet(wait_for, fut, timeout=timeout, sent=sent)
+                for (_, wait_for), fut in zip(requests, futs)
+            )
+        )
+
+    def dispatch(self, packet: bytes) -> None:
+        codec = DECODE_TABLE[packet[1]]
+        if codec is None:
+            self.metrics.unknown_packets += 1
+            self.log_warning(f"Unknown packet type {packet[1]:#04x}")
+            return
+        self.metrics.packets[packet[1]] += 1
+        values = codec.decode(packet)
+        if self._outstanding and self._resolve(
+            codec.code, (codec.motor, codec.param, *values)
+        ):
+            return
+        handler = self._handlers.get(codec.param)
+        if handler is not None:
+            handler(codec.motor, *values)
 
     def packet_recieved(
         self, packet_type: str, motor: Motor, param: Parameter, *args
     ) -> None:
-        self.log_debug(f"Received packet '{packet_type}' {motor} {param} {args}")
-        if packet_type in self._outstanding:
-            self._outstanding[packet_type].set_result((motor, param, *args))
-            del self._outstanding[packet_type]
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self.log_debug(f"Received packet '{packet_type}' {motor} {param} {args}")
+        if self._resolve(packet_type, (motor, param, *args)):
+            return
         # Check for position and status callback
-        elif param == Parameter.Position:
-            if self._position_cb:
-                self._position_cb(motor, args[0], args[1])
-        elif param == Parameter.PwmStatus:
-            if self._pwm_status_sb:
-                self._pwm_status_sb(motor, args[0], args[1])
+        handler = self._handlers.get(param)
+        if handler is not None:
+            handler(motor, *args)
+
+
+class FrameParser:
+    """
+    Incremental splitter of the inbound byte stream into packets.
+
+    Incoming bytes are copied once into a preallocated buffer of fixed
+    capacity, complete packets are handed to `on_packet` as memoryview
+    slices of that buffer, and anything that doesn't look like a
+    `[xyz]` frame is skipped up to the next `[`.
+    The view passed to `on_packet` is only valid for the duration of the call.
+    """
+
+    def __init__(
+        self,
+        on_packet: Callable[[memoryview], None],
+        capacity: int = DEFAULT_BUFFER_SIZE,
+    ) -> None:
+        if capacity < PACKET_LEN:
+            raise ValueError(f"Buffer capacity {capacity} is less than packet size")
+        self._on_packet = on_packet
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._head = 0
+        self._tail = 0
+        self.packets = 0
+        self.dropped_bytes = 0
+        self.resyncs = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def pending(self) -> int:
+        return self._tail - self._head
+
+    def feed(self, data: bytes) -> None:
+        data = memoryview(data)
+        capacity = len(self._buffer)
+        while data:
+            if self._head:
+                self._compact()
+            n = min(len(data), capacity - self._tail)
+            self._view[self._tail : self._tail + n] = data[:n]
+            self._tail += n
+            data = data[n:]
+            self._scan()
+
+    def reset(self) -> None:
+        self._head = 0
+        self._tail = 0
+
+    def _compact(self) -> None:
+        pending = self._tail - self._head
+        if pending:
+            self._buffer[:pending] = self._view[self._head : self._tail]
+        self._head = 0
+        self._tail = pending
+
+    def _scan(self) -> None:
+        buffer = self._buffer
+        view = self._view
+        head = self._head
+        tail = self._tail
+        try:
+            while tail - head >= PACKET_LEN:
+                end = head + PACKET_LEN
+                if buffer[head] == PACKET_START and buffer[end - 1] == PACKET_END:
+                    self.packets += 1
+                    packet = view[head:end]
+                    head = end
+                    self._on_packet(packet)
+                    continue
+                # Resync on the next packet start
+                start = buffer.find(b"[", head + 1, tail)
+                if start < 0:
+                    start = tail
+                self.dropped_bytes += start - head
+                self.resyncs += 1
+                head = start
+        finally:
+            self._head = head
 
 
 class Protocol(asyncio.Protocol, Loggable):
-    def __init__(self, client: Client):
+    def __init__(
+        self,
+        client: Client,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        write_buffer_limit: int = DEFAULT_WRITE_BUFFER_LIMIT,
+    ):
+        """
+        Writing pauses once the transport buffers `write_buffer_limit` bytes,
+        which bounds the latency of the commands, None keeps the transport
+        default
+        """
         super().__init__()
         self.set_logger(logging.getLogger("PROTO"))
 
         self._transport = None
         self._client = client
-        self._buffer = bytes()
+        self._parser = FrameParser(self._packet_received, buffer_size)
+        self._write_buffer_limit = write_buffer_limit
+
+    @property
+    def parser(self) -> FrameParser:
+        return self._parser
 
     def connection_made(self, transport) -> None:
         self._transport = transport
-        self._client._transport = transport
+        self._client.connection_made(transport)
+        if self._write_buffer_limit is not None:
+            try:
+                transport.set_write_buffer_limits(high=self._write_buffer_limit)
+            except NotImplementedError:
+                pass
         self.log_debug(f"port opened {self._transport}")
 
     def data_received(self, data) -> None:
-        self.log_debug(f"data received {repr(data)}")
         if not data:
             return
-        self._buffer = self._buffer + data
-        self.process_buffer()
-
-    def process_buffer(self) -> None:
-        if len(self._buffer) < 5:
-            return
-
-        buffer = self._buffer[:5]
-        packet = parse_packet(buffer)
-        self._client.packet_recieved(*packet)
-
-        self._buffer = self._buffer[5:]
-        self.process_buffer()
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self.log_debug(f"data received {data!r}")
+        parser = self._parser
+        metrics = self._client.metrics
+        metrics.bytes_in += len(data)
+        dropped = parser.dropped_bytes
+        resyncs = parser.resyncs
+        parser.feed(data)
+        if parser.dropped_bytes != dropped:
+            metrics.dropped_bytes += parser.dropped_bytes - dropped
+            metrics.resyncs += parser.resyncs - resyncs
+            self.log_warning(
+                f"dropped {parser.dropped_bytes - dropped} bytes of garbage, "
+                f"total {parser.dropped_bytes}"
+            )
+
+    def _packet_received(self, packet: memoryview) -> None:
+        self._client.dispatch(packet)
 
     def connection_lost(self, exc) -> None:
-        self.log_debug("port closed")
-        self._transport.loop.stop()
+        self.log_debug(f"port closed {exc!r}")
+        # A transport replaced by a reconnect already is no concern of the client
+        if self._client._transport is self._transport:
+            self._client.connection_lost(exc)
 
     def pause_writing(self) -> None:
         self.log_debug("pause writing")
-        self.log_debug(self._transport.get_write_buffer_size())
+        self._client.pause_writing()
 
     def resume_writing(self) -> None:
-        self.log_debug(self._transport.get_write_buffer_size())
         self.log_debug("resume writing")
+        self._client.resume_writing()
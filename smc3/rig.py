@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+from typing import List, Optional, Sequence, Tuple
+
+from .box import Box
+from .loggable import Loggable
+from .protocol import Motor, POSITIONS_FRAME_LEN
+from .metrics import Histogram
+
+MOTORS_PER_BOX = len(Motor)
+
+# Upper bounds of inter-box skew buckets in seconds
+SKEW_BUCKETS = (
+    0.000005,
+    0.00001,
+    0.00002,
+    0.00005,
+    0.0001,
+    0.0002,
+    0.0005,
+    0.001,
+)
+
+
+class Rig(Loggable):
+    """
+    Several boxes driven together on one event loop, with the motors numbered
+    globally: axis 0-2 are motors A-C of the first box, 3-5 of the second and so on.
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    boxes: List[Box]
+
+    def __init__(self, boxes: Sequence[Box], *, axes: int = None) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("RIG"))
+
+        if not boxes:
+            raise ValueError("A rig needs at least one box")
+        loop = boxes[0].loop
+        for box in boxes:
+            if box.loop is not loop or box.threaded:
+                raise ValueError(f"Box {box.device} doesn't run on the rig loop")
+        if axes is None:
+            axes = len(boxes) * MOTORS_PER_BOX
+        if axes < 1 or len(boxes) * MOTORS_PER_BOX < axes:
+            raise ValueError(f"Invalid number of axes {axes} for {len(boxes)} boxes")
+
+        self._loop = loop
+        self.boxes = list(boxes)
+        self._axes = axes
+        self._buffers = [bytearray(POSITIONS_FRAME_LEN) for _ in self.boxes]
+        self.skew = Histogram(SKEW_BUCKETS)
+
+    @classmethod
+    async def open(
+        cls,
+        devices: Sequence[str],
+        *,
+        axes: int = None,
+        loop: asyncio.AbstractEventLoop = None,
+        **kwargs,
+    ) -> "Rig":
+        """
+        Open all the devices concurrently
+        """
+        loop = loop or asyncio.get_running_loop()
+        boxes = await asyncio.gather(
+            *(Box.open(device=d, loop=loop, **kwargs) for d in devices),
+            return_exceptions=True,
+        )
+        errors = [b for b in boxes if isinstance(b, BaseException)]
+        if errors:
+            # Don't leak the boxes that did open
+            for box in boxes:
+                if isinstance(box, Box):
+                    box.close()
+            raise errors[0]
+        return cls(boxes, axes=axes)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    @property
+    def axes(self) -> int:
+        return self._axes
+
+    def axis(self, axis: int) -> Tuple[Box, Motor]:
+        if axis < 0 or self._axes <= axis:
+            raise IndexError(f"Axis {axis} out of range 0-{self._axes - 1}")
+        box, motor = divmod(axis, MOTORS_PER_BOX)
+        return self.boxes[box], Motor(motor + 1)
+
+    def set_position(self, axis: int, pos: int) -> None:
+        box, motor = self.axis(axis)
+        box.set_position(motor, pos)
+
+    def set_positions(self, positions: Sequence[Optional[int]]) -> float:
+        """
+        Write positions of all axes, one frame per box back to back.
+        Axes with position None are left alone.
+        Returns the time between the first and the last box write in seconds.
+        """
+        if len(positions) != self._axes:
+            raise ValueError(
+                f"Invalid number of positions {len(positions)}, rig has {self._axes} axes"
+            )
+        # Encode everything first so that the writes go out back to back
+        frames = []
+        for i, buffer in enumerate(self._buffers):
+            chunk = positions[i * MOTORS_PER_BOX : (i + 1) * MOTORS_PER_BOX]
+            if len(chunk) < MOTORS_PER_BOX:
+                chunk = list(chunk) + [None] * (MOTORS_PER_BOX - len(chunk))
+            frames.append(self.boxes[i].encode_positions(*chunk, buffer))
+        first = last = 0.0
+        for box, frame in zip(self.boxes, frames):
+            if frame is None:
+                continue
+            box.send_frame(frame)
+            last = time.perf_counter()
+            if not first:
+                first = last
+        skew = last - first
+        self.skew.add(skew)
+        return skew
+
+    def enable_motors(self) -> None:
+        for box in self.boxes:
+            box.enable_motors()
+
+    def close(self) -> None:
+        for box in self.boxes:
+            box.close()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+
+from enum import Enum
+from typing import Callable
+
+from .loggable import Loggable
+from .metrics import Histogram
+
+MIN_RATE = 50
+MAX_RATE = 1000
+DEFAULT_RATE = 100
+
+
+class OverrunPolicy(Enum):
+    CatchUp = "catch-up"
+    Skip = "skip"
+
+
+class MotionScheduler(Loggable):
+    """
+    Calls `producer` at a fixed rate on absolute deadlines.
+
+    Deadlines are computed from the start time, so the rate doesn't drift with the
+    time spent in the producer. The producer receives the scheduled (loop) time of the tick.
+    When the producer overruns one or more whole periods, the missed ticks are either
+    run back to back (OverrunPolicy.CatchUp) or dropped (OverrunPolicy.Skip).
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    _producer: Callable[[float], None]
+
+    def __init__(
+        self,
+        producer: Callable[[float], None],
+        *,
+        rate: float = DEFAULT_RATE,
+        policy: OverrunPolicy = OverrunPolicy.Skip,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("SCHED"))
+
+        if rate < MIN_RATE or MAX_RATE < rate:
+            raise ValueError(f"Rate {rate} out of range {(MIN_RATE, MAX_RATE)}")
+        if not loop:
+            loop = asyncio.get_event_loop()
+
+        self._loop = loop
+        self._producer = producer
+        self._period = 1.0 / rate
+        self._policy = policy
+        self._deadline = 0.0
+        self._handle = None
+        self._done = None
+        self.ticks = 0
+        self.skipped = 0
+        self.lateness = Histogram()
+
+    @property
+    def rate(self) -> float:
+        return 1.0 / self._period
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    @property
+    def running(self) -> bool:
+        return self._handle is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._done = self._loop.create_future()
+        self._deadline = self._loop.time()
+        self._handle = self._loop.call_at(self._deadline, self._tick)
+
+    def stop(self) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        if self._done and not self._done.done():
+            self._done.set_result(None)
+
+    async def run(self, duration: float = None) -> None:
+        """
+        Run the scheduler until stopped or for `duration` seconds
+        """
+        self.start()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._done), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.stop()
+
+    def _tick(self) -> None:
+        deadline = self._deadline
+        self.lateness.add(self._loop.time() - deadline)
+        try:
+            self._producer(deadline)
+        except Exception as e:
+            self.log_error(f"Producer failed: {e!r}")
+            self._handle = None
+            self._done.set_exception(e)
+            return
+        self.ticks += 1
+
+        deadline += self._period
+        if self._policy == OverrunPolicy.Skip:
+            missed = int((self._loop.time() - deadline) / self._period)
+            if missed > 0:
+                self.skipped += missed
+                deadline += missed * self._period
+        self._deadline = deadline
+        self._handle = self._loop.call_at(deadline, self._tick)
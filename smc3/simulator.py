@@ -0,0 +1,470 @@
+"""
+Simulated SMC3 box.
+
+Implements the command table of `smc3.protocol` with a PID controller and a first
+order motor model per axis. The simulator can be connected to a `Protocol` in the
+same event loop with `create_simulator_connection`, or exposed on a pty with
+`PtySimulator` for programs that open a serial device.
+
+The link between the host and the simulator can be throttled to the serial baud
+rate and delayed by a fixed latency, and the feedback can be made noisy.
+"""
+
+import asyncio
+import logging
+import os
+import pty
+import random
+import threading
+import tty
+
+from typing import Callable, Dict, List, Tuple
+
+from .loggable import Loggable
+from .protocol import (
+    DEFAULT_BAUDRATE,
+    PACKET_STRUCTS,
+    COMMAND_ARG_LIMITS,
+    FrameParser,
+    Motor,
+    Parameter,
+    POSITION_MAX,
+    byte_to_param,
+    param_to_char,
+)
+
+DEFAULT_VERSION = 101
+FEEDBACK_PERIOD = 0.015
+PHYSICS_RATE = 1000
+BITS_PER_BYTE = 10
+
+INTEGRAL_LIMIT = 1000
+# Positions are reported in a byte
+FEEDBACK_MAX = 255
+
+STATUS_OK = 0
+STATUS_CUTOFF = 1
+
+DEFAULT_PARAMS = {
+    Parameter.Kp: (300,),
+    Parameter.Ki: (0,),
+    Parameter.Kd: (100,),
+    Parameter.Ks: (5,),
+    Parameter.PWMinMax: (30, 200),
+    Parameter.MinMax: (0, 0),
+    Parameter.FBDeadZone: (2, 0),
+}
+
+
+class AxisSimulator:
+    """
+    PID loop of one motor driving a DC motor with a first order velocity response.
+    A full 255 PWM duty moves the actuator at `max_speed` units per second.
+    """
+
+    motor: Motor
+    params: Dict[Parameter, Tuple[int, ...]]
+
+    def __init__(
+        self,
+        motor: Motor,
+        *,
+        max_speed: float = 2000.0,
+        time_constant: float = 0.05,
+        position: float = POSITION_MAX / 2,
+    ) -> None:
+        self.motor = motor
+        self.max_speed = max_speed
+        self.time_constant = time_constant
+        self.params = dict(DEFAULT_PARAMS)
+        self.enabled = True
+        self.target = int(position)
+        self.position = position
+        self.velocity = 0.0
+        self.pwm = 0
+        self.status = STATUS_OK
+        self._integral = 0.0
+        self._last_error = 0.0
+        self._dterm = 0.0
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.status = STATUS_OK
+
+    def set_target(self, target: int) -> None:
+        clip = self.params[Parameter.MinMax][1]
+        self.target = min(max(target, clip), POSITION_MAX - clip)
+
+    def step(self, dt: float, feedback: float) -> None:
+        kp, ki, kd, ks = (
+            self.params[p][0]
+            for p in (Parameter.Kp, Parameter.Ki, Parameter.Kd, Parameter.Ks)
+        )
+        pwm_min, pwm_max = self.params[Parameter.PWMinMax]
+        cutoff = self.params[Parameter.MinMax][0]
+        deadzone = self.params[Parameter.FBDeadZone][0]
+
+        if cutoff and (feedback < cutoff or POSITION_MAX - cutoff < feedback):
+            self.enabled = False
+            self.status = STATUS_CUTOFF
+
+        drive = 0.0
+        if self.enabled:
+            error = self.target - feedback
+            if abs(error) <= deadzone:
+                error = 0.0
+                self._integral = 0.0
+            self._integral = min(
+                max(self._integral + error, -INTEGRAL_LIMIT), INTEGRAL_LIMIT
+            )
+            self._dterm += (kd * (error - self._last_error) - self._dterm) / max(ks, 1)
+            self._last_error = error
+            out = (kp * error + ki * self._integral / 100 + self._dterm) / 100
+            pwm = min(abs(out), pwm_max)
+            if error and pwm < pwm_min:
+                pwm = pwm_min
+            self.pwm = int(pwm)
+            drive = out < 0 and -pwm or pwm
+        else:
+            self.pwm = 0
+
+        speed = drive / 255 * self.max_speed
+        self.velocity += (speed - self.velocity) * min(dt / self.time_constant, 1.0)
+        self.position += self.velocity * dt
+        if self.position < 0:
+            self.position, self.velocity = 0.0, 0.0
+        elif POSITION_MAX < self.position:
+            self.position, self.velocity = float(POSITION_MAX), 0.0
+
+
+class Simulator(Loggable):
+    """
+    Simulated box. Bytes from the host are passed to `receive`, bytes for the
+    host are passed to the `send` callback set by `attach`.
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    axes: List[AxisSimulator]
+
+    def __init__(
+        self,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+        version: int = DEFAULT_VERSION,
+        baudrate: int = DEFAULT_BAUDRATE,
+        latency: float = 0.0,
+        noise: float = 0.0,
+        physics_rate: float = PHYSICS_RATE,
+        feedback_period: float = FEEDBACK_PERIOD,
+        seed: int = None,
+        **axis_kwargs,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("SIM"))
+
+        self._loop = loop
+        self.version = version
+        self.baudrate = baudrate
+        self.latency = latency
+        self.noise = noise
+        self.physics_rate = physics_rate
+        self.feedback_period = feedback_period
+        self.axes = [AxisSimulator(m, **axis_kwargs) for m in Motor]
+        self.saved = {(a.motor, p): v for a in self.axes for p, v in a.params.items()}
+        self.feedback_mode = 0
+        self.commands = 0
+        self._random = random.Random(seed)
+        self._parser = FrameParser(self._command_received)
+        self._send: Callable[[bytes], None] = None
+        self._physics = None
+        self._feedback = None
+        self._host_free = 0.0
+        self._box_free = 0.0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def attach(self, send: Callable[[bytes], None]) -> None:
+        self._send = send
+
+    def start(self, loop: asyncio.AbstractEventLoop = None) -> None:
+        if loop:
+            self._loop = loop
+        if not self._loop:
+            self._loop = asyncio.get_event_loop()
+        if self._physics:
+            return
+        self._physics = self._loop.call_soon(self._physics_tick, self._loop.time())
+
+    def stop(self) -> None:
+        if self._physics:
+            self._physics.cancel()
+            self._physics = None
+        if self._feedback:
+            self._feedback.cancel()
+            self._feedback = None
+
+    def axis(self, motor: Motor) -> AxisSimulator:
+        return self.axes[motor.value - 1]
+
+    def feedback(self, axis: AxisSimulator) -> float:
+        pos = axis.position
+        if self.noise:
+            pos += self._random.gauss(0.0, self.noise)
+        return min(max(pos, 0.0), POSITION_MAX)
+
+    # Link between host and box
+    def _transfer_time(self, size: int) -> float:
+        if not self.baudrate:
+            return 0.0
+        return size * BITS_PER_BYTE / self.baudrate
+
+    def write(self, data: bytes) -> None:
+        """
+        Bytes written by the host, delivered after the serial transfer time and latency
+        """
+        data = bytes(data)
+        now = self._loop.time()
+        self._box_free = max(now, self._box_free) + self._transfer_time(len(data))
+        delay = self._box_free - now + self.latency
+        if delay > 0:
+            self._loop.call_later(delay, self.receive, data)
+        else:
+            self.receive(data)
+
+    def _reply(self, data: bytes) -> None:
+        if not self._send:
+            return
+        now = self._loop.time()
+        self._host_free = max(now, self._host_free) + self._transfer_time(len(data))
+        delay = self._host_free - now + self.latency
+        if delay > 0:
+            self._loop.call_later(delay, self._send, data)
+        else:
+            self._send(data)
+
+    # Command handling
+    def receive(self, data: bytes) -> None:
+        self._parser.feed(data)
+
+    def _command_received(self, packet: memoryview) -> None:
+        self.commands += 1
+        cmd = bytes(packet[1:4])
+        if cmd[:2] == b"rd":
+            self._read(cmd[2])
+        elif cmd[:2] == b"mo":
+            self._set_feedback_mode(cmd[2] - ord("0"))
+        elif cmd == b"ena":
+            for a in self.axes:
+                a.enable()
+        elif cmd[:2] == b"en":
+            motor = cmd[2] - ord("0")
+            if 1 <= motor <= len(self.axes):
+                self.axes[motor - 1].enable()
+        elif cmd == b"sav":
+            self.saved = {
+                (a.motor, p): v for a in self.axes for p, v in a.params.items()
+            }
+        elif cmd == b"ver":
+            self._reply(PACKET_STRUCTS[1].pack(*b"[v", self.version, ord("]")))
+        elif ord("A") <= cmd[0] <= ord("X"):
+            self._set(cmd[0], cmd[1], cmd[2])
+        else:
+            self.log_warning(f"Unknown command {bytes(packet)}")
+
+    def _set(self, code: int, hi: int, lo: int) -> None:
+        motor, param = byte_to_param(code)
+        axis = self.axis(motor)
+        if param == Parameter.Position:
+            axis.set_target(hi << 8 | lo)
+        elif param in COMMAND_ARG_LIMITS:
+            axis.params[param] = (hi << 8 | lo,)
+        else:
+            axis.params[param] = (hi, lo)
+
+    def _values(self, axis: AxisSimulator, param: Parameter) -> Tuple[int, ...]:
+        if param == Parameter.Position:
+            return (
+                min(axis.target >> 2, FEEDBACK_MAX),
+                min(int(self.feedback(axis)) >> 2, FEEDBACK_MAX),
+            )
+        if param == Parameter.PwmStatus:
+            return axis.pwm, axis.status
+        return axis.params[param]
+
+    def _packet(self, axis: AxisSimulator, param: Parameter) -> bytes:
+        values = self._values(axis, param)
+        code = ord(param_to_char(axis.motor, param))
+        return PACKET_STRUCTS[len(values)].pack(ord("["), code, *values, ord("]"))
+
+    def _read(self, code: int) -> None:
+        motor, param = byte_to_param(code)
+        if param not in DEFAULT_PARAMS and param not in (
+            Parameter.Position,
+            Parameter.PwmStatus,
+        ):
+            self.log_warning(f"Unknown read command {chr(code)}")
+            return
+        self._reply(self._packet(self.axis(motor), param))
+
+    def _set_feedback_mode(self, mode: int) -> None:
+        self.feedback_mode = mode
+        if mode and not self._feedback:
+            self._feedback = self._loop.call_soon(
+                self._feedback_tick, self._loop.time()
+            )
+        elif not mode and self._feedback:
+            self._feedback.cancel()
+            self._feedback = None
+
+    # Timers
+    def _physics_tick(self, deadline: float) -> None:
+        dt = 1.0 / self.physics_rate
+        for axis in self.axes:
+            axis.step(dt, self.feedback(axis))
+        deadline += dt
+        now = self._loop.time()
+        if deadline < now - dt * 10:
+            # Too far behind, don't try to catch up
+            deadline = now
+        self._physics = self._loop.call_at(deadline, self._physics_tick, deadline)
+
+    def _feedback_tick(self, deadline: float) -> None:
+        frame = b"".join(self._packet(a, Parameter.Position) for a in self.axes)
+        frame += b"".join(self._packet(a, Parameter.PwmStatus) for a in self.axes)
+        self._reply(frame)
+        deadline += self.feedback_period
+        self._feedback = self._loop.call_at(deadline, self._feedback_tick, deadline)
+
+
+class SimulatorTransport(asyncio.Transport):
+    """
+    In-process transport connecting a protocol to a simulator
+    """
+
+    def __init__(
+        self, simulator: Simulator, protocol: asyncio.Protocol, extra=None
+    ) -> None:
+        super().__init__(extra)
+        self._simulator = simulator
+        self._protocol = protocol
+        self._closing = False
+        simulator.attach(self._deliver)
+
+    @property
+    def simulator(self) -> Simulator:
+        return self._simulator
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._simulator.loop
+
+    def _deliver(self, data: bytes) -> None:
+        if not self._closing:
+            self._protocol.data_received(data)
+
+    def write(self, data) -> None:
+        if not self._closing:
+            self._simulator.write(data)
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._simulator.stop()
+        self._simulator.attach(None)
+        self._simulator.loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+
+async def create_simulator_connection(
+    loop: asyncio.AbstractEventLoop,
+    protocol_factory: Callable[[], asyncio.Protocol],
+    simulator: Simulator = None,
+    **kwargs,
+) -> Tuple[SimulatorTransport, asyncio.Protocol]:
+    """
+    Connect a protocol to a simulator in the same loop,
+    keyword arguments are passed to the Simulator
+    """
+    if simulator is None:
+        simulator = Simulator(loop=loop, **kwargs)
+    simulator.start(loop)
+    protocol = protocol_factory()
+    transport = SimulatorTransport(simulator, protocol)
+    protocol.connection_made(transport)
+    return transport, protocol
+
+
+class PtySimulator(Loggable):
+    """
+    Simulator exposed on a pseudo terminal, running its own event loop on a thread
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("SIM"))
+
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self._loop = asyncio.new_event_loop()
+        self.simulator = Simulator(loop=self._loop, **kwargs)
+        self.simulator.attach(self._write)
+        self._thread = threading.Thread(
+            target=self._run, name="smc3-simulator", daemon=True
+        )
+
+    @property
+    def port(self) -> str:
+        return os.ttyname(self._slave)
+
+    def open(self) -> None:
+        self._thread.start()
+        self.log_debug(f"Simulator attached to {self.port}")
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self) -> None:
+        self.simulator.start(self._loop)
+        self._loop.add_reader(self._master, self._read)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.remove_reader(self._master)
+            self.simulator.stop()
+            self._loop.close()
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self._master, 4096)
+        except (BlockingIOError, OSError):
+            return
+        if data:
+            self.simulator.write(data)
+
+    def _write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self._master, view)
+            except BlockingIOError:
+                # The host isn't reading, drop the rest like a full UART would
+                self.log_debug(f"Dropped {len(view)} bytes")
+                return
+            view = view[n:]
@@ -0,0 +1,393 @@
+import asyncio
+import struct
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from .protocol import Motor
+
+DEFAULT_TELEMETRY_CAPACITY = 4096
+
+COLUMNS = {
+    "timestamp": "d",
+    "target": "H",
+    "feedback": "H",
+    "pwm": "H",
+    "status": "H",
+}
+
+
+class TelemetrySample(NamedTuple):
+    timestamp: float
+    motor: Motor
+    target: int
+    feedback: int
+    pwm: int
+    status: int
+
+
+class MotorTelemetry:
+    """
+    Fixed capacity columnar history of a motor's telemetry.
+
+    A row is started by each position packet and completed by the pwm and status
+    packet that follows it. Every column is stored twice back to back, so that
+    any window of the ring is a contiguous range and can be returned as
+    a memoryview without copying.
+    """
+
+    motor: Motor
+
+    def __init__(
+        self, motor: Motor, capacity: int = DEFAULT_TELEMETRY_CAPACITY
+    ) -> None:
+        if capacity < 1:
+            raise ValueError(f"Invalid telemetry capacity {capacity}")
+        self.motor = motor
+        self._capacity = capacity
+        self._columns = {
+            name: array(code, bytes(array(code).itemsize * capacity * 2))
+            for name, code in COLUMNS.items()
+        }
+        self._timestamp = self._columns["timestamp"]
+        self._target = self._columns["target"]
+        self._feedback = self._columns["feedback"]
+        self._pwm = self._columns["pwm"]
+        self._status = self._columns["status"]
+        self._next = 0
+        self._count = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clear(self) -> None:
+        self._next = 0
+        self._count = 0
+
+    def add_position(self, timestamp: float, target: int, feedback: int) -> None:
+        i = self._next
+        j = i + self._capacity
+        last = (i or self._capacity) - 1
+        self._timestamp[i] = self._timestamp[j] = timestamp
+        self._target[i] = self._target[j] = target
+        self._feedback[i] = self._feedback[j] = feedback
+        self._pwm[i] = self._pwm[j] = self._pwm[last]
+        self._status[i] = self._status[j] = self._status[last]
+        self._next = i + 1 < self._capacity and i + 1 or 0
+        if self._count < self._capacity:
+            self._count += 1
+
+    def update_pwm_status(self, timestamp: float, pwm: int, status: int) -> None:
+        if not self._count:
+            self.add_position(timestamp, 0, 0)
+        i = (self._next or self._capacity) - 1
+        j = i + self._capacity
+        self._pwm[i] = self._pwm[j] = pwm
+        self._status[i] = self._status[j] = status
+
+    def latest(self) -> TelemetrySample:
+        if not self._count:
+            return None
+        i = (self._next or self._capacity) - 1
+        return TelemetrySample(
+            self._timestamp[i],
+            self.motor,
+            self._target[i],
+            self._feedback[i],
+            self._pwm[i],
+            self._status[i],
+        )
+
+    def _window(self) -> Tuple[int, int]:
+        start = (self._next - self._count) % self._capacity
+        return start, start + self._count
+
+    def columns(self) -> Dict[str, memoryview]:
+        """
+        Views of all the stored rows, oldest first
+        """
+        start, end = self._window()
+        return {name: memoryview(col)[start:end] for name, col in self._columns.items()}
+
+    def slice(self, t0: float, t1: float) -> Dict[str, memoryview]:
+        """
+        Views of the rows with t0 <= timestamp <= t1, oldest first.
+        The rows in the views are overwritten once the ring wraps around.
+        """
+        lo, hi = self._window()
+        start = bisect_left(self._timestamp, t0, lo, hi)
+        end = bisect_right(self._timestamp, t1, start, hi)
+        return {name: memoryview(col)[start:end] for name, col in self._columns.items()}
+
+
+class Telemetry:
+    """
+    Telemetry history of all motors
+    """
+
+    motors: List[MotorTelemetry]
+
+    def __init__(self, capacity: int = DEFAULT_TELEMETRY_CAPACITY) -> None:
+        self.motors = [MotorTelemetry(m, capacity) for m in Motor]
+
+    def __getitem__(self, motor: Motor) -> MotorTelemetry:
+        return self.motors[motor.value - 1]
+
+    def clear(self) -> None:
+        for m in self.motors:
+            m.clear()
+
+    def latest(self, motor: Motor) -> TelemetrySample:
+        return self.motors[motor.value - 1].latest()
+
+    def slice(self, motor: Motor, t0: float, t1: float) -> Dict[str, memoryview]:
+        return self.motors[motor.value - 1].slice(t0, t1)
+
+
+class TelemetryKind(Enum):
+    Position = "position"
+    PwmStatus = "pwm_status"
+
+
+DEFAULT_QUEUE_SIZE = 64
+
+
+class Subscription:
+    """
+    Asynchronous iterator over telemetry samples of a set of motors.
+
+    Samples are queued as they arrive, without waiting for the consumer. When
+    `conflate` is set, a pending sample of a motor is replaced by a newer one,
+    so a slow consumer only ever sees the latest values. Otherwise at most
+    `maxsize` samples are kept and the oldest are dropped.
+    With a non-zero `deadband` a sample is only delivered when target, feedback
+    or pwm moved by at least `deadband` or the status changed since the last
+    delivered sample of the motor.
+    """
+
+    def __init__(
+        self,
+        hub: "TelemetryHub",
+        *,
+        motors: Iterable[Motor] = None,
+        kinds: Iterable[TelemetryKind] = None,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        conflate: bool = True,
+        deadband: int = 0,
+    ) -> None:
+        self._hub = hub
+        self.motors = frozenset(motors or Motor)
+        self.kinds = frozenset(kinds or TelemetryKind)
+        self.conflate = conflate
+        self.deadband = deadband
+        self.dropped = 0
+        self._pending: Dict[Motor, TelemetrySample] = {}
+        self._queue = deque(maxlen=maxsize)
+        self._last: Dict[Motor, TelemetrySample] = {}
+        self._waiter: asyncio.Future = None
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._hub.unsubscribe(self)
+        self._wakeup()
+
+    def pending(self) -> int:
+        return len(self._pending) + len(self._queue)
+
+    def _accepts(self, sample: TelemetrySample) -> bool:
+        if not self.deadband:
+            return True
+        last = self._last.get(sample.motor)
+        if last is None or last.status != sample.status:
+            return True
+        db = self.deadband
+        return (
+            abs(sample.target - last.target) >= db
+            or abs(sample.feedback - last.feedback) >= db
+            or abs(sample.pwm - last.pwm) >= db
+        )
+
+    def _publish(self, kind: TelemetryKind, sample: TelemetrySample) -> None:
+        if (
+            kind not in self.kinds
+            or sample.motor not in self.motors
+            or not self._accepts(sample)
+        ):
+            return
+        self._last[sample.motor] = sample
+        if self.conflate:
+            if sample.motor in self._pending:
+                self.dropped += 1
+                del self._pending[sample.motor]
+            self._pending[sample.motor] = sample
+        else:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(sample)
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _pop(self) -> TelemetrySample:
+        if self._pending:
+            motor = next(iter(self._pending))
+            return self._pending.pop(motor)
+        if self._queue:
+            return self._queue.popleft()
+        return None
+
+    async def get(self) -> TelemetrySample:
+        """
+        Wait for the next sample, returns None when the subscription is closed
+        """
+        while True:
+            sample = self._pop()
+            if sample is not None or self._closed:
+                return sample
+            self._waiter = self._hub.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> TelemetrySample:
+        sample = await self.get()
+        if sample is None:
+            raise StopAsyncIteration
+        return sample
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+Listener = Callable[[TelemetryKind, TelemetrySample], None]
+
+
+class TelemetryHub:
+    """
+    Fans telemetry samples out to subscriptions and to listeners,
+    which are called synchronously as the samples arrive
+    """
+
+    loop: asyncio.AbstractEventLoop
+    subscriptions: List[Subscription]
+    listeners: List[Listener]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.subscriptions = []
+        self.listeners = []
+
+    def __bool__(self) -> bool:
+        return bool(self.subscriptions or self.listeners)
+
+    def subscribe(self, **kwargs) -> Subscription:
+        sub = Subscription(self, **kwargs)
+        self.subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        if sub in self.subscriptions:
+            self.subscriptions.remove(sub)
+
+    def add_listener(self, listener: Listener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Listener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def publish(self, kind: TelemetryKind, sample: TelemetrySample) -> None:
+        for sub in self.subscriptions:
+            sub._publish(kind, sample)
+        for listener in self.listeners:
+            listener(kind, sample)
+
+    def close(self) -> None:
+        for sub in list(self.subscriptions):
+            sub.close()
+
+
+TELEMETRY_MAGIC = b"SMC3TEL1"
+# timestamp, motor, target, feedback, pwm, status
+TELEMETRY_RECORD = struct.Struct("<dBHHHH")
+DEFAULT_RECORDER_BUFFER = 64 * 1024
+
+
+class TelemetryRecorder:
+    """
+    Appends complete telemetry rows to a file of fixed size little-endian
+    records after TELEMETRY_MAGIC, which `smc3.analysis` maps into NumPy arrays.
+    A recorder is a telemetry listener:
+
+        with TelemetryRecorder("session.tel") as recorder:
+            box.add_listener(recorder)
+    """
+
+    def __init__(self, path: str, buffer_size: int = DEFAULT_RECORDER_BUFFER) -> None:
+        self.path = path
+        self.rows = 0
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._file = open(path, "ab", buffering=0)
+        if not self._file.seek(0, 2):
+            self._buffer += TELEMETRY_MAGIC
+
+    def __call__(self, kind: TelemetryKind, sample: TelemetrySample) -> None:
+        # The row is complete once the pwm and status follow the position
+        if kind is TelemetryKind.PwmStatus:
+            self.add(sample)
+
+    def add(self, sample: TelemetrySample) -> None:
+        if self._file is None:
+            return
+        self._buffer += TELEMETRY_RECORD.pack(
+            sample.timestamp,
+            sample.motor.value,
+            sample.target,
+            sample.feedback,
+            sample.pwm,
+            sample.status,
+        )
+        self.rows += 1
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is not None and self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "TelemetryRecorder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,244 @@
+"""
+Jerk-limited trajectory shaping.
+
+Targets arriving at a low or irregular rate, e.g. from game telemetry, are turned
+into smooth positions at the output rate. Every axis follows its target with its
+velocity, acceleration and jerk bounded by `MotionLimits`, so a step of the
+target becomes an S-curve instead of slamming the actuator.
+
+On every tick the shaper picks the largest jerk which still lets the axis stop
+at the target without exceeding the limits, the stopping distance being known
+in closed form. A tick costs the same regardless of the distance to the target
+and a settled axis costs almost nothing.
+
+    shaper = TrajectoryShaper(MotionLimits(velocity=2000), rate=500)
+    shaper.set_target([800, 300, 512])
+    a, b, c = shaper.step()
+
+`TrajectoryShaper.process` shapes a whole precomputed profile, `hold` resamples
+sparse (time, target) keyframes to the output rate for it.
+"""
+
+import math
+
+import numpy as np
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .protocol import AXES, CENTER, POSITION_MAX, POSITION_MIN
+
+# Distance to the target, in position units, below which a slow axis is
+# snapped to it, half of the command resolution
+SETTLE_DISTANCE = 0.5
+# Halvings of the jerk range when braking
+JERK_SEARCH_STEPS = 10
+
+
+class MotionLimits(NamedTuple):
+    """
+    Limits of an axis in position units per second, per second² and per second³
+    """
+
+    velocity: float = 2000.0
+    acceleration: float = 20000.0
+    jerk: float = 400000.0
+
+
+def stop_distance(v: float, a: float, acceleration: float, jerk: float) -> float:
+    """
+    Distance covered until standstill from velocity v ≥ 0 and acceleration a,
+    braking as hard as the limits allow. Negative if the axis is already
+    slowing down fast enough to come back.
+    """
+    if v + a * abs(a) / (2 * jerk) <= 0.0:
+        # Only the acceleration has to be brought to zero
+        t = abs(a) / jerk
+        return v * t + a * t * t / 2 - math.copysign(jerk, a) * t * t * t / 6
+    # Ramp the acceleration down to -peak, hold it, then ramp it back to zero
+    peak = min(math.sqrt(jerk * v + a * a / 2), acceleration)
+    t1 = (a + peak) / jerk
+    v1 = v + a * t1 - jerk * t1 * t1 / 2
+    d = v * t1 + a * t1 * t1 / 2 - jerk * t1 * t1 * t1 / 6
+    t2 = max(0.0, (v1 - peak * peak / (2 * jerk)) / peak)
+    d += v1 * t2 - peak * t2 * t2 / 2
+    v1 -= peak * t2
+    t3 = peak / jerk
+    return d + v1 * t3 - peak * t3 * t3 / 2 + jerk * t3 * t3 * t3 / 6
+
+
+def _advance(
+    p: float, v: float, a: float, target: float, limits: MotionLimits, dt: float
+) -> Tuple[float, float, float]:
+    """
+    State of an axis after one tick of dt towards the target
+    """
+    velocity, acceleration, jerk = limits
+    e = target - p
+    s = 1.0 if e >= 0.0 else -1.0
+    # Mirrored so that the target is ahead
+    vm = v * s
+    am = a * s
+    em = e * s
+    dt2 = dt * dt / 2
+    dt3 = dt * dt * dt / 6
+    two_jerk = 2 * jerk
+
+    def safe(j: float) -> bool:
+        a1 = am + j * dt
+        v1 = vm + am * dt + j * dt2
+        if v1 + a1 * abs(a1) / two_jerk > velocity:
+            return False
+        d = vm * dt + am * dt2 + j * dt3
+        return stop_distance(v1, a1, acceleration, jerk) <= em - d
+
+    lo = max(-jerk, (-acceleration - am) / dt)
+    hi = min(jerk, (acceleration - am) / dt)
+    if safe(hi):
+        j = hi
+    elif not safe(lo):
+        j = lo
+    else:
+        for _ in range(JERK_SEARCH_STEPS):
+            mid = (lo + hi) / 2
+            if safe(mid):
+                lo = mid
+            else:
+                hi = mid
+        j = lo
+    j *= s
+    p1 = p + v * dt + a * dt2 + j * dt3
+    v1 = v + a * dt + j * dt2
+    # Snapping zeroes the acceleration within the tick, only if the jerk allows
+    if (
+        abs(target - p1) < SETTLE_DISTANCE
+        and abs(v1) < jerk * dt * dt
+        and abs(a) <= jerk * dt
+    ):
+        return target, 0.0, 0.0
+    return p1, v1, a + j * dt
+
+
+def _clamp(value: float) -> float:
+    return min(max(float(value), POSITION_MIN), POSITION_MAX)
+
+
+class TrajectoryShaper:
+    """
+    Positions of `axes` axes following their targets within `limits`, one
+    `MotionLimits` for all the axes or one per axis, advanced by `step` once
+    per tick at `rate`. Targets are clamped to the position limits.
+    """
+
+    def __init__(
+        self,
+        limits: Union[MotionLimits, Sequence[MotionLimits]] = MotionLimits(),
+        *,
+        rate: float,
+        axes: int = AXES,
+        initial: Union[float, Sequence[float]] = CENTER,
+    ) -> None:
+        if isinstance(limits, MotionLimits):
+            limits = [limits] * axes
+        if len(limits) != axes:
+            raise ValueError(f"Expected limits for {axes} axes, got {len(limits)}")
+        for lim in limits:
+            if min(lim) <= 0:
+                raise ValueError(f"Invalid motion limits {lim}")
+        self.limits = [MotionLimits(*(float(x) for x in lim)) for lim in limits]
+        self.rate = rate
+        self.dt = 1.0 / rate
+        self.axes = axes
+        self.reset(initial)
+
+    def reset(self, positions: Union[float, Sequence[float]] = CENTER) -> None:
+        """
+        Stop all the axes at positions, which become the targets
+        """
+        if not isinstance(positions, (list, tuple, np.ndarray)):
+            positions = [positions] * self.axes
+        self.positions = [_clamp(p) for p in positions]
+        self.velocities = [0.0] * self.axes
+        self.accelerations = [0.0] * self.axes
+        self.targets = list(self.positions)
+
+    @property
+    def settled(self) -> bool:
+        """
+        All the axes are at rest at their targets
+        """
+        return self.positions == self.targets and not any(self.velocities)
+
+    def set_target(self, targets: Sequence[Optional[float]]) -> None:
+        """
+        New targets, None keeps the target of an axis
+        """
+        for i, target in enumerate(targets):
+            if target is not None:
+                self.targets[i] = _clamp(target)
+
+    def step(self) -> List[int]:
+        """
+        Advance by one tick and return the positions
+        """
+        pos = self.positions
+        vel = self.velocities
+        acc = self.accelerations
+        for i, target in enumerate(self.targets):
+            p = pos[i]
+            if p == target and not vel[i] and not acc[i]:
+                continue
+            pos[i], vel[i], acc[i] = _advance(
+                p, vel[i], acc[i], target, self.limits[i], self.dt
+            )
+        return [round(p) for p in pos]
+
+    def __call__(self, targets: Sequence[Optional[float]]) -> List[int]:
+        """
+        Set the targets and advance by one tick, usable as a stage after
+        the mixer of `smc3.cueing.CueingPipeline`
+        """
+        self.set_target(targets)
+        return self.step()
+
+    def process(self, targets: np.ndarray) -> np.ndarray:
+        """
+        Positions for a block of targets of shape (samples, axes), one per tick,
+        as an integer array of the same shape, the state carries over. Each
+        sample depends on the previous one, the axes are shaped one after
+        another in a tight loop.
+        """
+        targets = np.clip(
+            np.asarray(targets, dtype=np.float64), POSITION_MIN, POSITION_MAX
+        )
+        if targets.ndim != 2 or targets.shape[1] != self.axes:
+            raise ValueError(f"Expected targets of shape (samples, {self.axes})")
+        out = np.empty(targets.shape)
+        dt = self.dt
+        for i in range(self.axes):
+            limits = self.limits[i]
+            p = self.positions[i]
+            v = self.velocities[i]
+            a = self.accelerations[i]
+            column = out[:, i]
+            for k, target in enumerate(targets[:, i].tolist()):
+                if p != target or v or a:
+                    p, v, a = _advance(p, v, a, target, limits, dt)
+                column[k] = p
+            self.positions[i] = p
+            self.velocities[i] = v
+            self.accelerations[i] = a
+        if len(targets):
+            self.targets = targets[-1].tolist()
+        return np.rint(out).astype(np.int64)
+
+
+def hold(times: np.ndarray, targets: np.ndarray, *, rate: float) -> np.ndarray:
+    """
+    Targets of sparse keyframes at increasing times, shape (keyframes, axes),
+    held until the next keyframe and sampled at `rate` from the first one
+    to the last one
+    """
+    times = np.asarray(times, dtype=np.float64)
+    targets = np.asarray(targets)
+    t = times[0] + np.arange(int((times[-1] - times[0]) * rate) + 1) / rate
+    return targets[np.searchsorted(times, t, side="right") - 1]
@@ -0,0 +1,174 @@
+"""
+Connection factories for `Box`.
+
+A connection factory is a coroutine function taking the event loop and a protocol
+factory and returning a (transport, protocol) pair, like
+`loop.create_connection` or `serial_asyncio.create_serial_connection`.
+
+`connection_for` picks a factory by device name:
+
+    /dev/ttyUSB0            serial device
+    tcp://host:port         TCP socket, e.g. a ser2net bridge
+    unix:///path/to/socket  Unix domain socket
+    sim://                  in-process simulator
+"""
+
+import asyncio
+
+from typing import Awaitable, Callable, Tuple
+from urllib.parse import urlsplit
+
+from .protocol import DEFAULT_BAUDRATE
+
+ProtocolFactory = Callable[[], asyncio.Protocol]
+ConnectionFactory = Callable[
+    [asyncio.AbstractEventLoop, ProtocolFactory],
+    Awaitable[Tuple[asyncio.Transport, asyncio.Protocol]],
+]
+
+
+def serial_connection(
+    device: str, baudrate: int = DEFAULT_BAUDRATE
+) -> ConnectionFactory:
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        import serial_asyncio
+
+        from serial import EIGHTBITS, PARITY_NONE, STOPBITS_ONE
+
+        return await serial_asyncio.create_serial_connection(
+            loop,
+            protocol_factory,
+            device,
+            baudrate=baudrate,
+            bytesize=EIGHTBITS,
+            parity=PARITY_NONE,
+            stopbits=STOPBITS_ONE,
+        )
+
+    return connect
+
+
+def tcp_connection(host: str, port: int) -> ConnectionFactory:
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        return await loop.create_connection(protocol_factory, host, port)
+
+    return connect
+
+
+def unix_connection(path: str) -> ConnectionFactory:
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        return await loop.create_unix_connection(protocol_factory, path)
+
+    return connect
+
+
+def simulator_connection(simulator=None, **kwargs) -> ConnectionFactory:
+    """
+    Connect to a `smc3.simulator.Simulator` running in the same loop,
+    keyword arguments are passed to the simulator
+    """
+
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        from .simulator import create_simulator_connection
+
+        return await create_simulator_connection(
+            loop, protocol_factory, simulator, **kwargs
+        )
+
+    return connect
+
+
+class PipeTransport(asyncio.Transport):
+    """
+    One end of an in-memory pipe, data written is delivered to the protocol
+    of the other end on the next loop iteration
+    """
+
+    def __init__(
+        self, loop: asyncio.AbstractEventLoop, protocol: asyncio.Protocol
+    ) -> None:
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self._peer: "PipeTransport" = None
+        self._closing = False
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def get_protocol(self) -> asyncio.Protocol:
+        return self._protocol
+
+    def set_protocol(self, protocol: asyncio.Protocol) -> None:
+        self._protocol = protocol
+
+    def write(self, data) -> None:
+        if self._closing or self._peer is None:
+            return
+        self._loop.call_soon(self._peer._deliver, bytes(data))
+
+    def _deliver(self, data: bytes) -> None:
+        if not self._closing:
+            self._protocol.data_received(data)
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.call_soon(self._protocol.connection_lost, None)
+        if self._peer is not None:
+            self._peer.close()
+
+    def abort(self) -> None:
+        self.close()
+
+
+def pipe_pair(
+    loop: asyncio.AbstractEventLoop,
+    protocol_a: asyncio.Protocol,
+    protocol_b: asyncio.Protocol,
+) -> Tuple[PipeTransport, PipeTransport]:
+    """
+    Connect two protocols with an in-memory pipe
+    """
+    a = PipeTransport(loop, protocol_a)
+    b = PipeTransport(loop, protocol_b)
+    a._peer = b
+    b._peer = a
+    protocol_a.connection_made(a)
+    protocol_b.connection_made(b)
+    return a, b
+
+
+def memory_connection(peer_factory: ProtocolFactory) -> ConnectionFactory:
+    """
+    Connect to a protocol created by `peer_factory` with an in-memory pipe,
+    the peer plays the role of the box
+    """
+
+    async def connect(loop: asyncio.AbstractEventLoop, protocol_factory):
+        protocol = protocol_factory()
+        transport, _ = pipe_pair(loop, protocol, peer_factory())
+        return transport, protocol
+
+    return connect
+
+
+def connection_for(device: str, baudrate: int = DEFAULT_BAUDRATE) -> ConnectionFactory:
+    url = urlsplit(device)
+    if url.scheme == "tcp":
+        if not url.hostname or not url.port:
+            raise ValueError(f"Invalid TCP address {device}, expected tcp://host:port")
+        return tcp_connection(url.hostname, url.port)
+    if url.scheme == "unix":
+        return unix_connection(url.path)
+    if url.scheme == "sim":
+        return simulator_connection(baudrate=baudrate)
+    return serial_connection(device, baudrate)
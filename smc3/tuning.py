@@ -0,0 +1,503 @@
+"""
+Automated PID tuning.
+
+The tuner drives a motor through a `TestProfile` (a sequence of steps followed
+by a chirp) and records the feedback. A plant model, the motor speed at full PWM,
+its time constant and a dead time, is fitted to the recorded response by
+simulating the SMC3 PID loop with the gains used during the test. PID gains are
+then searched against the fitted model, and only the best few candidates are
+confirmed on the box. Candidates are ranked by the mean tracking error, with
+a penalty for overshooting a step by more than `overshoot_limit`.
+
+Model simulations are vectorized over candidates with NumPy and spread over
+a process pool, the event loop keeps running while they are evaluated.
+
+    tuner = AutoTuner(box, MotorNumber.A)
+    result = await tuner.tune()
+    print(result.plant, result.best.gains)
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import multiprocessing
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from .box import Box
+from .loggable import Loggable
+from .protocol import COMMAND_ARG_LIMITS, Motor, Parameter
+from .scheduler import MotionScheduler
+from .simulator import INTEGRAL_LIMIT, PHYSICS_RATE, POSITION_MAX
+
+MODEL_DT = 1.0 / PHYSICS_RATE
+# Telemetry positions are scaled down to 0-255
+FEEDBACK_SCALE = 4
+
+DEFAULT_RATE = 100
+DEFAULT_CONFIRM = 3
+DEFAULT_OVERSHOOT_LIMIT = 0.02
+# Cost added per unit of overshoot beyond the limit, in position units
+OVERSHOOT_PENALTY = 1000.0
+CHUNK_SIZE = 128
+
+GAIN_PARAMS = (Parameter.Kp, Parameter.Ki, Parameter.Kd, Parameter.Ks)
+
+PLANT_SPEEDS = np.geomspace(250.0, 8000.0, 16)
+PLANT_TIME_CONSTANTS = np.geomspace(0.005, 0.5, 12)
+PLANT_DEAD_TIMES = np.array([0.0, 0.002, 0.005, 0.01, 0.02, 0.04])
+
+DEFAULT_GAIN_GRID = {
+    Parameter.Kp: (50, 100, 150, 200, 300, 400, 600, 800, 1000),
+    Parameter.Ki: (0, 10, 50, 100),
+    Parameter.Kd: (0, 50, 100, 200, 400, 600, 1000),
+    Parameter.Ks: (1, 3, 5, 10, 20),
+}
+
+
+class Gains(NamedTuple):
+    kp: int
+    ki: int
+    kd: int
+    ks: int
+
+
+class Limits(NamedTuple):
+    """
+    Fixed parameters of the PID loop
+    """
+
+    pwm_min: int
+    pwm_max: int
+    deadzone: int
+
+
+class PlantModel(NamedTuple):
+    """
+    Motor speed at full PWM in position units per second, time constant of the
+    speed response and dead time in seconds, and the RMS fit error
+    """
+
+    max_speed: float
+    time_constant: float
+    dead_time: float
+    error: float
+
+
+class Candidate(NamedTuple):
+    """
+    PID gains with the cost predicted by the model and the one measured on
+    the box, NaN unless confirmed
+    """
+
+    gains: Gains
+    model_cost: float
+    cost: float = math.nan
+    overshoot: float = math.nan
+
+
+class TuningResult(NamedTuple):
+    motor: Motor
+    plant: PlantModel
+    baseline: Candidate
+    best: Candidate
+    confirmed: List[Candidate]
+
+
+class TestProfile:
+    """
+    Steps between levels around `center` followed by a linear chirp
+    from `chirp_start` to `chirp_end` Hz, positions as a function of the time
+    from the start of the test
+    """
+
+    def __init__(
+        self,
+        *,
+        center: int = 512,
+        amplitude: int = 200,
+        step_duration: float = 1.0,
+        chirp_duration: float = 4.0,
+        chirp_start: float = 0.2,
+        chirp_end: float = 2.0,
+        settle: float = 0.5,
+    ) -> None:
+        lo, hi = COMMAND_ARG_LIMITS[Parameter.Position]
+        if center - amplitude < lo or hi < center + amplitude:
+            raise ValueError(f"Profile {center}±{amplitude} out of range {(lo, hi)}")
+        self.center = center
+        self.amplitude = amplitude
+        self.step_duration = step_duration
+        self.chirp_duration = chirp_duration
+        self.chirp_start = chirp_start
+        self.chirp_end = chirp_end
+        self.settle = settle
+        self.levels = np.array(
+            [
+                center + amplitude,
+                center - amplitude,
+                center + amplitude // 2,
+                center,
+            ]
+        )
+        self.steps_duration = len(self.levels) * step_duration
+
+    @property
+    def duration(self) -> float:
+        return self.steps_duration + self.chirp_duration
+
+    def steps(self) -> List[Tuple[float, float, int, int]]:
+        """
+        (start, end, from, to) of every step
+        """
+        prev = np.concatenate(([self.center], self.levels[:-1]))
+        return [
+            (i * self.step_duration, (i + 1) * self.step_duration, int(a), int(b))
+            for i, (a, b) in enumerate(zip(prev, self.levels))
+        ]
+
+    def __call__(self, t: np.ndarray) -> np.ndarray:
+        t = np.asarray(t, dtype=np.float64)
+        index = np.clip((t // self.step_duration).astype(int), 0, len(self.levels) - 1)
+        tc = np.clip(t - self.steps_duration, 0.0, self.chirp_duration)
+        sweep = (self.chirp_end - self.chirp_start) / (2 * self.chirp_duration)
+        phase = 2 * np.pi * (self.chirp_start * tc + sweep * tc * tc)
+        chirp = self.center + self.amplitude * np.sin(phase)
+        res = np.where(t < self.steps_duration, self.levels[index], chirp)
+        return np.rint(res).astype(int)
+
+    def reference(
+        self, rate: float, dt: float = MODEL_DT
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Model time grid and the target on it, updated at `rate` like the commands
+        """
+        t = np.arange(0.0, self.duration, dt)
+        return t, self(np.floor(t * rate) / rate)
+
+
+def simulate(
+    reference: np.ndarray,
+    plants: np.ndarray,
+    gains: np.ndarray,
+    limits: Limits,
+    x0: float,
+    dt: float = MODEL_DT,
+) -> np.ndarray:
+    """
+    Closed loop response of the SMC3 PID loop to the reference, one row of
+    positions per candidate. `plants` rows are (max_speed, time_constant,
+    dead_time), `gains` rows are (kp, ki, kd, ks), either one broadcasts.
+    """
+    plants = np.atleast_2d(np.asarray(plants, dtype=np.float64))
+    gains = np.atleast_2d(np.asarray(gains, dtype=np.float64))
+    n = max(len(plants), len(gains))
+    speed, tau, dead = (np.broadcast_to(plants[:, i], (n,)) for i in range(3))
+    kp, ki, kd, ks = (np.broadcast_to(gains[:, i], (n,)) for i in range(4))
+    ks = np.maximum(ks, 1.0)
+    alpha = np.minimum(dt / tau, 1.0)
+    delay = np.rint(dead / dt).astype(int)
+    history = int(delay.max()) + 1
+    drives = np.zeros((history, n))
+    columns = np.arange(n)
+
+    pos = np.full(n, float(x0))
+    vel = np.zeros(n)
+    integral = np.zeros(n)
+    last_error = np.zeros(n)
+    dterm = np.zeros(n)
+    out = np.empty((len(reference), n))
+    for i, target in enumerate(reference):
+        error = target - pos
+        dz = np.abs(error) <= limits.deadzone
+        error[dz] = 0.0
+        integral = np.where(
+            dz, 0.0, np.clip(integral + error, -INTEGRAL_LIMIT, INTEGRAL_LIMIT)
+        )
+        dterm += (kd * (error - last_error) - dterm) / ks
+        last_error = error
+        u = (kp * error + ki * integral / 100 + dterm) / 100
+        pwm = np.minimum(np.abs(u), limits.pwm_max)
+        pwm = np.floor(
+            np.where((error != 0) & (pwm < limits.pwm_min), limits.pwm_min, pwm)
+        )
+        drives[i % history] = np.where(u < 0, -pwm, pwm)
+        drive = drives[(i - delay) % history, columns]
+        vel += (drive / 255 * speed - vel) * alpha
+        pos += vel * dt
+        clipped = (pos < 0) | (POSITION_MAX < pos)
+        if clipped.any():
+            np.clip(pos, 0, POSITION_MAX, out=pos)
+            vel[clipped] = 0.0
+        out[i] = pos
+    return out.T
+
+
+def tracking_cost(
+    t: np.ndarray,
+    reference: np.ndarray,
+    position: np.ndarray,
+    profile: TestProfile,
+    overshoot_limit: float = DEFAULT_OVERSHOOT_LIMIT,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cost and the largest step overshoot (fraction of the step) of each row
+    of `position` sampled at times `t`
+    """
+    position = np.atleast_2d(position)
+    iae = np.mean(np.abs(position - reference), axis=1)
+    overshoot = np.zeros(len(position))
+    for t0, t1, a, b in profile.steps():
+        mask = (t0 <= t) & (t < t1)
+        if a == b or not mask.any():
+            continue
+        seg = (position[:, mask] - b) * np.sign(b - a) / abs(b - a)
+        overshoot = np.maximum(overshoot, seg.max(axis=1))
+    cost = iae + OVERSHOOT_PENALTY * np.maximum(overshoot - overshoot_limit, 0.0)
+    return cost, overshoot
+
+
+def _fit_errors(
+    reference: np.ndarray,
+    plants: np.ndarray,
+    gains: Gains,
+    limits: Limits,
+    x0: float,
+    samples: np.ndarray,
+    feedback: np.ndarray,
+) -> np.ndarray:
+    model = simulate(reference, plants, np.array([gains]), limits, x0)
+    return np.sqrt(np.mean(np.square(model[:, samples] - feedback), axis=1))
+
+
+def _gain_costs(
+    reference: np.ndarray,
+    gains: np.ndarray,
+    plant: PlantModel,
+    limits: Limits,
+    x0: float,
+    t: np.ndarray,
+    profile: TestProfile,
+    overshoot_limit: float,
+) -> np.ndarray:
+    model = simulate(reference, np.array([plant[:3]]), gains, limits, x0)
+    return tracking_cost(t, reference, model, profile, overshoot_limit)[0]
+
+
+async def _map_chunks(
+    executor: Executor, fn: Callable, items: np.ndarray, *args
+) -> np.ndarray:
+    """
+    Evaluate `fn` over chunks of `items` in the executor, the chunk is passed
+    as the second argument
+    """
+    loop = asyncio.get_running_loop()
+    first, *rest = args
+    futures = [
+        loop.run_in_executor(executor, fn, first, items[i : i + CHUNK_SIZE], *rest)
+        for i in range(0, len(items), CHUNK_SIZE)
+    ]
+    return np.concatenate(await asyncio.gather(*futures))
+
+
+def gain_grid(grid: dict = None) -> np.ndarray:
+    grid = grid or DEFAULT_GAIN_GRID
+    return np.array(list(itertools.product(*(grid[p] for p in GAIN_PARAMS))))
+
+
+class AutoTuner(Loggable):
+    """
+    Tunes the PID gains of a motor, see the module documentation
+    """
+
+    def __init__(
+        self,
+        box: Box,
+        motor: Motor,
+        *,
+        profile: TestProfile = None,
+        rate: float = DEFAULT_RATE,
+        grid: dict = None,
+        confirm: int = DEFAULT_CONFIRM,
+        overshoot_limit: float = DEFAULT_OVERSHOOT_LIMIT,
+        workers: int = None,
+    ) -> None:
+        super().__init__()
+        self.set_logger(logging.getLogger("TUNER"))
+        if box.threaded:
+            raise ValueError("The tuner must run on the box loop")
+        self.box = box
+        self.motor = motor
+        self.profile = profile or TestProfile()
+        self.rate = rate
+        self.candidates = gain_grid(grid)
+        self.confirm = confirm
+        self.overshoot_limit = overshoot_limit
+        self.workers = workers
+        self.t, self.reference = self.profile.reference(rate)
+
+    async def read_gains(self) -> Gains:
+        values = await self.box.read_params_async(
+            [(self.motor, p) for p in GAIN_PARAMS]
+        )
+        return Gains(*(v[0] for v in values))
+
+    def set_gains(self, gains: Gains) -> None:
+        for p, v in zip(GAIN_PARAMS, gains):
+            self.box.set_parameter(self.motor, p, int(v))
+
+    async def read_limits(self) -> Limits:
+        (pwm_min, pwm_max), (deadzone, _) = await self.box.read_params_async(
+            [(self.motor, Parameter.PWMinMax), (self.motor, Parameter.FBDeadZone)]
+        )
+        return Limits(pwm_min, pwm_max, deadzone)
+
+    async def run_test(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Drive the motor through the profile, returns the feedback sample times
+        relative to the start of the test and the feedback in position units
+        """
+        box = self.box
+        profile = self.profile
+        box.set_position(self.motor, profile.center)
+        await asyncio.sleep(profile.settle)
+
+        origin = None
+
+        def produce(t: float) -> None:
+            nonlocal origin
+            if origin is None:
+                origin = t
+            box.set_position(self.motor, int(profile(t - origin)))
+
+        scheduler = MotionScheduler(produce, rate=self.rate, loop=box.loop)
+        await scheduler.run(profile.duration)
+        # Let the last feedback arrive
+        await asyncio.sleep(0.05)
+        columns = box.telemetry[self.motor].slice(origin, origin + profile.duration)
+        t = np.array(columns["timestamp"]) - origin
+        feedback = np.array(columns["feedback"], dtype=np.float64)
+        return t, feedback * FEEDBACK_SCALE + FEEDBACK_SCALE / 2
+
+    def measure(self, t: np.ndarray, feedback: np.ndarray) -> Tuple[float, float]:
+        reference = self.profile(np.floor(t * self.rate) / self.rate)
+        cost, overshoot = tracking_cost(
+            t, reference, feedback, self.profile, self.overshoot_limit
+        )
+        return float(cost[0]), float(overshoot[0])
+
+    async def identify(
+        self, executor: Executor, gains: Gains, limits: Limits
+    ) -> PlantModel:
+        t, feedback = await self.run_test()
+        if len(t) < 10:
+            raise RuntimeError(f"Not enough feedback from motor {self.motor.name}")
+        samples = np.minimum(np.rint(t / MODEL_DT).astype(int), len(self.t) - 1)
+        x0 = self.profile.center
+
+        async def fit(plants: np.ndarray) -> np.ndarray:
+            return await _map_chunks(
+                executor,
+                _fit_errors,
+                plants,
+                self.reference,
+                gains,
+                limits,
+                x0,
+                samples,
+                feedback,
+            )
+
+        plants = np.array(
+            list(
+                itertools.product(PLANT_SPEEDS, PLANT_TIME_CONSTANTS, PLANT_DEAD_TIMES)
+            )
+        )
+        errors = await fit(plants)
+        speed, tau, dead = plants[np.argmin(errors)]
+        # Refine around the best coarse fit
+        plants = np.array(
+            list(
+                itertools.product(
+                    speed * np.array([0.8, 0.9, 1.0, 1.1, 1.25]),
+                    tau * np.array([0.7, 0.85, 1.0, 1.2, 1.4]),
+                    np.maximum(dead + np.array([-0.002, 0.0, 0.002]), 0.0),
+                )
+            )
+        )
+        errors = await fit(plants)
+        best = np.argmin(errors)
+        return PlantModel(*(float(v) for v in plants[best]), float(errors[best]))
+
+    async def search(
+        self, executor: Executor, plant: PlantModel, limits: Limits
+    ) -> List[Candidate]:
+        costs = await _map_chunks(
+            executor,
+            _gain_costs,
+            self.candidates,
+            self.reference,
+            plant,
+            limits,
+            self.profile.center,
+            self.t,
+            self.profile,
+            self.overshoot_limit,
+        )
+        order = np.argsort(costs)
+        return [
+            Candidate(Gains(*(int(v) for v in self.candidates[i])), float(costs[i]))
+            for i in order
+        ]
+
+    async def evaluate(self, candidate: Candidate) -> Candidate:
+        self.set_gains(candidate.gains)
+        cost, overshoot = self.measure(*await self.run_test())
+        self.log_info(
+            f"{self.motor.name} {candidate.gains}: cost {cost:.2f} "
+            f"(model {candidate.model_cost:.2f}) overshoot {overshoot:.1%}"
+        )
+        return candidate._replace(cost=cost, overshoot=overshoot)
+
+    async def tune(self) -> TuningResult:
+        """
+        Identify the plant, search the gains and confirm the best candidates.
+        The best confirmed gains, possibly the original ones, are left set
+        but not saved.
+        """
+        box = self.box
+        original = await self.read_gains()
+        limits = await self.read_limits()
+        box.enable_feedback(self.motor)
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(self.workers, mp_context=context) as executor:
+                self.log_info(f"Identifying motor {self.motor.name} with {original}")
+                plant = await self.identify(executor, original, limits)
+                self.log_info(f"{self.motor.name} {plant}")
+                ranked = await self.search(executor, plant, limits)
+
+            model = simulate(
+                self.reference,
+                np.array([plant[:3]]),
+                np.array([original]),
+                limits,
+                self.profile.center,
+            )
+            model_cost, _ = tracking_cost(
+                self.t, self.reference, model, self.profile, self.overshoot_limit
+            )
+            baseline = await self.evaluate(Candidate(original, float(model_cost[0])))
+            confirmed = [baseline]
+            for candidate in ranked[: self.confirm]:
+                confirmed.append(await self.evaluate(candidate))
+        finally:
+            box.disable_feedback()
+
+        best = min(confirmed, key=lambda c: c.cost)
+        self.set_gains(best.gains)
+        return TuningResult(self.motor, plant, baseline, best, confirmed)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import logging
+import os
+
+from termcolor import cprint
+
+from smc3 import Box, DEFAULT_BAUDRATE
+from smc3.daemon import Daemon
+from smc3.metrics import MetricsRegistry, serve_prometheus
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+DEFAULT_SOCKET = "/tmp/smc3d.sock"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Share an SMC3 box among several clients"
+    )
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
+    )
+    parser.add_argument(
+        "-u",
+        "--unix",
+        default=DEFAULT_SOCKET,
+        help="Unix socket path, clients connect to unix://PATH",
+    )
+    parser.add_argument(
+        "-t", "--tcp", help="Listen on HOST:PORT, clients connect to tcp://HOST:PORT"
+    )
+    parser.add_argument(
+        "-s", "--stats", type=float, default=0, help="Print statistics every N seconds"
+    )
+    parser.add_argument(
+        "-m", "--metrics", help="Serve Prometheus metrics over HTTP on HOST:PORT"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    box = Box(device=args.device, baudrate=args.baudrate, loop=loop)
+    v = box.get_version()
+    cprint(f"SMC3 Version: {v / 100}", "red")
+
+    daemon = Daemon(box)
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        loop.run_until_complete(daemon.serve_unix(args.unix))
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(":")
+        loop.run_until_complete(daemon.serve_tcp(host or "localhost", int(port)))
+    if args.metrics:
+        registry = MetricsRegistry()
+        registry.register(box.metrics, device=box.device)
+        registry.register(daemon.metrics, device=box.device)
+        host, _, port = args.metrics.rpartition(":")
+        loop.run_until_complete(
+            serve_prometheus(registry, host or "localhost", int(port))
+        )
+        cprint(f"Metrics on http://{host or 'localhost'}:{port}/metrics", "green")
+
+    def print_stats() -> None:
+        for k, v in daemon.stats().items():
+            cprint(f"{k:12s} {v}", "yellow")
+        if args.stats:
+            loop.call_later(args.stats, print_stats)
+
+    if args.stats:
+        loop.call_later(args.stats, print_stats)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        daemon.close()
+        box.delay(0.1)
+        print_stats()
+    finally:
+        box.close()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import asyncio
+
+from smc3.box import Box
+from smc3.protocol import POSITIONS_FRAME_LEN, Motor
+from smc3.simulator import Simulator, create_simulator_connection
+
+
+async def _until(condition, timeout: float = 1.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def test_set_positions_with_buffer_while_disconnected():
+    async def run() -> None:
+        simulator = Simulator(loop=asyncio.get_running_loop())
+        transports = []
+        up = True
+
+        async def connect(loop, protocol_factory):
+            if not up:
+                raise ConnectionRefusedError()
+            transport, protocol = await create_simulator_connection(
+                loop, protocol_factory, simulator
+            )
+            transports.append(transport)
+            return transport, protocol
+
+        box = await Box.open(
+            connection=connect, reconnect_delay=0.01, max_reconnect_delay=0.05
+        )
+        buffer = bytearray(POSITIONS_FRAME_LEN)
+        box.enable_motors()
+        box.set_positions(a=100, b=100, buffer=buffer)
+
+        up = False
+        transports[-1].close()
+        await _until(lambda: not box.connected)
+        box.set_positions(a=200, b=300, buffer=buffer)
+        box.set_positions(a=250, buffer=buffer)
+
+        up = True
+        await _until(lambda: box.connected)
+        await box.drain_async()
+        await _until(lambda: simulator.axis(Motor.A).target == 250)
+        assert simulator.axis(Motor.B).target == 300
+        assert simulator.axis(Motor.A).enabled
+        box.close()
+
+    asyncio.run(run())
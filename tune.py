@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+
+from termcolor import cprint
+
+from smc3 import Box, MotorNumber, DEFAULT_BAUDRATE
+from smc3.tuning import (
+    AutoTuner,
+    TestProfile,
+    DEFAULT_CONFIRM,
+    DEFAULT_OVERSHOOT_LIMIT,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)-8s - %(levelname)-7s - %(message)s",
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the PID gains of a motor")
+    parser.add_argument(
+        "-b", "--baudrate", type=int, default=DEFAULT_BAUDRATE, help="UART baud rate"
+    )
+    parser.add_argument(
+        "-a", "--amplitude", type=int, default=200, help="Test steps amplitude"
+    )
+    parser.add_argument(
+        "-c",
+        "--confirm",
+        type=int,
+        default=DEFAULT_CONFIRM,
+        help="Best candidates confirmed on the box",
+    )
+    parser.add_argument(
+        "-o",
+        "--overshoot",
+        type=float,
+        default=DEFAULT_OVERSHOOT_LIMIT,
+        help="Acceptable overshoot, fraction of the step",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, help="Worker processes, all CPUs by default"
+    )
+    parser.add_argument(
+        "-s", "--save", action="store_true", help="Save the tuned gains on the box"
+    )
+    parser.add_argument(
+        "device", help="USB device or tcp://host:port, unix:///path, sim://"
+    )
+    parser.add_argument("motor", choices=["A", "B", "C"], help="Motor to tune")
+    args = parser.parse_args()
+
+    logging.getLogger("PROTO").setLevel(logging.INFO)
+    box = Box(device=args.device, baudrate=args.baudrate)
+    motor = MotorNumber.__members__[args.motor]
+    tuner = AutoTuner(
+        box,
+        motor,
+        profile=TestProfile(amplitude=args.amplitude),
+        confirm=args.confirm,
+        overshoot_limit=args.overshoot,
+        workers=args.workers,
+    )
+    result = box.loop.run_until_complete(tuner.tune())
+
+    plant = result.plant
+    cprint(
+        f"Plant: speed {plant.max_speed:.0f}/s time constant "
+        f"{plant.time_constant * 1000:.1f}ms dead time {plant.dead_time * 1000:.1f}ms "
+        f"(fit error {plant.error:.1f})",
+        "cyan",
+    )
+    for c in result.confirmed:
+        color = c is result.best and "green" or "white"
+        cprint(
+            f"Kp {c.gains.kp:4d} Ki {c.gains.ki:4d} Kd {c.gains.kd:4d} Ks {c.gains.ks:2d}"
+            f"  cost {c.cost:7.2f} model {c.model_cost:7.2f} overshoot {c.overshoot:.1%}",
+            color,
+        )
+    if result.best is result.baseline:
+        cprint("The original gains are the best", "yellow")
+    elif args.save:
+        box.save_settings()
+        box.delay(0.1)
+        cprint("Saved", "green")
+    box.close()
+
+
+if __name__ == "__main__":
+    main()